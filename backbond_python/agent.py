@@ -3,12 +3,23 @@ import os
 import json
 
 from langgraph.graph import START, END, MessagesState, StateGraph
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.tools import StructuredTool
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import ToolNode
 from langchain_openai import ChatOpenAI
 
-from agent_tools import get_search_result, get_traffic_info,get_single_attraction
+from agent_tools import get_search_result, get_traffic_info,get_single_attraction, to_async_tool
+from utils.tracing import tracer
+from utils.cassette import cassette
+from utils.concurrency import get_limiter
+from utils.llm_cache import llm_cache
+from utils.prompt_builder import compile_prompt, current_time_text, prompt_cache_stats
+from utils.usage import usage_tracker
+from utils.model_router import model_router
+from utils.rate_limit import get_guard, estimate_tokens
+from utils.message_compaction import compact_messages, TOOL_CONTEXT_BUDGET, TOOL_RESULT_DIGEST_CHARS
+from utils.structured_output import structured_output, response_format, is_unsupported_error
 from config import (
     ATTRACTIONS_PROMPT,
     PLAN_PROMPT,
@@ -21,9 +32,12 @@ from config import (
     SINGLE_ATTRACTIONS_PROMPT,
 )
 import os
+import re
+import asyncio
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 import time
-current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 # 加载 .env 文件
 load_dotenv()
 
@@ -48,15 +62,37 @@ def clean_json_markdown(text: str) -> str:
     return text.strip()
 
 
+# 影响模型输出的生成参数，参与请求签名
+MODEL_PARAM_FIELDS = ("temperature", "max_tokens", "top_p", "frequency_penalty", "presence_penalty", "seed", "stop",
+                      "model_kwargs")
+
+
 class Agent():
+    # 智能体名称，用于模型路由、缓存、用量统计和追踪，子类覆盖
+    name = "Agent"
+    # 是否使用LLM响应缓存，子类可设为 False 退出（也可通过 LLM_CACHE_DISABLED_AGENTS 配置）
+    use_llm_cache = True
+    error_message = "处理失败"
+    # 编译后的系统提示词（utils.prompt_builder），为 None 时只发送用户消息
+    prompt = None
+    # 结构化输出使用的 JSON Schema 名称（utils.structured_output.OUTPUT_SCHEMAS），为 None 时按文本输出
+    output_schema = None
+
     def __init__(self):
-        self.name = "Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
+        self.init_models()
+    def init_models(self):
+        """
+        按 utils.model_router 的路由配置为当前智能体创建模型链
+        self.chat_model 为主模型，self.model_chain 为 [主模型, 备用模型...]
+        重试由 utils.rate_limit 统一处理，客户端默认不再自行重试（路由配置中可设置 max_retries 覆盖）
+        """
+        self.model_chain = [ChatOpenAI(name=self.name, **{"max_retries": 0, **params}) for params in model_router.route(self.name)]
+        self.chat_model = self.model_chain[0]
+    def resolve_chain(self, model):
+        """invoke_model 的 model 参数：None 使用智能体的模型链，列表为自定义的模型链，单个模型不回退"""
+        if model is None:
+            return self.model_chain
+        return list(model) if isinstance(model, (list, tuple)) else [model]
     def should_use_tool(self, state):
         """
         判断是否需要使用工具
@@ -67,38 +103,315 @@ class Agent():
         if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
             return "tool"
         return END        
+    def invoke_model(self, messages, model=None):
+        """
+        统一的模型调用入口，所有智能体的LLM调用都经过这里
+        
+        Args:
+            messages: 消息列表
+            model: 要调用的模型或模型链（例如绑定了工具的模型），默认使用智能体的模型链
+                   模型链中前一个模型调用失败时依次尝试下一个
+        每个模型的调用经过 utils.rate_limit 的限速、退避重试和熔断，每次尝试占用一个 llm 并发名额
+        """
+        chain = self.resolve_chain(model)
+        request = self.request_signature(messages, chain[0])
+        use_cache = self.use_llm_cache and llm_cache.enabled_for(self.name)
+        with tracer.span("llm.invoke", agent=self.name) as span:
+            if use_cache:
+                cached = llm_cache.lookup(self.name, request)
+                if cached is not None:
+                    return self.cached_response(request, cached, span)
+            start = time.time()
+            estimate = estimate_tokens(messages)
+            for index, candidate in enumerate(chain):
+                candidate_request = self.request_signature(messages, candidate)
+                guard = get_guard(candidate_request["model"])
+                try:
+                    response = cassette.call(
+                        "llm",
+                        candidate_request,
+                        lambda: guard.call(lambda: candidate.invoke(messages), estimate, limiter=get_limiter("llm")),
+                        serialize=message_to_dict,
+                        deserialize=lambda data: messages_from_dict([data])[0],
+                    )
+                    break
+                except Exception as e:
+                    self.handle_model_failure(chain, index, e, span)
+            self.record_usage(candidate_request, response, span)
+            if use_cache:
+                llm_cache.save(self.name, request, message_to_dict(response), time.time() - start)
+            return response
+    async def ainvoke_model(self, messages, model=None):
+        """
+        invoke_model 的异步版本，等待并发名额和模型响应时不占用线程
+        缓存读写是本地 SQLite 操作，放到线程池中执行
+        """
+        chain = self.resolve_chain(model)
+        request = self.request_signature(messages, chain[0])
+        use_cache = self.use_llm_cache and llm_cache.enabled_for(self.name)
+        with tracer.span("llm.invoke", agent=self.name, mode="async") as span:
+            if use_cache:
+                cached = await asyncio.to_thread(llm_cache.lookup, self.name, request)
+                if cached is not None:
+                    return self.cached_response(request, cached, span)
+            start = time.time()
+            estimate = estimate_tokens(messages)
+            for index, candidate in enumerate(chain):
+                candidate_request = self.request_signature(messages, candidate)
+                guard = get_guard(candidate_request["model"])
+                try:
+                    response = await cassette.acall(
+                        "llm",
+                        candidate_request,
+                        lambda: guard.acall(lambda: candidate.ainvoke(messages), estimate, limiter=get_limiter("llm")),
+                        serialize=message_to_dict,
+                        deserialize=lambda data: messages_from_dict([data])[0],
+                    )
+                    break
+                except Exception as e:
+                    self.handle_model_failure(chain, index, e, span)
+            self.record_usage(candidate_request, response, span)
+            if use_cache:
+                await asyncio.to_thread(llm_cache.save, self.name, request, message_to_dict(response), time.time() - start)
+            return response
+    def handle_model_failure(self, chain, index, error, span=None):
+        """模型链中的模型调用失败：还有备用模型时记录后继续，否则抛出异常"""
+        failed = getattr(getattr(chain[index], "bound", chain[index]), "model_name", None)
+        if index == len(chain) - 1:
+            raise error
+        print(f"{self.name} 模型 {failed} 调用失败，切换到备用模型: {str(error)}")
+        if span is not None:
+            span.set_attribute("fallback_from", failed)
+            span.set_attribute("fallback_error", str(error))
+    def cached_response(self, request, cached, span=None):
+        """把缓存中的响应还原为消息，并标记为缓存命中"""
+        if span is not None:
+            span.set_attribute("llm_cache", "hit")
+        response = messages_from_dict([cached])[0]
+        response.response_metadata["llm_cache_hit"] = True
+        usage_tracker.record(self.name, request["model"], response, cache_hit=True)
+        return response
+    def record_usage(self, request, response, span=None):
+        """记录本次调用的 token 用量和费用（按智能体、阶段、任务汇总），以及服务端前缀缓存命中情况"""
+        prompt_cache_stats.record(self.name, response)
+        usage = usage_tracker.record(self.name, request["model"], response)
+        if span is not None:
+            span.set_attribute("model", request["model"])
+            span.set_attribute("input_tokens", usage["input"])
+            span.set_attribute("output_tokens", usage["output"])
+            if usage["cost"] is not None:
+                span.set_attribute("cost", round(usage["cost"], 6))
+    def request_signature(self, messages, model):
+        """
+        生成请求描述，用于录制/回放和响应缓存：模型、绑定的工具和消息内容（不含随机生成的消息id）
+        """
+        normalized = []
+        for message in messages:
+            if isinstance(message, BaseMessage):
+                normalized.append({
+                    "role": message.type,
+                    "content": message.content,
+                    "tool_calls": [{"name": call["name"], "args": call["args"]} for call in getattr(message, "tool_calls", None) or []],
+                    "tool_call_id": getattr(message, "tool_call_id", None),
+                })
+            else:
+                normalized.append({"role": message.get("role"), "content": message.get("content")})
+        bound = getattr(model, "bound", model)
+        kwargs = getattr(model, "kwargs", {})
+        tools = kwargs.get("tools", [])
+        signature = {
+            "agent": self.name,
+            "model": getattr(bound, "model_name", None),
+            "tools": [tool.get("function", {}).get("name") for tool in tools if isinstance(tool, dict)],
+            "messages": normalized,
+        }
+        # 结构化输出的请求与文本请求分开缓存/录制（包含 schema，schema 变化后不会命中旧的响应）
+        if kwargs.get("response_format"):
+            signature["response_format"] = kwargs["response_format"]
+        # 路由配置中的生成参数（temperature、max_tokens 等）和 bind 的其他参数不同时分开缓存
+        params = {key: getattr(bound, key, None) for key in MODEL_PARAM_FIELDS}
+        params.update({key: value for key, value in kwargs.items() if key not in ("tools", "response_format")})
+        params = {key: value for key, value in params.items() if value not in (None, {})}
+        if params:
+            signature["params"] = params
+        return signature
+    def prompt_values(self):
+        """
+        系统提示词末尾的可变值（如当前时间），在每次请求时计算
+        """
+        return {}
+    def build_messages(self, message: str):
+        """
+        构造发送给模型的消息：静态前缀相同的系统提示词 + 用户消息
+        """
+        messages = []
+        if self.prompt is not None:
+            messages.append({"role": "system", "content": self.prompt.render(**self.prompt_values())})
+        messages.append({"role": "user", "content": message})
+        return messages
+    def structured_chains(self):
+        """
+        按优先级返回 [(模式, 绑定了 response_format 的模型链)]
+        没有设置 output_schema、关闭了结构化输出或主模型都不支持时返回空列表
+        """
+        if not self.output_schema:
+            return []
+        model_name = self.chat_model.model_name
+        return [(mode, [model.bind(response_format=response_format(self.output_schema, mode)) for model in self.model_chain])
+                for mode in structured_output.modes_for(model_name)]
+    def structured_unsupported(self, mode, error):
+        """调用失败是否因为服务端不支持该结构化输出模式，是则记录下来，之后不再尝试"""
+        if not is_unsupported_error(error):
+            return False
+        structured_output.mark_unsupported(self.chat_model.model_name, mode, error)
+        return True
+    def invoke_structured(self, messages):
+        """
+        使用服务端的结构化输出（JSON Schema / JSON 模式）调用模型
+        返回 (响应, 解析后的字典)；服务端不支持时返回 (None, None)，由调用方按文本方式调用
+        响应不是合法的 JSON 对象时字典为 None，调用方用原来的解析方式处理该响应
+        """
+        for mode, chain in self.structured_chains():
+            try:
+                response = self.invoke_model(messages, chain)
+            except Exception as e:
+                if self.structured_unsupported(mode, e):
+                    continue
+                raise
+            return response, structured_output.parse(response.content)
+        return None, None
+    async def ainvoke_structured(self, messages):
+        """
+        invoke_structured 的异步版本
+        """
+        for mode, chain in self.structured_chains():
+            try:
+                response = await self.ainvoke_model(messages, chain)
+            except Exception as e:
+                if self.structured_unsupported(mode, e):
+                    continue
+                raise
+            return response, structured_output.parse(response.content)
+        return None, None
+    def parse_response(self, response):
+        """
+        从模型响应中取出结果
+        """
+        return response.content
     def run(self, message: str):
         try:
-            response = self.chat_model.invoke([{"role": "user", "content": message}])
-            return response.content
+            messages = self.build_messages(message)
+            response, data = self.invoke_structured(messages)
+            if data is not None:
+                return data
+            if response is None:
+                response = self.invoke_model(messages)
+            return self.parse_response(response)
         except Exception as e:
-            return json.dumps({"error": f"处理失败: {str(e)}"})
+            return json.dumps({"error": f"{self.error_message}: {str(e)}"}, ensure_ascii=False)
+    async def arun(self, message: str):
+        """
+        run 的异步版本
+        """
+        try:
+            messages = self.build_messages(message)
+            response, data = await self.ainvoke_structured(messages)
+            if data is not None:
+                return data
+            if response is None:
+                response = await self.ainvoke_model(messages)
+            return self.parse_response(response)
+        except Exception as e:
+            return json.dumps({"error": f"{self.error_message}: {str(e)}"}, ensure_ascii=False)
 
 
 class Seperate_Task_Agent(Agent):
+    name = "Seperate_Task_Agent"
+    output_schema = "tasks"
+
     def __init__(self):
         super().__init__()
-        self.name = "Seperate_Task_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.task_system_prompt = TASK_SEPARATE_PROMPT["prompt"]
-    
+        self.prompt = compile_prompt(TASK_SEPARATE_PROMPT)
+
+    # 任务分解缓存（进程内共享，LRU）: {规范化后的用户需求: 任务分解结果JSON字符串}
+    _task_cache = OrderedDict()
+    _task_cache_lock = threading.Lock()
+    _task_cache_size = int(os.getenv("TASK_CACHE_SIZE", "256"))
+
+    @staticmethod
+    def normalize_message(user_message: str) -> str:
+        """
+        规范化用户需求，作为任务分解缓存的键
+        统一全角/半角标点、去除多余空白并转为小写
+        """
+        text = user_message.strip().lower()
+        text = text.translate(str.maketrans("，。：；！？（）【】“”‘’", ",.:;!?()[]\"\"''"))
+        text = re.sub(r"\s+", "", text)
+        return text
+
+    def cached_tasks(self, cache_key):
+        with self._task_cache_lock:
+            if cache_key in self._task_cache:
+                self._task_cache.move_to_end(cache_key)
+                return self._task_cache[cache_key]
+        return None
+
+    def remember_tasks(self, cache_key, content):
+        # 只缓存能解析出任务列表的结果，避免把失败结果固化下来
+        try:
+            if json.loads(content).get("tasks"):
+                with self._task_cache_lock:
+                    self._task_cache[cache_key] = content
+                    self._task_cache.move_to_end(cache_key)
+                    while len(self._task_cache) > self._task_cache_size:
+                        self._task_cache.popitem(last=False)
+        except (json.JSONDecodeError, AttributeError):
+            pass
+
     def analyze_task(self, user_message: str):
         """
-        分析用户需求并分解为具体任务
+        分析用户需求并分解为具体任务，相同需求直接返回缓存结果
+        """
+        cache_key = self.normalize_message(user_message)
+        cached = self.cached_tasks(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            messages = self.build_messages(user_message)
+            response, data = self.invoke_structured(messages)
+            if response is None:
+                response = self.invoke_model(messages)
+        except Exception as e:
+            return json.dumps({"error": f"任务分析失败: {str(e)}"})
+        content = self.task_content(response, data)
+        self.remember_tasks(cache_key, content)
+        return content
+
+    @staticmethod
+    def task_content(response, data):
+        """任务分解结果统一为JSON字符串，结构化输出已解析的结果直接序列化"""
+        if data is not None:
+            return json.dumps(data, ensure_ascii=False)
+        return clean_json_markdown(response.content)
+
+    async def aanalyze_task(self, user_message: str):
+        """
+        analyze_task 的异步版本
         """
+        cache_key = self.normalize_message(user_message)
+        cached = self.cached_tasks(cache_key)
+        if cached is not None:
+            return cached
         try:
-            response = self.chat_model.invoke([
-                {"role": "system", "content": self.task_system_prompt},
-                {"role": "user", "content": user_message}
-            ])
-            return response.content
+            messages = self.build_messages(user_message)
+            response, data = await self.ainvoke_structured(messages)
+            if response is None:
+                response = await self.ainvoke_model(messages)
         except Exception as e:
             return json.dumps({"error": f"任务分析失败: {str(e)}"})
+        content = self.task_content(response, data)
+        self.remember_tasks(cache_key, content)
+        return content
     
     def generate_tasks(self, user_message: str):
         """
@@ -113,375 +426,320 @@ class Seperate_Task_Agent(Agent):
         """
         return self.generate_tasks(message)
 
-class Single_Agent(Agent):
+    async def arun(self, message: str):
+        return await self.aanalyze_task(message)
+
+# 工具循环预算用完后追加的提示，要求模型直接给出最终答案
+FORCE_FINAL_ANSWER_PROMPT = "工具调用次数已达上限，请不要再调用工具，直接根据已获取的信息按要求的格式给出最终答案。"
+
+
+def memoized_tool(tool, memo, run_stats):
     """
-    单一景点智能体
+    同一次运行内参数相同的工具调用直接返回之前的结果
+    memo 和 run_stats 由调用方为每次运行单独创建；抛出异常的调用不缓存
     """
-    def __init__(self):
-        super().__init__()
-        self.name = "Single_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.attractions_prompt = SINGLE_ATTRACTIONS_PROMPT["prompt"]
+    def memo_key(kwargs):
+        return f"{tool.name}:{json.dumps(kwargs, ensure_ascii=False, sort_keys=True, default=str)}"
+
+    def lookup(key):
+        if key in memo:
+            run_stats["memo_hits"] += 1
+            return True, memo[key]
+        run_stats["tool_calls"] += 1
+        return False, None
+
+    def func(**kwargs):
+        key = memo_key(kwargs)
+        hit, result = lookup(key)
+        if not hit:
+            result = memo[key] = tool.func(**kwargs)
+        return result
+
+    async def coroutine(**kwargs):
+        key = memo_key(kwargs)
+        hit, result = lookup(key)
+        if not hit:
+            result = memo[key] = await tool.coroutine(**kwargs)
+        return result
+
+    return StructuredTool.from_function(func=func, coroutine=coroutine, name=tool.name,
+                                        description=tool.description, args_schema=tool.args_schema)
+
+
+class Tool_Agent(Agent):
+    """
+    使用工具的智能体基类：agent → tool → agent 循环，直到模型不再调用工具或用完预算
+    子类需要设置 name、prompt、tools 和 error_message
+    """
+    tools = [get_search_result]
+    error_message = "处理失败"
+    # 每次运行的预算：模型调用轮数和工具调用次数，可通过 TOOL_MAX_ITERATIONS_<智能体名> / TOOL_MAX_CALLS_<智能体名> 单独配置
+    max_iterations = int(os.getenv("TOOL_MAX_ITERATIONS", "6"))
+    max_tool_calls = int(os.getenv("TOOL_MAX_CALLS", "8"))
+    # 发送给模型的上下文预算（估算 token 数），超出时压缩已使用过的工具结果，可通过 TOOL_CONTEXT_BUDGET_<智能体名> 单独配置
+    context_budget = TOOL_CONTEXT_BUDGET
+
+    def prompt_values(self):
+        return {"time": current_time_text()}
+
     def should_use_tool(self, state):
         """
         判断是否需要使用工具
         """
         last_message = state["messages"][-1]
-        print("Single_Agent_last_message:",last_message)
+        print(f"{self.name}_last_message:", last_message)
         # 检查消息是否有tool_calls属性
         if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
             return "tool"
         return END
-    def tool_model(self, message, model):
+
+    def tool_budget(self):
+        """返回 (最大模型调用轮数, 最大工具调用次数)"""
+        name = self.name.upper()
+        return (int(os.getenv(f"TOOL_MAX_ITERATIONS_{name}", self.max_iterations)),
+                int(os.getenv(f"TOOL_MAX_CALLS_{name}", self.max_tool_calls)))
+
+    def compaction_budget(self):
+        """返回 (上下文预算, 工具结果摘要的最大字符数)"""
+        name = self.name.upper()
+        return (int(os.getenv(f"TOOL_CONTEXT_BUDGET_{name}", self.context_budget)),
+                int(os.getenv(f"TOOL_RESULT_DIGEST_CHARS_{name}", TOOL_RESULT_DIGEST_CHARS)))
+
+    @staticmethod
+    def new_run_stats():
+        return {"iterations": 0, "tool_calls": 0, "memo_hits": 0, "forced_final": False,
+                "compacted_results": 0, "compaction_saved_tokens": 0}
+
+    def build_graph(self, model, asynchronous=False, run_stats=None):
+        """
+        创建 agent → tool 循环的状态图
+        asynchronous 为 True 时模型和工具都以异步方式调用（工具的同步实现在线程池中执行）
+        图只用于一次运行：相同参数的工具调用在本次运行内只执行一次；
+        轮数或工具调用次数用完后，最后一轮不再允许调用工具，强制模型给出最终答案
+        每轮发送前按上下文预算压缩模型已经使用过的工具结果，图的状态中仍保留完整历史
+        """
+        run_stats = run_stats if run_stats is not None else self.new_run_stats()
+        max_iterations, max_tool_calls = self.tool_budget()
+        context_budget, digest_chars = self.compaction_budget()
+        memo = {}
+        tools = [memoized_tool(to_async_tool(item), memo, run_stats) for item in self.tools]
         # 绑定搜索工具和知识库工具
-        tool_model = model.bind_tools([get_search_result])
-        tool_node = ToolNode([get_search_result])
-        
+        chain = self.resolve_chain(model)
+        tool_model = [item.bind_tools(tools) for item in chain]
+        final_model = [item.bind_tools(tools, tool_choice="none") for item in chain]
+        tool_node = ToolNode(tools)
+
+        def prepare(messages):
+            """返回本轮 (调用的模型, 发送的消息, 剩余的工具调用次数)"""
+            iteration = sum(1 for m in messages if getattr(m, "type", None) == "ai") + 1
+            used_calls = sum(len(getattr(m, "tool_calls", None) or []) for m in messages if getattr(m, "type", None) == "ai")
+            run_stats["iterations"] = iteration
+            request_messages, compacted, saved_tokens = compact_messages(messages, context_budget, digest_chars)
+            run_stats["compacted_results"] = max(run_stats["compacted_results"], compacted)
+            run_stats["compaction_saved_tokens"] += saved_tokens
+            if iteration >= max_iterations or used_calls >= max_tool_calls:
+                run_stats["forced_final"] = True
+                return final_model, request_messages + [HumanMessage(content=FORCE_FINAL_ANSWER_PROMPT)], 0
+            return tool_model, request_messages, max_tool_calls - used_calls
+
+        def finish(span, response, remaining_calls):
+            tool_calls = getattr(response, "tool_calls", None) or []
+            if len(tool_calls) > remaining_calls:
+                # 超出预算的工具调用直接丢弃；预算为 0 时模型仍返回了工具调用，只保留文本内容
+                response = AIMessage(content=response.content, tool_calls=tool_calls[:remaining_calls],
+                                     response_metadata=response.response_metadata,
+                                     usage_metadata=getattr(response, "usage_metadata", None))
+            if span is not None:
+                span.set_attribute("forced_final", remaining_calls == 0)
+                if response.tool_calls:
+                    span.set_attribute("tool_calls", [call["name"] for call in response.tool_calls])
+            return response
+
+        def iteration_span(messages):
+            return tracer.span(f"{self.name}.iteration", iteration=run_stats["iterations"], messages=len(messages))
+
         # 创建一个包装函数来处理状态
         def agent_node(state):
             # 从状态中获取消息并传递给tool_model
             messages = state["messages"]
-            # 调用tool_model并获取响应
-            response = tool_model.invoke(messages)
+            current_model, request_messages, remaining_calls = prepare(messages)
+            with iteration_span(messages) as span:
+                # 调用tool_model并获取响应
+                response = finish(span, self.invoke_model(request_messages, current_model), remaining_calls)
             # 返回新的状态
             return {"messages": messages + [response]}
-        
-        # 初始状态
-        initial_state = {
-            "messages": [
-                {"role": "system", "content": self.attractions_prompt.format(time=current_time)},
-                {"role": "user", "content": message}
-            ]
-        }
-        
+
+        async def async_agent_node(state):
+            messages = state["messages"]
+            current_model, request_messages, remaining_calls = prepare(messages)
+            with iteration_span(messages) as span:
+                response = finish(span, await self.ainvoke_model(request_messages, current_model), remaining_calls)
+            return {"messages": messages + [response]}
+
         # 创建状态图
         graph = StateGraph(MessagesState)
-        graph.add_node("agent", agent_node)
+        graph.add_node("agent", async_agent_node if asynchronous else agent_node)
         graph.add_node("tool", tool_node)
         graph.add_edge(START, "agent")
         graph.add_conditional_edges("agent", self.should_use_tool, ["tool", END])
         graph.add_edge("tool", "agent")
-        
-        # 编译并运行
-        app = graph.compile()
-        return app.invoke(initial_state)
-    
+        return graph.compile()
+
+    def initial_state(self, message):
+        return {"messages": self.build_messages(message)}
+
+    def tool_model(self, message, model, run_stats=None):
+        return self.build_graph(model, run_stats=run_stats).invoke(self.initial_state(message))
+
+    async def atool_model(self, message, model, run_stats=None):
+        return await self.build_graph(model, asynchronous=True, run_stats=run_stats).ainvoke(self.initial_state(message))
+
+    @staticmethod
+    def record_run_stats(span, run_stats):
+        if span is not None:
+            for key, value in run_stats.items():
+                span.set_attribute(key, value)
+
+    @staticmethod
+    def final_content(result):
+        # 从结果中获取最终消息 - result 是一个字典，包含 "messages" 键
+        if isinstance(result, dict) and "messages" in result:
+            messages = result["messages"]
+            if messages and len(messages) > 0:
+                last_message = messages[-1]
+                # 从最后一条消息中获取内容
+                if hasattr(last_message, 'content'):
+                    return last_message.content
+                elif isinstance(last_message, dict) and 'content' in last_message:
+                    return last_message['content']
+        return result
+
     def run(self, message: str):
+        """
+        返回最后一条消息的内容（字符串），不再返回图的完整状态，
+        阶段检查点和 Plan_Agent 的输入中只保留最终答案；失败时返回包含 error 的 JSON 字符串
+        """
+        try:
+            run_stats = self.new_run_stats()
+            with tracer.span(f"agent.{self.name}") as span:
+                # 调用tool_model获取结果
+                result = self.tool_model(message, self.model_chain, run_stats)
+                self.record_run_stats(span, run_stats)
+            return self.final_content(result)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return json.dumps({"error": f"{self.error_message}: {str(e)}"}, ensure_ascii=False)
+
+    async def arun(self, message: str):
         try:
-            # 调用tool_model获取结果
-            result = self.tool_model(message, self.chat_model)
-            # 从结果中获取最终消息 - result 是一个字典，包含 "messages" 键
-            if isinstance(result, dict) and "messages" in result:
-                messages = result["messages"]
-                if messages and len(messages) > 0:
-                    last_message = messages[-1]
-                    # 从最后一条消息中获取内容
-                    if hasattr(last_message, 'content'):
-                        return last_message.content
-                    elif isinstance(last_message, dict) and 'content' in last_message:
-                        return last_message['content']
-            return result
+            run_stats = self.new_run_stats()
+            with tracer.span(f"agent.{self.name}", mode="async") as span:
+                result = await self.atool_model(message, self.model_chain, run_stats)
+                self.record_run_stats(span, run_stats)
+            return self.final_content(result)
         except Exception as e:
             import traceback
             traceback.print_exc()
-            return json.dumps({"error": f"景点推荐失败: {str(e)}"}, ensure_ascii=False)
+            return json.dumps({"error": f"{self.error_message}: {str(e)}"}, ensure_ascii=False)
 
-class Attractions_Agent(Agent):
+class Single_Agent(Tool_Agent):
+    """
+    单一景点智能体
+    """
+    name = "Single_Agent"
+    tools = [get_search_result]
+    error_message = "景点推荐失败"
+
+    def __init__(self):
+        super().__init__()
+        self.prompt = compile_prompt(SINGLE_ATTRACTIONS_PROMPT)
+
+class Attractions_Agent(Tool_Agent):
     """
     景点推荐智能体
     """
+    name = "Attractions_Agent"
+    tools = [get_search_result, get_single_attraction]
+    error_message = "景点推荐失败"
+
     def __init__(self):
         super().__init__()
-        self.name = "Attractions_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.attractions_prompt = ATTRACTIONS_PROMPT["prompt"]
-    def should_use_tool(self, state):
-        """
-        判断是否需要使用工具
-        """
-        last_message = state["messages"][-1]
-        print("Attractions_Agent_last_message:",last_message)
-        # 检查消息是否有tool_calls属性
-        if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-            return "tool"
-        return END
-    def tool_model(self, message, model):
-        # 绑定搜索工具和知识库工具
-        tool_model = model.bind_tools([get_search_result,get_single_attraction])
-        tool_node = ToolNode([get_search_result,get_single_attraction])
-        
-        # 创建一个包装函数来处理状态
-        def agent_node(state):
-            # 从状态中获取消息并传递给tool_model
-            messages = state["messages"]
-            # 调用tool_model并获取响应
-            response = tool_model.invoke(messages)
-            # 返回新的状态
-            return {"messages": messages + [response]}
-        
-        # 初始状态
-        initial_state = {
-            "messages": [
-                {"role": "system", "content": self.attractions_prompt.format(time=current_time)},
-                {"role": "user", "content": message}
-            ]
-        }
-        
-        # 创建状态图
-        graph = StateGraph(MessagesState)
-        graph.add_node("agent", agent_node)
-        graph.add_node("tool", tool_node)
-        graph.add_edge(START, "agent")
-        graph.add_conditional_edges("agent", self.should_use_tool, ["tool", END])
-        graph.add_edge("tool", "agent")
-        
-        # 编译并运行
-        app = graph.compile()
-        return app.invoke(initial_state)
-    
-    def run(self, message: str):
-        try:
-            # 调用tool_model获取结果
-            result = self.tool_model(message, self.chat_model)
-            # 从结果中获取最终消息
-            if hasattr(result, "messages"):
-                return result.content
-            return result
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return json.dumps({"error": f"景点推荐失败: {str(e)}"}, ensure_ascii=False)
+        self.prompt = compile_prompt(ATTRACTIONS_PROMPT)
 
     
 class Plan_Agent(Agent):
     """
     计划生成智能体
     """
+    name = "Plan_Agent"
+    error_message = "计划生成失败"
+    output_schema = "daily_plans"
+
     def __init__(self):
         super().__init__()
-        self.name = "Plan_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.plan_prompt = PLAN_PROMPT["prompt"]
-    def run(self, message: str):
-        try:
-            response = self.chat_model.invoke([
-                {"role": "system", "content": self.plan_prompt},
-                {"role": "user", "content": message}
-            ])
-            return json.dumps(clean_json_markdown(response.content), ensure_ascii=False)
-        except Exception as e:
-            return json.dumps({"error": f"计划生成失败: {str(e)}"}, ensure_ascii=False)
+        self.prompt = compile_prompt(PLAN_PROMPT)
+    def parse_response(self, response):
+        return json.dumps(clean_json_markdown(response.content), ensure_ascii=False)
     
-class Traffic_Agent(Agent):
+class Traffic_Agent(Tool_Agent):
     """
     交通推荐智能体
     """
+    name = "Traffic_Agent"
+    tools = [get_search_result]
+    error_message = "交通推荐失败"
+
     def __init__(self):
         super().__init__()
-        self.name = "Traffic_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.traffic_prompt = TRAFFIC_PROMPT["prompt"]
-    def tool_model(self, message, model):
-        # 绑定搜索工具和知识库工具
-        tool_model = model.bind_tools([get_search_result])
-        tool_node = ToolNode([get_search_result])
-        
-        # 创建一个包装函数来处理状态
-        def agent_node(state):
-            # 从状态中获取消息并传递给tool_model
-            messages = state["messages"]
-            # 调用tool_model并获取响应
-            response = tool_model.invoke(messages)
-            # 返回新的状态
-            return {"messages": messages + [response]}
-        
-        # 初始状态
-        initial_state = {
-            "messages": [
-                {"role": "system", "content": self.traffic_prompt.format(time=current_time)},
-                {"role": "user", "content": message}
-            ]
-        }
-        
-        # 创建状态图
-        graph = StateGraph(MessagesState)
-        graph.add_node("agent", agent_node)
-        graph.add_node("tool", tool_node)
-        graph.add_edge(START, "agent")
-        graph.add_conditional_edges("agent", self.should_use_tool, ["tool", END])
-        graph.add_edge("tool", "agent")
-        
-        # 编译并运行
-        app = graph.compile()
-        return app.invoke(initial_state)
-    def run(self, message: str):
-        try:
-            # 调用tool_model获取结果
-            result = self.tool_model(message, self.chat_model)
-            # 从结果中获取最终消息
-            if hasattr(result, "messages"):
-                return result.content
-            return result
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return json.dumps({"error": f"交通推荐失败: {str(e)}"}, ensure_ascii=False)
+        self.prompt = compile_prompt(TRAFFIC_PROMPT)
     
 class Hotel_Agent(Agent):
     """
     酒店推荐智能体(暂不采用)
     """
+    name = "Hotel_Agent"
+    error_message = "酒店推荐失败"
+
     def __init__(self):
         super().__init__()
-        self.name = "Hotel_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.hotel_prompt = HOTEL_PROMPT["prompt"]
-    def run(self, message: str):
-        try:
-            response = self.chat_model.invoke([
-                {"role": "system", "content": self.hotel_prompt.format(question=message)},
-                {"role": "user", "content": message}
-            ])
-            return response.content
-        except Exception as e:
-            return json.dumps({"error": f"酒店推荐失败: {str(e)}"})
+        self.prompt = compile_prompt(HOTEL_PROMPT)
 
-class Dining_Agent(Agent):
+class Dining_Agent(Tool_Agent):
     """
     美食推荐智能体
     """
+    name = "Dining_Agent"
+    tools = [get_search_result, get_single_attraction]
+    error_message = "美食推荐失败"
+
     def __init__(self):
         super().__init__()
-        self.name = "Dining_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.dining_prompt = DINING_PROMPT["prompt"]
-    def tool_model(self, message, model):
-        # 绑定搜索工具和知识库工具
-        tool_model = model.bind_tools([get_search_result,get_single_attraction])
-        tool_node = ToolNode([get_search_result,get_single_attraction])
-        
-        # 创建一个包装函数来处理状态
-        def agent_node(state):
-            # 从状态中获取消息并传递给tool_model
-            messages = state["messages"]
-            # 调用tool_model并获取响应
-            response = tool_model.invoke(messages)
-            # 返回新的状态
-            return {"messages": messages + [response]}
-        
-        # 初始状态
-        initial_state = {
-            "messages": [
-                {"role": "system", "content": self.dining_prompt.format(time=current_time)},
-                {"role": "user", "content": message}
-            ]
-        }
-        
-        # 创建状态图
-        graph = StateGraph(MessagesState)
-        graph.add_node("agent", agent_node)
-        graph.add_node("tool", tool_node)
-        graph.add_edge(START, "agent")
-        graph.add_conditional_edges("agent", self.should_use_tool, ["tool", END])
-        graph.add_edge("tool", "agent")
-        
-        # 编译并运行
-        app = graph.compile()
-        return app.invoke(initial_state)
-    def run(self, message: str):
-        try:
-            # 调用tool_model获取结果
-            result = self.tool_model(message, self.chat_model)
-            # 从结果中获取最终消息
-            if hasattr(result, "messages"):
-                return result.content
-            return result
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return json.dumps({"error": f"美食推荐失败: {str(e)}"}, ensure_ascii=False)
+        self.prompt = compile_prompt(DINING_PROMPT)
         
 class Budget_Agent(Agent):
     """
     预算推荐智能体
     """
+    name = "Budget_Agent"
+    error_message = "预算推荐失败"
+    output_schema = "budget"
+
     def __init__(self):
         super().__init__()
-        self.name = "Budget_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.budget_prompt = BUDGET_PROMPT["prompt"]
-    def run(self, message: str):
-        try:
-            response = self.chat_model.invoke([
-                {"role": "system", "content": self.budget_prompt.format(question=message)},
-                {"role": "user", "content": message}
-            ])
-            return response.content
-        except Exception as e:
-            return json.dumps({"error": f"预算推荐失败: {str(e)}"})
+        self.prompt = compile_prompt(BUDGET_PROMPT)
 
-class Safe_Answer_Agent():
+class Safe_Answer_Agent(Agent):
     """
     判断提问是否是在允许的范围内
     """
+    name = "Safe_Answer_Agent"
+    error_message = "安全检查失败"
+    output_schema = "safety_verdict"
+
     def __init__(self):
         super().__init__()
-        self.name = "Safe_Answer_Agent"
-        self.chat_model = ChatOpenAI(
-            name=self.name,
-            model_name=os.environ["MODEL"],
-            base_url=os.environ["BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-        )
-        self.safe_answer_prompt = SAFE_ANSWER_PROMPT["prompt"]
-    
-    def run(self, user_message: str):
-        """
-        判断用户输入是否与旅游相关
-        """
-        try:
-            response = self.chat_model.invoke([
-                {"role": "system", "content": self.safe_answer_prompt.format(question=user_message)},
-                {"role": "user", "content": user_message}
-            ])
-            return response.content
-        except Exception as e:
-            return json.dumps({"error": f"安全检查失败: {str(e)}"})
+        self.prompt = compile_prompt(SAFE_ANSWER_PROMPT)
 
 def agent_debug(agent: Agent, message: str):
     """
@@ -1,12 +1,17 @@
 from langchain import tools
 from langchain.tools import tool
+from langchain_core.tools import BaseTool, StructuredTool
 import requests
 import requests
-from bs4 import BeautifulSoup
 import json
 import time
+import asyncio
+import functools
+import itertools
+import concurrent.futures
 
 def time_cost(func):
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         start = time.time()
         result = func(*args, **kwargs)
@@ -18,33 +23,76 @@ def time_cost(func):
 
 # from rag import rag_system
 import os
+from utils.tracing import tracer, traced, submit_with_context
+from utils.cassette import recorded
+from utils.concurrency import get_limiter, limited, get_io_executor, get_lookup_executor
+from utils.url_cache import url_cache
+from utils.search_cache import search_cache
+from utils.geocode import geocoder
+from utils.disk_cache import DiskCache
+from utils.http_client import http_client
+from utils.html_text import extract_text_stream, is_text_content_type, PAGE_TEXT_CHARS, PAGE_MAX_BYTES
 
-@time_cost
+# 网页下载的连接/读取超时（秒）
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "3"))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "8"))
+# 每次搜索并发下载的结果页数，以及返回给模型的页数（按搜索排名取最先成功的几页）
+SEARCH_FETCH_FANOUT = int(os.getenv("SEARCH_FETCH_FANOUT", "4"))
+SEARCH_MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", "2"))
+# 一次工具调用中下载网页的总时限（秒），到时返回已下载完成的内容
+SEARCH_FETCH_DEADLINE = float(os.getenv("SEARCH_FETCH_DEADLINE", "10"))
+# get_single_attraction 同时查询的景点数，以及按景点名缓存查询结果的时间（秒）
+ATTRACTION_LOOKUP_FANOUT = int(os.getenv("ATTRACTION_LOOKUP_FANOUT", "6"))
+ATTRACTION_CACHE_TTL = int(os.getenv("ATTRACTION_CACHE_TTL", "86400"))
+
+attraction_cache = DiskCache("attraction", default_ttl=ATTRACTION_CACHE_TTL)
+
+@traced("http.fetch_page")
 def get_url_content(url):
     """
     获取搜索得到的url的content内容
+    经过 utils.url_cache：有效期内直接使用缓存，过期后用 ETag / Last-Modified 重新验证
+    """
+    return url_cache.get_or_fetch(url, fetch_url_content)
+
+@recorded("fetch_page")
+@limited("fetch")
+@time_cost
+def fetch_url_content(url, validators=None):
+    """
+    流式下载网页并提取文本：只下载网页类的内容，最多读取 PAGE_MAX_BYTES 字节，正文收集够后停止读取
+    validators 为缓存中的 {"etag", "last_modified"}，服务端返回 304 时结果为 {"not_modified": True}
     """
     try:
         headers = {
             'User-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
         }
-        response = requests.get(url,headers=headers,allow_redirects=True)
-        response.raise_for_status()  # 检查HTTP错误
-        
-        # 获取纯文本
-        text_content = response.text
-        
-        # 如果需要解析HTML获取文本
-        soup = BeautifulSoup(text_content, 'html.parser')
-        clean_text = soup.get_text()
-        if len(clean_text) > 2000:
-            clean_text = clean_text[:2000]
-        return {
-            'status_code': response.status_code,
-            'text': text_content,
-            'clean_text': clean_text,
-            'encoding': response.encoding
-        }
+        if validators:
+            if validators.get("etag"):
+                headers['If-None-Match'] = validators["etag"]
+            if validators.get("last_modified"):
+                headers['If-Modified-Since'] = validators["last_modified"]
+        with http_client.get(url,headers=headers,allow_redirects=True,stream=True,
+                             timeout=(FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT)) as response:
+            if response.status_code == 304:
+                return {'status_code': 304, 'not_modified': True}
+            response.raise_for_status()  # 检查HTTP错误
+            content_type = response.headers.get('Content-Type', '')
+            if not is_text_content_type(content_type):
+                return {'error': f'不支持的内容类型: {content_type}'}
+            
+            # 边下载边提取正文（跳过脚本、样式和导航），提前结束时直接关闭连接
+            clean_text, info = extract_text_stream(response.iter_content(chunk_size=16 * 1024), content_type,
+                                                   PAGE_TEXT_CHARS, PAGE_MAX_BYTES)
+            return {
+                'status_code': response.status_code,
+                'clean_text': clean_text,
+                'encoding': info["encoding"],
+                'bytes_read': info["bytes_read"],
+                'truncated': info["truncated"],
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
         
     except requests.RequestException as e:
         return {'error': str(e)}
@@ -59,13 +107,21 @@ def get_search_url(search_response):
     return url_data
 
 
-def get_search_result(query: str):
+@traced("http.search_api")
+def search_api(query: str, freshness: str = "noLimit"):
     """
-    获取搜索结果,并返回规范化结果
+    调用搜索API，返回原始的JSON响应
+    经过 utils.search_cache：相同的查询（规范化后）在按查询分类设置的有效期内直接使用缓存
+    """
+    return search_cache.get_or_search(query, freshness, request_search_api)
+
+@recorded("search_api")
+def request_search_api(query: str, freshness: str = "noLimit"):
+    """
+    请求搜索API
     """
     url = os.getenv("search_url")
     api_key = "Bearer " + os.getenv("search_api_key")
-    freshness = "noLimit"
     summery = True 
     payload = json.dumps({
         "query": query,
@@ -76,19 +132,48 @@ def get_search_result(query: str):
         "Authorization": api_key,
         "Content-Type": "application/json"
     }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    
+    with get_limiter("search").slot() as mark_throttled:
+        response = http_client.request("POST", url, headers=headers, data=payload)
+        if response.status_code == 429:
+            mark_throttled()
+    return response.json()
+
+def fetch_pages(url_data, max_pages=SEARCH_MAX_PAGES, fanout=SEARCH_FETCH_FANOUT, deadline=SEARCH_FETCH_DEADLINE):
+    """
+    并发下载排名前 fanout 的结果页，返回最多 max_pages 页的文本（按搜索排名排序）
+    已有 max_pages 页下载成功或到达总时限时立即返回；未完成的下载在后台继续，结果写入网页缓存
+    """
+    urls = [item["url"] for item in url_data[:fanout]]
+    if not urls:
+        return []
+    executor = get_io_executor()
+    futures = {submit_with_context(executor, get_url_content, url): rank for rank, url in enumerate(urls)}
+    pages = {}
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=deadline):
+            try:
+                page = future.result()
+            except Exception as e:
+                print(f"网页下载失败: {str(e)}")
+                continue
+            if not page.get("error"):
+                pages[futures[future]] = page.get("clean_text", "")
+            if len(pages) >= max_pages:
+                break
+    except concurrent.futures.TimeoutError:
+        print(f"网页下载超过总时限 {deadline} 秒，返回已完成的 {len(pages)} 页")
+    return [pages[rank] for rank in sorted(pages)[:max_pages]]
+
+@traced("tool.get_search_result")
+@recorded("search")
+def get_search_result(query: str):
+    """
+    获取搜索结果,并返回规范化结果
+    """
     # 得到url列表
-    url_data = get_search_url(response.json())
-    url_data = url_data[:2] if len(url_data) > 2 else url_data
+    url_data = get_search_url(search_api(query))
     # formatted_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    content_list = []
-    for url in url_data:
-        if get_url_content(url["url"]).get("error"):
-            continue
-        content_list.append(get_url_content(url["url"]).get("clean_text", ""))
-        
-    return content_list
+    return fetch_pages(url_data)
 
 @tool
 def get_route_plan(origin: str, destination: str, date: str):
@@ -149,7 +234,7 @@ def get_traffic_data(origin: str, destination: str, date: str, filter: str = '',
     }
 
     # 发起接口网络请求
-    response = requests.get(os.getenv("traffic_api_url"), params=requestParams)
+    response = http_client.get(os.getenv("traffic_api_url"), params=requestParams)
     
     # 解析响应结果
     if response.status_code == 200:
@@ -160,35 +245,32 @@ def get_traffic_data(origin: str, destination: str, date: str, filter: str = '',
         # 网络异常等因素，解析结果异常。可依据业务逻辑自行处理。
         print('请求异常')
 
+@traced("tool.location_transform")
 def location_transform(origin,destination):
     """
     转换出发地和目的地的位置信息
+    城市/车站名先由离线地名库（utils.gazetteer）解析，其余经过 utils.geocode 的本地缓存，
+    未缓存的地址在一次批量请求中同时解析
     """
-    # 调用交通信息API
-    gaode_base_url = "https://restapi.amap.com/v3/geocode/geo?"
-    origin_get_url = gaode_base_url + "key=" + os.getenv("gaode_api_key") + "&address=" + origin
-    destination_get_url = gaode_base_url + "key=" + os.getenv("gaode_api_key") + "&address=" + destination
-    # 发起接口网络请求
-    origin_response = requests.get(origin_get_url)
-    destination_response = requests.get(destination_get_url)
-    # 解析响应结果
-    if origin_response.status_code == 200 and destination_response.status_code == 200:
-        origin_result = origin_response.json()
-        destination_result = destination_response.json()
-        if origin_result["status"] == "1" and destination_result["status"] == "1":
-            origin_location = origin_result["geocodes"][0]["location"]
-            destination_location = destination_result["geocodes"][0]["location"]
-            origin_citycode = origin_result["geocodes"][0]["citycode"]
-            destination_citycode = destination_result["geocodes"][0]["citycode"]
-            return {"origin":origin_location,"destination":destination_location,"origin_citycode":origin_citycode,"destination_citycode":destination_citycode}
-        else:
-            print("位置信息获取失败")
-            return None
-    else:
-        # 网络异常等因素，解析结果异常。可依据业务逻辑自行处理。
-        print('请求异常')
+    locations = geocode_locations([origin, destination])
+    origin_result = locations.get(origin)
+    destination_result = locations.get(destination)
+    if origin_result is None or destination_result is None:
+        print("位置信息获取失败")
         return None
+    return {"origin":origin_result["location"],"destination":destination_result["location"],
+            "origin_citycode":origin_result["citycode"],"destination_citycode":destination_result["citycode"]}
+
+def geocode_locations(addresses):
+    """
+    批量地理编码：一次解析整个行程中的地点，返回 {地址: {"location", "citycode", "adcode", "city", ...}}
+    地名库识别的地点附带 gazetteer_city、gazetteer_station、gazetteer_telecode 等规范名称和编码
+    解析失败的地址值为 None
+    """
+    return geocoder.geocode_many(addresses)
 
+@traced("tool.get_route_info")
+@recorded("route")
 def get_route_info(locations: dict):
     """
     获取交通信息
@@ -207,7 +289,7 @@ def get_route_info(locations: dict):
     base_url = "https://restapi.amap.com/v5/direction/transit/integrated?"
     # 发起接口网络请求
     req_url = base_url + "origin=" + origin + "&destination=" + destination + "&city1=" + origin_citycode + "&city2=" + destination_citycode+"&key=" + os.getenv("gaode_api_key")
-    response = requests.get(req_url)
+    response = http_client.get(req_url)
     # 解析响应结果
     if response.status_code == 200:
         responseResult = response.json()
@@ -242,6 +324,7 @@ def get_transport_info(messages):
     return transport_info
 
 @tool
+@traced("tool.get_single_attraction")
 def get_single_attraction(messages):
     """
     获取单个景点或活动的详细信息
@@ -252,37 +335,74 @@ def get_single_attraction(messages):
     Returns:
         包含景点或活动详细信息的字典
     """
-    # 调用交通信息API
-    print("messages:",messages)
     json_messages = messages.get("attractions", [])
-    url = os.getenv("search_url")
-    api_key = "Bearer " + os.getenv("search_api_key")
-    freshness = "noLimit"
-    summery = True 
-    headers = {
-        "Authorization": api_key,
-        "Content-Type": "application/json"
-    }
-    response_list = {}
-    
-    for item in json_messages:
-        attraction_name = item["name"]
-        payload = json.dumps({
-        "query": f"景点：{attraction_name}开放时间地址详细信息",
-        "freshness": freshness,
-        "summery": summery
-        })
-        response = requests.request("POST", url, headers=headers, data=payload)
-        print(response.json())
-        url_data = get_search_url(response.json())
-        url_data = url_data[:2] if len(url_data) > 2 else url_data
+    names = list(dict.fromkeys(item["name"] for item in json_messages))
+    if not names:
+        return {}
+    # 各景点在共享的查询线程池中并发查询，每次调用同时在途的最多 ATTRACTION_LOOKUP_FANOUT 个，
+    # 完成一个再提交下一个；查询内部的网页下载提交到 I/O 线程池，等待下载的线程不会占用 I/O 线程池
+    executor = get_lookup_executor()
+    queue = iter(names)
+    pending = {submit_with_context(executor, lookup_attraction, name): name
+               for name in itertools.islice(queue, ATTRACTION_LOOKUP_FANOUT)}
+    results = {}
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            results[pending.pop(future)] = future.result()
+            name = next(queue, None)
+            if name is not None:
+                pending[submit_with_context(executor, lookup_attraction, name)] = name
+    return {name: results[name] for name in names}
+
+
+@traced("tool.lookup_attraction")
+def lookup_attraction(attraction_name):
+    """
+    查询单个景点的信息，结果按规范化的景点名缓存；查询不到信息时不缓存
+    """
+    cache_key = " ".join(attraction_name.split()).lower()
+    cached = attraction_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        search_response = search_api(f"景点：{attraction_name}开放时间地址详细信息")
+        content_list = fetch_pages(get_search_url(search_response), max_pages=1)
+    except Exception as e:
+        print(f"景点 {attraction_name} 查询失败: {str(e)}")
         content_list = []
-        for data in url_data:
-            if get_url_content(data["url"]).get("error"):
-                continue
-            content_list.append(get_url_content(data["url"]).get("clean_text", ""))
-        response_list[attraction_name] = content_list[0] if content_list else "暂无信息"
-    return response_list
+    if not content_list:
+        return "暂无信息"
+    attraction_cache.set(cache_key, content_list[0])
+    return content_list[0]
+
+
+def to_async_tool(func_or_tool):
+    """
+    把同步工具包装成同时支持 invoke 和 ainvoke 的工具
+    异步调用时在默认线程池中执行同步实现，事件循环不会被网络请求阻塞，线程数也有上限
+
+    Args:
+        func_or_tool: 普通函数（以文档字符串作为工具描述）或 @tool 装饰后的工具
+    """
+    if isinstance(func_or_tool, BaseTool):
+        func = func_or_tool.func
+        name = func_or_tool.name
+        description = func_or_tool.description
+        args_schema = func_or_tool.args_schema
+    else:
+        func = func_or_tool
+        name = func.__name__
+        description = func.__doc__
+        args_schema = None
+
+    async def coroutine(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    return StructuredTool.from_function(func=func, coroutine=coroutine, name=name,
+                                        description=description, args_schema=args_schema)
+
+
 if __name__ == "__main__":
     from dotenv import load_dotenv
 # 加载 .env 文件
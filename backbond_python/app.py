@@ -1,13 +1,27 @@
 from flask import Flask, render_template, request, jsonify, session
 from flask_cors import CORS
+import os
 import json
 from datetime import datetime, timedelta
 import random
 import uuid
+import asyncio
 import threading
-from route_generate import generate_travel_plan, single_agent
+from route_generate import generate_travel_plan, agenerate_travel_plan, generate_travel_plan_variants, single_agent, checkpoint_store, DEFAULT_BUDGET_LEVELS
 from utils.context_manager import ContextManager
 from generate_daily_posters import DailyPosterGenerator
+from utils.tracing import tracer
+from utils.concurrency import concurrency_stats, submit_coroutine
+from utils.llm_cache import llm_cache
+from utils.prompt_builder import prompt_cache_stats
+from utils.usage import usage_tracker
+from utils.structured_output import structured_output
+from utils.rate_limit import rate_limit_stats, unavailable_retry_after
+from utils.url_cache import url_cache
+from utils.search_cache import search_cache
+from agent_tools import attraction_cache, geocode_locations
+from utils.geocode import geocoder
+from utils.http_client import http_client
 
 # Initialize context manager
 context_manager = ContextManager()
@@ -24,33 +38,121 @@ CORS(app)
 tasks = {}
 tasks_lock = threading.Lock()
 
-def run_generate_plan_task(task_id, origin, destination, days, budget_level, preferences, start_date):
+# 为 1 时任务由共享事件循环调度（单档位任务以 agenerate_travel_plan 异步执行），不再为每个任务创建后台线程
+ASYNC_PIPELINE = os.getenv("ASYNC_PIPELINE", "0") == "1"
+
+def llm_unavailable_response():
+    """模型服务全部处于熔断中时直接拒绝新任务，避免任务排队后再逐个失败"""
+    retry_after = unavailable_retry_after()
+    if retry_after is None:
+        return None
+    response = jsonify({"error": "模型服务暂不可用，请稍后重试", "retry_after": round(retry_after)})
+    response.headers["Retry-After"] = str(int(retry_after) + 1)
+    return response, 503
+
+def mark_task_completed(task_id, result, posters):
+    with tasks_lock:
+        tasks[task_id]["status"] = "completed"
+        tasks[task_id]["result"] = result
+        tasks[task_id]["posters"] = posters
+        tasks[task_id]["usage"] = usage_tracker.task_usage(task_id)
+        tasks[task_id]["completed_at"] = datetime.now().isoformat()
+    print(f"[Task {task_id}] 执行完成")
+
+def mark_task_failed(task_id, error):
+    import traceback
+    traceback.print_exc()
+    with tasks_lock:
+        tasks[task_id]["status"] = "failed"
+        tasks[task_id]["error"] = str(error)
+        tasks[task_id]["usage"] = usage_tracker.task_usage(task_id)
+        tasks[task_id]["completed_at"] = datetime.now().isoformat()
+    print(f"[Task {task_id}] 执行失败: {str(error)}")
+
+def run_generate_plan_task(task_id, origin, destination, days, budget_level, preferences, start_date, task_mode="llm", user_text=None,
+                           retry_stages=None, skip_stages=None):
     """在后台线程中执行旅行计划生成任务"""
     try:
         print(f"[Task {task_id}] 开始执行...")
-        result = generate_travel_plan(origin, destination, days, budget_level, preferences, start_date)
+        with tracer.start_trace(task_id, destination=destination, origin=origin, days=days, task_mode=task_mode):
+            result = generate_travel_plan(origin, destination, days, budget_level, preferences, start_date,
+                                          task_mode=task_mode, user_text=user_text, task_id=task_id,
+                                          retry_stages=retry_stages, skip_stages=skip_stages)
+            
+            # 生成海报
+            print(f"[Task {task_id}] 开始生成海报...")
+            with open(f"./result_{task_id}.json", "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            with tracer.span("stage.posters"):
+                generator = DailyPosterGenerator(result)
+                posters = generator.generate_all_posters()
         
-        # 生成海报
-        print(f"[Task {task_id}] 开始生成海报...")
-        with open(f"./result_{task_id}.json", "w", encoding="utf-8") as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-        generator = DailyPosterGenerator(result)
-        posters = generator.generate_all_posters()
+        mark_task_completed(task_id, result, posters)
+    except Exception as e:
+        mark_task_failed(task_id, e)
+
+async def arun_generate_plan_task(task_id, origin, destination, days, budget_level, preferences, start_date, task_mode="llm", user_text=None,
+                                  retry_stages=None, skip_stages=None):
+    """在共享事件循环中执行旅行计划生成任务，海报生成放到线程池中执行"""
+    try:
+        print(f"[Task {task_id}] 开始执行（异步）...")
+        with tracer.start_trace(task_id, destination=destination, origin=origin, days=days, task_mode=task_mode, pipeline="async"):
+            result = await agenerate_travel_plan(origin, destination, days, budget_level, preferences, start_date,
+                                                 task_mode=task_mode, user_text=user_text, task_id=task_id,
+                                                 retry_stages=retry_stages, skip_stages=skip_stages)
+            
+            print(f"[Task {task_id}] 开始生成海报...")
+            with open(f"./result_{task_id}.json", "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            with tracer.span("stage.posters"):
+                posters = await asyncio.to_thread(lambda: DailyPosterGenerator(result).generate_all_posters())
         
-        with tasks_lock:
-            tasks[task_id]["status"] = "completed"
-            tasks[task_id]["result"] = result
-            tasks[task_id]["posters"] = posters
-            tasks[task_id]["completed_at"] = datetime.now().isoformat()
-        print(f"[Task {task_id}] 执行完成")
+        mark_task_completed(task_id, result, posters)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        with tasks_lock:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["error"] = str(e)
-            tasks[task_id]["completed_at"] = datetime.now().isoformat()
-        print(f"[Task {task_id}] 执行失败: {str(e)}")
+        mark_task_failed(task_id, e)
+
+def start_task(run_task, arun_task, *args, **kwargs):
+    """启动后台任务：ASYNC_PIPELINE=1 时把 arun_task 提交到共享事件循环，否则在后台线程中执行 run_task"""
+    if ASYNC_PIPELINE:
+        submit_coroutine(arun_task(*args, **kwargs))
+    else:
+        threading.Thread(target=run_task, args=args, kwargs=kwargs, daemon=True).start()
+
+def start_plan_task(*args, **kwargs):
+    """启动单档位任务"""
+    start_task(run_generate_plan_task, arun_generate_plan_task, *args, **kwargs)
+
+def run_generate_variants_task(task_id, origin, destination, days, budget_levels, preferences, start_date, task_mode="llm", user_text=None,
+                               retry_stages=None, skip_stages=None):
+    """在后台线程中生成多个预算档位的旅行计划，共享与预算无关的阶段"""
+    try:
+        print(f"[Task {task_id}] 开始执行多档位生成: {budget_levels}")
+        with tracer.start_trace(task_id, destination=destination, origin=origin, days=days, budget_levels=budget_levels):
+            result = generate_travel_plan_variants(origin, destination, days, budget_levels, preferences, start_date,
+                                                   task_mode=task_mode, user_text=user_text, task_id=task_id,
+                                                   retry_stages=retry_stages, skip_stages=skip_stages)
+            
+            # 为每个档位生成海报
+            print(f"[Task {task_id}] 开始生成海报...")
+            with open(f"./result_{task_id}.json", "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            posters = {}
+            with tracer.span("stage.posters"):
+                for level, variant in result.get("variants", {}).items():
+                    if isinstance(variant, dict) and not variant.get("error"):
+                        posters[level] = DailyPosterGenerator(variant).generate_all_posters()
+        
+        mark_task_completed(task_id, result, posters)
+    except Exception as e:
+        mark_task_failed(task_id, e)
+
+async def arun_generate_variants_task(*args, **kwargs):
+    """多档位任务没有异步版本，由共享事件循环调度，阻塞的等待放到线程中执行"""
+    await asyncio.to_thread(run_generate_variants_task, *args, **kwargs)
+
+def start_variants_task(*args, **kwargs):
+    """启动多档位任务"""
+    start_task(run_generate_variants_task, arun_generate_variants_task, *args, **kwargs)
 
 # Route for home page
 # @app.route('/')
@@ -60,6 +162,9 @@ def run_generate_plan_task(task_id, origin, destination, days, budget_level, pre
 # API endpoint for generating travel plan (异步模式)
 @app.route('/api/generate-plan', methods=['POST'], endpoint='api_generate_plan')
 def api_generate_plan():
+    unavailable = llm_unavailable_response()
+    if unavailable:
+        return unavailable
     data = request.json
     destination = data.get('destination')
     origin = data.get('origin')
@@ -87,17 +192,13 @@ def api_generate_plan():
                 "days": days,
                 "budget_level": budget_level,
                 "preferences": preferences,
-                "start_date": start_date
+                "start_date": start_date,
+                "task_mode": "template"
             }
         }
     
-    # 启动后台线程执行任务
-    thread = threading.Thread(
-        target=run_generate_plan_task,
-        args=(task_id, origin, destination, days, budget_level, preferences, start_date),
-        daemon=True
-    )
-    thread.start()
+    # 启动后台任务
+    start_plan_task(task_id, origin, destination, days, budget_level, preferences, start_date, task_mode="template")
     
     # 立即返回任务ID
     return jsonify({
@@ -109,6 +210,9 @@ def api_generate_plan():
 # API endpoint for chat (异步模式)
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
+    unavailable = llm_unavailable_response()
+    if unavailable:
+        return unavailable
     data = request.json
     destination = data.get('destination')
     origin = data.get('origin')
@@ -116,8 +220,10 @@ def api_chat():
     budget_level = data.get('budget_level')
     preferences = data.get('preferences', [])
     start_date = data.get('start_date', datetime.now().strftime("%Y-%m-%d"))
+    # 自由文本需求，提供时使用LLM进行任务分解
+    user_text = data.get('message')
     
-    print(f"收到请求: {destination}, {days}, {budget_level}, {preferences}, {start_date}")
+    print(f"收到请求: {destination}, {days}, {budget_level}, {preferences}, {start_date}, {user_text}")
     
     # 生成任务ID
     task_id = str(uuid.uuid4())
@@ -135,17 +241,14 @@ def api_chat():
                 "days": days,
                 "budget_level": budget_level,
                 "preferences": preferences,
-                "start_date": start_date
+                "start_date": start_date,
+                "message": user_text,
+                "task_mode": "llm"
             }
         }
     
-    # 启动后台线程执行任务
-    thread = threading.Thread(
-        target=run_generate_plan_task,
-        args=(task_id, origin, destination, days, budget_level, preferences, start_date),
-        daemon=True
-    )
-    thread.start()
+    # 启动后台任务
+    start_plan_task(task_id, origin, destination, days, budget_level, preferences, start_date, "llm", user_text)
     
     # 立即返回任务ID
     return jsonify({
@@ -154,6 +257,66 @@ def api_chat():
         "message": "任务已提交，正在生成旅游攻略..."
     })
 
+# API endpoint for generating several budget variants of one trip (异步模式)
+@app.route('/api/generate-variants', methods=['POST'])
+def api_generate_variants():
+    """
+    一次生成同一行程的多个预算档位（默认 经济/中等/豪华），
+    安全检查、任务分解、景点和交通研究只执行一次
+    """
+    unavailable = llm_unavailable_response()
+    if unavailable:
+        return unavailable
+    data = request.json
+    destination = data.get('destination')
+    origin = data.get('origin')
+    days = int(data.get('days', 3))
+    budget_levels = data.get('budget_levels') or DEFAULT_BUDGET_LEVELS
+    if not isinstance(budget_levels, list):
+        return jsonify({"error": "budget_levels 必须是列表"}), 400
+    invalid_levels = [level for level in budget_levels if not isinstance(level, str) or level not in DEFAULT_BUDGET_LEVELS]
+    if invalid_levels:
+        return jsonify({"error": f"未知的预算档位: {invalid_levels}，可选: {'/'.join(DEFAULT_BUDGET_LEVELS)}"}), 400
+    # 重复的档位只生成一次，保持请求中的顺序
+    budget_levels = list(dict.fromkeys(budget_levels))
+    preferences = data.get('preferences', [])
+    start_date = data.get('start_date', datetime.now().strftime("%Y-%m-%d"))
+    
+    print(f"收到多档位请求: {destination}, {days}, {budget_levels}, {preferences}, {start_date}")
+    
+    # 生成任务ID
+    task_id = str(uuid.uuid4())
+    
+    # 创建任务记录
+    with tasks_lock:
+        tasks[task_id] = {
+            "status": "pending",
+            "result": None,
+            "posters": None,
+            "error": None,
+            "created_at": datetime.now().isoformat(),
+            "params": {
+                "destination": destination,
+                "origin": origin,
+                "days": days,
+                "budget_levels": budget_levels,
+                "preferences": preferences,
+                "start_date": start_date,
+                "task_mode": "template"
+            }
+        }
+    
+    # 启动后台任务
+    start_variants_task(task_id, origin, destination, days, budget_levels, preferences, start_date, task_mode="template")
+    
+    # 立即返回任务ID
+    return jsonify({
+        "task_id": task_id,
+        "status": "pending",
+        "budget_levels": budget_levels,
+        "message": "任务已提交，正在生成多个预算档位的旅游攻略..."
+    })
+
 # API endpoint for querying task status
 @app.route('/api/task-status', methods=['GET'])
 def api_task_status():
@@ -180,9 +343,108 @@ def api_task_status():
         elif task["status"] == "failed":
             response["error"] = task["error"]
             response["completed_at"] = task.get("completed_at")
+        stored_usage = task.get("usage")
     
+    # token 用量和费用（按智能体、阶段汇总），执行中的任务返回当前累计值
+    response["usage"] = usage_tracker.task_usage(task_id) or stored_usage
+    # 各阶段的执行状态，失败或超时的阶段可通过 /api/retry-task 单独重试
+    response["stages"] = {stage: {"status": checkpoint["status"], "error": checkpoint["error"]}
+                          for stage, checkpoint in checkpoint_store.load(task_id).items()}
     return jsonify(response)
 
+# API endpoint for retrying or skipping failed stages
+@app.route('/api/retry-task', methods=['POST'])
+def api_retry_task():
+    """
+    重试任务中失败/超时的阶段，或跳过这些阶段；已成功的阶段直接使用检查点结果
+    请求参数: task_id, retry_stages（可选，默认重试所有失败/超时的阶段）, skip_stages（可选）
+    """
+    unavailable = llm_unavailable_response()
+    if unavailable:
+        return unavailable
+    data = request.json
+    task_id = data.get('task_id')
+    if not task_id:
+        return jsonify({"error": "缺少 task_id 参数"}), 400
+    
+    with tasks_lock:
+        if task_id not in tasks:
+            return jsonify({"error": "任务不存在"}), 404
+        task = tasks[task_id]
+        if task["status"] == "pending":
+            return jsonify({"error": "任务仍在执行中"}), 409
+        params = task["params"]
+        task["status"] = "pending"
+        task["error"] = None
+    
+    checkpoints = checkpoint_store.load(task_id)
+    retry_stages = data.get('retry_stages')
+    if retry_stages is None:
+        retry_stages = [stage for stage, checkpoint in checkpoints.items() if checkpoint["status"] in ("failed", "timeout")]
+    skip_stages = data.get('skip_stages', [])
+    
+    args = (task_id, params["origin"], params["destination"], params["days"],
+            params["budget_levels"] if "budget_levels" in params else params["budget_level"],
+            params["preferences"], params["start_date"], params.get("task_mode", "template"), params.get("message"))
+    kwargs = {"retry_stages": retry_stages, "skip_stages": skip_stages}
+    if "budget_levels" in params:
+        start_variants_task(*args, **kwargs)
+    else:
+        start_plan_task(*args, **kwargs)
+    
+    return jsonify({
+        "task_id": task_id,
+        "status": "pending",
+        "retry_stages": retry_stages,
+        "skip_stages": skip_stages,
+        "message": "任务已重新提交"
+    })
+
+# API endpoint for querying task trace
+@app.route('/api/task-trace/<task_id>', methods=['GET'])
+def api_task_trace(task_id):
+    """获取任务的链路追踪数据（各阶段、智能体迭代、工具调用和海报渲染的耗时）"""
+    trace = tracer.get_trace(task_id)
+    if trace is None:
+        return jsonify({"error": "追踪数据不存在"}), 404
+    return jsonify(trace)
+
+# API endpoint for service metrics
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """服务运行指标：任务数量、对外调用的并发限制状态、缓存命中和 token 用量"""
+    with tasks_lock:
+        task_counts = {}
+        for task in tasks.values():
+            task_counts[task["status"]] = task_counts.get(task["status"], 0) + 1
+    return jsonify({
+        "tasks": task_counts,
+        "concurrency": concurrency_stats(),
+        "llm_cache": llm_cache.stats(),
+        "url_cache": url_cache.stats(),
+        "search_cache": search_cache.stats(),
+        "geocode": geocoder.stats(),
+        "attraction_cache": attraction_cache.stats(),
+        "http": http_client.stats(),
+        "prompt_cache": prompt_cache_stats.stats(),
+        "usage": usage_tracker.stats(),
+        "structured_output": structured_output.stats(),
+        "llm_endpoints": rate_limit_stats()
+    })
+
+# API endpoint for bulk geocoding
+@app.route('/api/geocode', methods=['POST'])
+def api_geocode():
+    """
+    批量地理编码，一次解析行程中的所有地点
+    请求参数: addresses（地址列表）
+    """
+    data = request.json or {}
+    addresses = data.get('addresses')
+    if not isinstance(addresses, list) or not addresses:
+        return jsonify({"error": "addresses 必须是非空的地址列表"}), 400
+    return jsonify({"results": geocode_locations([str(address) for address in addresses])})
+
 # API endpoint for updating plan and regenerating posters
 @app.route('/api/update-plan', methods=['POST'])
 def api_update_plan():
@@ -242,6 +504,7 @@ def cleanup_expired_sessions():
         # 每小时清理一次过期会话（超过24小时未活动）
         while True:
             context_manager.cleanup_expired_sessions(expiration_hours=24)
+            checkpoint_store.cleanup_expired(expiration_hours=24)
             time.sleep(3600)  # 3600秒 = 1小时
     
     # 启动清理线程
@@ -0,0 +1,142 @@
+"""
+网页正文提取基准测试
+
+对比原来的 BeautifulSoup(html.parser).get_text()[:2000] 与 utils.html_text 的提取引擎
+（stream：标准库流式解析 + 提前结束；lxml：C 实现，需要安装 lxml）的耗时和输出内容。
+页面来自 --pages-dir 中保存的 .html 文件（可用浏览器"另存为"或 curl 保存真实的旅游网页）；
+目录不存在时生成与桩HTTP后端类似的合成页面。
+
+在 backbond_python 目录下运行：
+    python -m benchmarks.bench_html_extract --pages-dir benchmarks/pages --repeat 20
+    python -m benchmarks.bench_html_extract --synthetic-bytes 20000,200000,2000000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pipeline import summarize, git_revision, RESULTS_DIR
+from utils.html_text import extract_text, SKIP_TAGS
+
+DEFAULT_PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+def extract_bs4(html, max_chars, parser="html.parser"):
+    """原来的实现：解析完整 DOM 后取前 max_chars 个字符（包含脚本、样式和导航文本）"""
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, parser).get_text()[:max_chars]
+
+
+def available_engines():
+    engines = {"stream": lambda html, max_chars: extract_text(html, max_chars, engine="stream")}
+    try:
+        import bs4  # noqa: F401
+        engines["bs4"] = extract_bs4
+    except ImportError:
+        print("未安装 beautifulsoup4，跳过原实现的对比")
+    try:
+        import lxml  # noqa: F401
+        engines["lxml"] = lambda html, max_chars: extract_text(html, max_chars, engine="lxml")
+        if "bs4" in engines:
+            engines["bs4_lxml"] = lambda html, max_chars: extract_bs4(html, max_chars, parser="lxml")
+    except ImportError:
+        print("未安装 lxml，跳过 lxml 引擎")
+    return engines
+
+
+def synthetic_page(size):
+    """生成约 size 字节的页面：头部有脚本、样式和导航，正文在后面"""
+    script = "<script>" + "var tracker = {id: 1, events: []};" * 200 + "</script>"
+    style = "<style>" + ".nav-item { color: #333; margin: 0 8px; }" * 100 + "</style>"
+    nav = "<nav>" + "<a href='#'>首页</a> | <a href='#'>攻略</a> | <a href='#'>酒店</a>" * 30 + "</nav>"
+    paragraph = "<p>景点介绍：开放时间08:30-17:00，门票60元，地址位于市中心，建议游览2小时。</p>"
+    count = max((size - len(script) - len(style) - len(nav)) // len(paragraph.encode("utf-8")), 1)
+    return (f"<html><head><title>合成页面 {size}</title>{script}{style}</head>"
+            f"<body>{nav}<div class='content'>{paragraph * count}</div><footer>版权所有</footer></body></html>")
+
+
+def load_pages(args):
+    if os.path.isdir(args.pages_dir):
+        pages = {}
+        for name in sorted(os.listdir(args.pages_dir)):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(args.pages_dir, name), "r", encoding="utf-8", errors="replace") as f:
+                    pages[name] = f.read()
+        if pages:
+            return pages
+    print(f"{args.pages_dir} 中没有保存的页面，使用合成页面")
+    return {f"synthetic_{size}": synthetic_page(size) for size in
+            (int(item) for item in args.synthetic_bytes.split(",") if item.strip())}
+
+
+def noise_markers(text):
+    """输出中混入的脚本/样式内容（大括号和分号）数量，用于粗略比较正文质量"""
+    return text.count("{") + text.count(";")
+
+
+def run(engines, pages, args):
+    results = {}
+    for engine, func in engines.items():
+        timings = []
+        per_page = {}
+        for name, html in pages.items():
+            durations = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                text = func(html, args.max_chars)
+                durations.append(time.perf_counter() - start)
+            timings.extend(durations)
+            per_page[name] = {
+                "bytes": len(html.encode("utf-8")),
+                "ms": round(sum(durations) / len(durations) * 1000, 3),
+                "chars": len(text),
+                "noise_markers": noise_markers(text),
+                "preview": text[:80],
+            }
+        results[engine] = {"latency_s": summarize(timings), "pages": per_page}
+        print(f"{engine:>9}: 平均 {results[engine]['latency_s']['mean'] * 1000:.3f} ms, "
+              f"p95 {results[engine]['latency_s']['p95'] * 1000:.3f} ms")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="网页正文提取基准测试")
+    parser.add_argument("--pages-dir", default=DEFAULT_PAGES_DIR, help="保存的网页目录（.html 文件）")
+    parser.add_argument("--synthetic-bytes", default="20000,200000,2000000", help="没有保存的网页时生成的合成页面大小")
+    parser.add_argument("--max-chars", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=10, help="每个页面重复提取的次数")
+    parser.add_argument("--label", default="html_extract")
+    parser.add_argument("--output", help="结果文件路径，默认写入 benchmarks/results/")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pages = load_pages(args)
+    engines = available_engines()
+    result = {
+        "label": args.label,
+        "created_at": datetime.now().isoformat(),
+        "git_revision": git_revision(),
+        "config": vars(args),
+        "skip_tags": sorted(SKIP_TAGS),
+        "engines": run(engines, pages, args),
+    }
+    if "bs4" in result["engines"]:
+        baseline = result["engines"]["bs4"]["latency_s"]["mean"]
+        for engine, data in result["engines"].items():
+            data["speedup_vs_bs4"] = round(baseline / data["latency_s"]["mean"], 2) if data["latency_s"]["mean"] else None
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{args.label}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+端到端性能基准测试
+
+使用桩LLM和桩HTTP后端（可配置延迟分布与失败率）驱动 generate_travel_plan 或 app.py 的接口，
+在不同并发度下测量吞吐量、端到端延迟 p50/p95/p99、各阶段耗时和每个任务的内存占用。
+结果保存为 JSON，可通过 --baseline 与历史结果对比。
+
+在 backbond_python 目录下运行：
+    python -m benchmarks.bench_pipeline --levels 1,10,50,100,500 --llm-latency lognormal:1.5:0.5
+    python -m benchmarks.bench_pipeline --mode app --levels 1,10 --baseline benchmarks/results/xxx.json
+    python -m benchmarks.bench_pipeline --mode async --levels 100,1000 --label async
+    python -m benchmarks.bench_pipeline --routing-profiles default,tiered --model-latency stub-small=fixed:0.3 \
+        --levels 10 --label routing
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import uuid
+import argparse
+import tracemalloc
+import subprocess
+import concurrent.futures
+from datetime import datetime
+
+# 基准测试不导出追踪文件，并保留足够多的追踪用于统计阶段耗时
+os.environ.setdefault("TRACE_EXPORT", "")
+os.environ.setdefault("TRACE_MAX_IN_MEMORY", "100000")
+# 默认关闭本地缓存，避免重复请求直接命中缓存而测不到真实调度开销（可通过环境变量打开）
+os.environ.setdefault("LLM_CACHE", "0")
+os.environ.setdefault("MODEL", "stub-model")
+os.environ.setdefault("SMALL_MODEL", "stub-small")
+# 桩模型的单价（每百万 token），用于比较不同模型路由档案的费用
+os.environ.setdefault("LLM_PRICES", json.dumps({"stub-model": {"input": 2.0, "output": 8.0},
+                                                "stub-small": {"input": 0.2, "output": 0.8}}))
+os.environ.setdefault("BASE_URL", "http://stub-llm.local/v1")
+os.environ.setdefault("OPENAI_API_KEY", "stub-key")
+os.environ.setdefault("search_api_key", "stub-key")
+os.environ.setdefault("gaode_api_key", "stub-key")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import LatencyModel, StubLLMBackend, StubChatModel, StubHTTPBackend, STUB_SEARCH_URL
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# 统计耗时的 span 前缀
+STAGE_PREFIXES = ("stage.", "agent.", "poster.", "tool.")
+
+
+def percentile(values, pct):
+    """线性插值计算百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def stage_durations(traces):
+    """按 span 名称汇总所有任务的阶段耗时"""
+    durations = {}
+    for trace in traces:
+        if not trace:
+            continue
+        for span in trace["spans"]:
+            if span["name"].startswith(STAGE_PREFIXES):
+                durations.setdefault(span["name"], []).append(span["duration"])
+    return {name: summarize(values) for name, values in sorted(durations.items())}
+
+
+def install_stubs(args):
+    """替换 ChatOpenAI 和 requests，返回桩后端"""
+    import agent
+    model_latencies = {}
+    for item in filter(None, args.model_latency.split(",")):
+        model_name, spec = item.split("=", 1)
+        model_latencies[model_name.strip()] = LatencyModel.parse(spec.strip(), seed=args.seed)
+    llm_backend = StubLLMBackend(LatencyModel.parse(args.llm_latency, seed=args.seed),
+                                 failure_rate=args.llm_failure_rate,
+                                 tool_calls_per_run=args.tool_calls, seed=args.seed,
+                                 model_latencies=model_latencies)
+    http_backend = StubHTTPBackend(LatencyModel.parse(args.http_latency, seed=args.seed + 1),
+                                   failure_rate=args.http_failure_rate,
+                                   page_bytes=args.page_bytes, seed=args.seed + 1)
+    agent.ChatOpenAI = lambda **kwargs: StubChatModel(llm_backend, **kwargs)
+    os.environ["search_url"] = STUB_SEARCH_URL
+    http_backend.install()
+    return llm_backend, http_backend
+
+
+def request_params(index):
+    return {
+        "origin": "重庆",
+        "destination": "成都",
+        "days": 3,
+        "budget_level": "中等",
+        "preferences": ["美食", "休闲"],
+        "start_date": "2026-05-01",
+    }
+
+
+def run_pipeline_level(level, total, args):
+    """直接调用 generate_travel_plan，level 个任务并发"""
+    from route_generate import generate_travel_plan
+    from utils.tracing import tracer
+
+    def job(index):
+        task_id = f"bench-{uuid.uuid4()}"
+        params = request_params(index)
+        start = time.perf_counter()
+        error = None
+        with tracer.start_trace(task_id):
+            try:
+                result = generate_travel_plan(params["origin"], params["destination"], params["days"],
+                                              params["budget_level"], params["preferences"], params["start_date"],
+                                              task_mode=args.task_mode)
+                if not isinstance(result, dict) or result.get("error"):
+                    error = (result or {}).get("error", "empty result")
+            except Exception as e:
+                error = str(e)
+        return task_id, time.perf_counter() - start, error
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=level) as executor:
+        outcomes = list(executor.map(job, range(total)))
+    return outcomes, [tracer.get_trace(task_id) for task_id, _, _ in outcomes]
+
+
+def run_async_level(level, total, args):
+    """在一个事件循环中调用 agenerate_travel_plan，最多 level 个任务同时在途"""
+    from route_generate import agenerate_travel_plan
+    from utils.tracing import tracer
+
+    async def job(index, semaphore):
+        async with semaphore:
+            task_id = f"bench-{uuid.uuid4()}"
+            params = request_params(index)
+            start = time.perf_counter()
+            error = None
+            with tracer.start_trace(task_id):
+                try:
+                    result = await agenerate_travel_plan(params["origin"], params["destination"], params["days"],
+                                                         params["budget_level"], params["preferences"], params["start_date"],
+                                                         task_mode=args.task_mode)
+                    if not isinstance(result, dict) or result.get("error"):
+                        error = (result or {}).get("error", "empty result")
+                except Exception as e:
+                    error = str(e)
+            return task_id, time.perf_counter() - start, error
+
+    async def main():
+        semaphore = asyncio.Semaphore(level)
+        return await asyncio.gather(*(job(index, semaphore) for index in range(total)))
+
+    outcomes = asyncio.run(main())
+    return outcomes, [tracer.get_trace(task_id) for task_id, _, _ in outcomes]
+
+
+def run_app_level(level, total, args):
+    """通过 Flask 测试客户端调用 /api/generate-plan 并轮询 /api/task-status"""
+    import app as app_module
+    from utils.tracing import tracer
+    client = app_module.app.test_client()
+
+    submitted = {}
+    pending = list(range(total))
+    outcomes = []
+    # 同时在途的任务不超过 level 个
+    while pending or submitted:
+        while pending and len(submitted) < level:
+            index = pending.pop(0)
+            response = client.post("/api/generate-plan", json=request_params(index))
+            submitted[response.get_json()["task_id"]] = time.perf_counter()
+        time.sleep(args.poll_interval)
+        for task_id in list(submitted):
+            status = client.get("/api/task-status", query_string={"task_id": task_id}).get_json()
+            if status["status"] in ("completed", "failed"):
+                elapsed = time.perf_counter() - submitted.pop(task_id)
+                error = status.get("error")
+                if not error and isinstance(status.get("result"), dict):
+                    error = status["result"].get("error")
+                outcomes.append((task_id, elapsed, error))
+                result_file = f"./result_{task_id}.json"
+                if os.path.exists(result_file):
+                    os.remove(result_file)
+    return outcomes, [tracer.get_trace(task_id) for task_id, _, _ in outcomes]
+
+
+def run_level(level, args):
+    from utils.concurrency import set_agent_executor_workers
+    from utils.usage import usage_tracker
+    set_agent_executor_workers(args.fanout)
+    usage_before = usage_tracker.stats()["totals"]
+    total = max(level, args.min_tasks)
+    if args.memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    if args.mode == "app":
+        outcomes, traces = run_app_level(level, total, args)
+    elif args.mode == "async":
+        outcomes, traces = run_async_level(level, total, args)
+    else:
+        outcomes, traces = run_pipeline_level(level, total, args)
+    wall = time.perf_counter() - start
+    memory = None
+    if args.memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # 峰值内存按同时在途的任务数分摊
+        memory = {"peak_bytes": peak, "peak_bytes_per_task": peak // max(min(level, total), 1)}
+    latencies = [elapsed for _, elapsed, error in outcomes if not error]
+    usage_after = usage_tracker.stats()["totals"]
+    tokens = usage_after["total_tokens"] - usage_before["total_tokens"]
+    cost = usage_after["cost"] - usage_before["cost"]
+    return {
+        "concurrency": level,
+        "tasks": total,
+        "errors": sum(1 for _, _, error in outcomes if error),
+        "wall_time": round(wall, 4),
+        "throughput_per_s": round(len(outcomes) / wall, 4) if wall else None,
+        "latency": summarize(latencies),
+        "stages": stage_durations(traces),
+        "memory": memory,
+        "tokens": tokens,
+        "cost": round(cost, 6),
+        "cost_per_task": round(cost / total, 6) if total else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(current, baseline):
+    """打印与基准结果的对比"""
+    baseline_levels = {(level.get("routing_profile", "default"), level["concurrency"]): level
+                       for level in baseline.get("levels", [])}
+    print(f"\n对比基准: {baseline.get('label')} ({baseline.get('git_revision')}, {baseline.get('created_at')})")
+    print(f"{'档案':>10} {'并发':>6} {'吞吐量':>16} {'p50':>18} {'p95':>18} {'p99':>18}")
+    for level in current["levels"]:
+        profile = level.get("routing_profile", "default")
+        base = baseline_levels.get((profile, level["concurrency"]))
+        if not base:
+            continue
+
+        def delta(new, old):
+            if new is None or old is None or old == 0:
+                return "-"
+            return f"{new:.2f} ({(new - old) / old * 100:+.1f}%)"
+
+        print(f"{profile:>10} {level['concurrency']:>6} "
+              f"{delta(level['throughput_per_s'], base['throughput_per_s']):>16} "
+              f"{delta(level['latency'].get('p50'), base['latency'].get('p50')):>18} "
+              f"{delta(level['latency'].get('p95'), base['latency'].get('p95')):>18} "
+              f"{delta(level['latency'].get('p99'), base['latency'].get('p99')):>18}")
+
+
+def compare_profiles(result):
+    """打印各模型路由档案在相同并发度下的延迟和费用"""
+    print(f"\n{'档案':>10} {'并发':>6} {'p50':>10} {'p95':>10} {'tokens':>10} {'每任务费用':>12}")
+    for level in sorted(result["levels"], key=lambda item: (item["concurrency"], item["routing_profile"])):
+        latency = level["latency"]
+        print(f"{level['routing_profile']:>10} {level['concurrency']:>6} {str(latency.get('p50')):>10} "
+              f"{str(latency.get('p95')):>10} {level['tokens']:>10} {str(level['cost_per_task']):>12}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="旅行规划端到端性能基准测试")
+    parser.add_argument("--mode", choices=["pipeline", "async", "app"], default="pipeline",
+                        help="pipeline 直接调用 generate_travel_plan；async 在事件循环中调用 agenerate_travel_plan；"
+                             "app 通过 Flask 接口调用（包含海报生成）")
+    parser.add_argument("--levels", default="1,10,50,100,500", help="并发度列表，逗号分隔")
+    parser.add_argument("--min-tasks", type=int, default=10, help="每个并发度下最少执行的任务数")
+    parser.add_argument("--llm-latency", default="lognormal:1.0:0.5", help="LLM延迟分布，如 fixed:0.5 / uniform:0.2:2 / lognormal:1.0:0.5")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--http-latency", default="lognormal:0.3:0.6", help="HTTP延迟分布")
+    parser.add_argument("--http-failure-rate", type=float, default=0.0)
+    parser.add_argument("--page-bytes", type=int, default=20000, help="桩网页大小（字节）")
+    parser.add_argument("--tool-calls", type=int, default=1, help="每个工具型智能体每次运行发起的工具调用次数")
+    parser.add_argument("--fanout", type=int, default=int(os.getenv("AGENT_EXECUTOR_WORKERS", "32")), help="进程内共享的智能体线程池大小")
+    parser.add_argument("--task-mode", choices=["template", "llm"], default="template")
+    parser.add_argument("--routing-profiles", default=os.getenv("MODEL_ROUTING_PROFILE", "default"),
+                        help="依次测试的模型路由档案（model_routing.yaml），逗号分隔")
+    parser.add_argument("--model-latency", default="",
+                        help="按模型名指定桩LLM延迟，如 stub-small=fixed:0.3,stub-model=lognormal:1.5:0.5")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="不统计内存（tracemalloc 有额外开销）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--label", default="default", help="本次运行的标签，写入结果文件名")
+    parser.add_argument("--baseline", help="用于对比的历史结果文件")
+    parser.add_argument("--output", help="结果文件路径，默认写入 benchmarks/results/")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    llm_backend, http_backend = install_stubs(args)
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    config = {key: value for key, value in vars(args).items() if key not in ("baseline", "output")}
+    result = {
+        "label": args.label,
+        "created_at": datetime.now().isoformat(),
+        "git_revision": git_revision(),
+        "config": config,
+        "levels": [],
+    }
+    from utils.model_router import model_router
+    profiles = [profile.strip() for profile in args.routing_profiles.split(",") if profile.strip()]
+    try:
+        for profile in profiles:
+            model_router.set_profile(profile)
+            for level in levels:
+                print(f"档案 {profile} 并发度 {level} 运行中...")
+                level_result = run_level(level, args)
+                level_result["routing_profile"] = profile
+                result["levels"].append(level_result)
+                latency = level_result["latency"]
+                print(f"  吞吐量 {level_result['throughput_per_s']}/s, p50 {latency.get('p50')}s, "
+                      f"p95 {latency.get('p95')}s, p99 {latency.get('p99')}s, 失败 {level_result['errors']}, "
+                      f"每任务费用 {level_result['cost_per_task']}")
+    finally:
+        http_backend.uninstall()
+    from utils.usage import usage_tracker
+    result["usage"] = usage_tracker.stats()
+    result["backend_calls"] = {"llm": llm_backend.calls, "llm_failures": llm_backend.failures,
+                               "http": http_backend.calls, "http_failures": http_backend.failures}
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{args.label}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {output}")
+
+    if len(profiles) > 1:
+        compare_profiles(result)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+    return result
+
+
+if __name__ == "__main__":
+    main()
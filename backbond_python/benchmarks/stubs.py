@@ -0,0 +1,273 @@
+"""
+基准测试用的桩后端：模拟LLM和外部HTTP服务（搜索API、网页、高德），
+可配置延迟分布和失败率，不访问任何真实服务
+"""
+
+import json
+import math
+import time
+import asyncio
+import random
+import threading
+from urllib.parse import urlparse
+
+import requests
+from langchain_core.messages import AIMessage
+
+STUB_SEARCH_URL = "http://stub-search.local/search"
+STUB_PAGE_HOST = "stub-page.local"
+
+
+class LatencyModel:
+    """
+    延迟分布
+    kind: fixed（固定值）/ uniform（[low, high] 均匀分布）/ lognormal（中位数 median，离散度 sigma）
+    单位均为秒
+    """
+
+    def __init__(self, kind="lognormal", median=0.5, sigma=0.5, low=0.0, high=1.0, seed=0):
+        self.kind = kind
+        self.median = median
+        self.sigma = sigma
+        self.low = low
+        self.high = high
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec, seed=0):
+        """
+        从字符串解析延迟分布，例如 "fixed:0.2"、"uniform:0.1:0.5"、"lognormal:1.5:0.6"
+        """
+        parts = spec.split(":")
+        kind = parts[0]
+        values = [float(value) for value in parts[1:]]
+        if kind == "fixed":
+            return cls("fixed", median=values[0], seed=seed)
+        if kind == "uniform":
+            return cls("uniform", low=values[0], high=values[1], seed=seed)
+        if kind == "lognormal":
+            return cls("lognormal", median=values[0], sigma=values[1] if len(values) > 1 else 0.5, seed=seed)
+        raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self):
+        with self.lock:
+            if self.kind == "fixed":
+                return self.median
+            if self.kind == "uniform":
+                return self.rng.uniform(self.low, self.high)
+            return self.rng.lognormvariate(math.log(max(self.median, 1e-6)), self.sigma)
+
+    def describe(self):
+        if self.kind == "fixed":
+            return f"fixed:{self.median}"
+        if self.kind == "uniform":
+            return f"uniform:{self.low}:{self.high}"
+        return f"lognormal:{self.median}:{self.sigma}"
+
+
+class StubFailure(Exception):
+    """桩后端按失败率注入的错误"""
+
+
+def _budget_json():
+    return json.dumps({
+        "total_estimated_cost": 3000, "daily_estimated_cost": 1000,
+        "breakdown": {"accommodation": 900, "transport": 800, "food": 600, "attractions": 400, "shopping": 200, "miscellaneous": 100},
+        "saving_tips": ["提前预订门票", "选择公共交通"]
+    }, ensure_ascii=False)
+
+
+def _tasks_json():
+    return json.dumps({"tasks": [
+        {"name": "预算", "type": "budget", "description": "估算旅行预算", "priority": "high"},
+        {"name": "景点", "type": "attraction", "description": "推荐目的地景点", "priority": "high"},
+        {"name": "交通", "type": "traffic", "description": "规划往返交通", "priority": "high"},
+        {"name": "美食", "type": "dining", "description": "推荐当地美食", "priority": "medium"},
+    ]}, ensure_ascii=False)
+
+
+def _plan_json(days=3):
+    daily_plans = []
+    for day in range(1, days + 1):
+        daily_plans.append({
+            "day": day, "date": f"2026-05-0{day}",
+            "activities": [
+                {"time": "09:00-12:00", "activity": f"景点{day}A", "location": "市中心", "duration": 3, "cost": 60},
+                {"time": "12:30-13:30", "activity": "午餐", "location": "老街", "duration": 1, "cost": 80},
+                {"time": "14:00-17:00", "activity": f"景点{day}B", "location": "城郊", "duration": 3, "cost": 40},
+            ],
+            "total_day_cost": 800, "transport_cost": 100, "food_cost": 200,
+            "accommodation": "市中心酒店", "accommodation_cost": 300,
+        })
+    return json.dumps({"daily_plans": daily_plans, "total_cost": 800 * days, "accommodation_cost": 300 * days,
+                       "attractions": [], "transport": {"local": "地铁"}}, ensure_ascii=False)
+
+
+FINAL_ANSWERS = {
+    "Safe_Answer_Agent": lambda: json.dumps({"is_allowed": True, "category": "旅游", "reason": "stub"}, ensure_ascii=False),
+    "Seperate_Task_Agent": _tasks_json,
+    "Budget_Agent": _budget_json,
+    "Attractions_Agent": lambda: json.dumps({"attractions": [{"name": "景点A", "price": 60}], "total_attractions": 1}, ensure_ascii=False),
+    "Traffic_Agent": lambda: json.dumps({"local_transport": "高铁", "recommended_route": "G1234", "estimated_cost_per_day": 100}, ensure_ascii=False),
+    "Dining_Agent": lambda: json.dumps({"restaurants": [{"name": "老字号", "price": 80}]}, ensure_ascii=False),
+    "Single_Agent": lambda: json.dumps({"attractions": [{"name": "景点A"}]}, ensure_ascii=False),
+    "Plan_Agent": _plan_json,
+}
+
+
+class StubLLMBackend:
+    """
+    模拟LLM服务
+    工具型智能体第一次调用返回一次 get_search_result 工具调用，收到工具结果后返回最终答案
+    """
+
+    def __init__(self, latency, failure_rate=0.0, tool_calls_per_run=1, seed=0, model_latencies=None):
+        self.latency = latency
+        # 按模型名指定的延迟分布（用于比较模型路由档案），未指定的模型使用 latency
+        self.model_latencies = model_latencies or {}
+        self.failure_rate = failure_rate
+        self.tool_calls_per_run = tool_calls_per_run
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def _should_fail(self):
+        with self.lock:
+            self.calls += 1
+            if self.failure_rate and self.rng.random() < self.failure_rate:
+                self.failures += 1
+                return True
+        return False
+
+    def latency_for(self, model_name):
+        return self.model_latencies.get(model_name, self.latency)
+
+    def respond(self, agent_name, messages, tools, model_name=None):
+        time.sleep(self.latency_for(model_name).sample())
+        return self._reply(agent_name, messages, tools)
+
+    async def arespond(self, agent_name, messages, tools, model_name=None):
+        await asyncio.sleep(self.latency_for(model_name).sample())
+        return self._reply(agent_name, messages, tools)
+
+    def _reply(self, agent_name, messages, tools):
+        if self._should_fail():
+            raise StubFailure(f"stub llm error (429) for {agent_name}")
+        prompt_chars = sum(len(str(getattr(m, "content", None) or (m.get("content") if isinstance(m, dict) else ""))) for m in messages)
+        tool_results = sum(1 for m in messages if getattr(m, "type", None) == "tool")
+        if tools and tool_results < self.tool_calls_per_run:
+            content = ""
+            tool_calls = [{"name": "get_search_result", "args": {"query": f"{agent_name} 查询 {tool_results}"},
+                           "id": f"call_{agent_name}_{tool_results}"}]
+        else:
+            content = FINAL_ANSWERS.get(agent_name, lambda: "{}")()
+            tool_calls = []
+        input_tokens = prompt_chars // 2
+        output_tokens = max(len(content) // 2, 1)
+        return AIMessage(content=content, tool_calls=tool_calls, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+        })
+
+
+class StubChatModel:
+    """替代 ChatOpenAI 的桩模型，接口只覆盖智能体用到的部分"""
+
+    def __init__(self, backend, name="Agent", model_name="stub-model", tools=None, bound_kwargs=None, **kwargs):
+        self.backend = backend
+        self.name = name
+        self.model_name = model_name
+        self.tools = tools or []
+        self.kwargs = dict(bound_kwargs or {})
+
+    def bind(self, **kwargs):
+        # 桩模型的回复本身就是 JSON，response_format 只记录在 kwargs 中参与请求签名
+        return StubChatModel(self.backend, name=self.name, model_name=self.model_name, tools=self.tools,
+                             bound_kwargs=dict(self.kwargs, **kwargs))
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        # tool_choice="none" 时模型不会再返回工具调用
+        if tool_choice == "none":
+            tools = []
+        return StubChatModel(self.backend, name=self.name, model_name=self.model_name,
+                             tools=[getattr(tool, "name", getattr(tool, "__name__", str(tool))) for tool in tools])
+
+    def invoke(self, messages, *args, **kwargs):
+        return self.backend.respond(self.name, messages, self.tools, self.model_name)
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        return await self.backend.arespond(self.name, messages, self.tools, self.model_name)
+
+
+class StubHTTPBackend:
+    """
+    模拟外部HTTP服务：搜索API、网页、高德地理编码与公交路线
+    通过替换 requests.Session.request 生效，因此覆盖 requests.get/requests.request 和自建 Session
+    """
+
+    def __init__(self, latency, failure_rate=0.0, page_bytes=20000, results_per_query=5, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.page_bytes = page_bytes
+        self.results_per_query = results_per_query
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.failures = 0
+        self._original_request = None
+
+    def _response(self, url, status_code, body, content_type):
+        response = requests.models.Response()
+        response.status_code = status_code
+        response.url = url
+        response.headers["Content-Type"] = content_type
+        response._content = body.encode("utf-8")
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        return response
+
+    def _page_html(self, path):
+        paragraph = f"<p>{path} 景点介绍，开放时间08:30-17:00，门票60元，地址市中心。</p>"
+        body = paragraph * max(self.page_bytes // len(paragraph.encode("utf-8")), 1)
+        return (f"<html><head><title>{path}</title><script>var x = 1;</script><style>p {{}}</style></head>"
+                f"<body><nav>首页 | 攻略 | 酒店</nav>{body}</body></html>")
+
+    def handle(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.calls[host] = self.calls.get(host, 0) + 1
+            fail = bool(self.failure_rate) and self.rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        time.sleep(self.latency.sample())
+        if fail:
+            return self._response(url, 429 if host == urlparse(STUB_SEARCH_URL).netloc else 503, "stub failure", "text/plain")
+        if url.startswith(STUB_SEARCH_URL):
+            pages = [{"url": f"http://{STUB_PAGE_HOST}/page/{self.rng.randint(0, 10000)}"} for _ in range(self.results_per_query)]
+            return self._response(url, 200, json.dumps({"data": {"webPages": {"value": pages}}}), "application/json")
+        if host == STUB_PAGE_HOST:
+            return self._response(url, 200, self._page_html(urlparse(url).path), "text/html; charset=utf-8")
+        if "restapi.amap.com" in host and "geocode" in url:
+            # 批量地理编码的地址以 "|" 分隔，每个地址返回一条结果
+            addresses = str((kwargs.get("params") or {}).get("address", "")).split("|")
+            geocodes = [{"location": "104.06,30.67", "citycode": "028"} for _ in addresses]
+            return self._response(url, 200, json.dumps({"status": "1", "geocodes": geocodes}), "application/json")
+        if "restapi.amap.com" in host:
+            return self._response(url, 200, json.dumps({"status": "1", "route": {"transits": [{"cost": {"duration": "3600"}}]}}), "application/json")
+        return self._response(url, 404, "not found", "text/plain")
+
+    def install(self):
+        """替换 requests.Session.request"""
+        backend = self
+        self._original_request = requests.sessions.Session.request
+
+        def request(session, method, url, *args, **kwargs):
+            return backend.handle(method, url, **kwargs)
+
+        requests.sessions.Session.request = request
+
+    def uninstall(self):
+        if self._original_request is not None:
+            requests.sessions.Session.request = self._original_request
+            self._original_request = None
@@ -16,6 +16,7 @@ import sys
 import base64
 from io import BytesIO
 from agent import clean_json_markdown
+from utils.tracing import tracer
 
 def get_chinese_font():
     """获取系统中可用的中文字体"""
@@ -355,7 +356,8 @@ class DailyPosterGenerator:
         
         generated_posters = []
         for idx, day_data in enumerate(self.daily_plans):
-            poster_data = self.create_poster(day_data, idx)
+            with tracer.span("poster.render", day=day_data.get('day', idx + 1)):
+                poster_data = self.create_poster(day_data, idx)
             generated_posters.append(poster_data)
         
         print(f"\n✨ 完成！共生成 {len(generated_posters)} 张海报")
@@ -1,9 +1,16 @@
+import os
 import json
+import asyncio
+import inspect
 import concurrent.futures
 
 from roleplay import *
-from agent import Seperate_Task_Agent, Safe_Answer_Agent, Budget_Agent, Attractions_Agent, Dining_Agent, Hotel_Agent, Traffic_Agent, Plan_Agent, Single_Agent
+from agent import Seperate_Task_Agent, Safe_Answer_Agent, Budget_Agent, Attractions_Agent, Dining_Agent, Hotel_Agent, Traffic_Agent, Plan_Agent, Single_Agent, clean_json_markdown
 from utils.utils import clean_and_parse_json
+from utils.tracing import tracer, submit_with_context
+from utils.concurrency import get_agent_executor
+from utils.usage import usage_tracker
+from utils.checkpoint import StageCheckpointStore, STAGE_COMPLETED, STAGE_FAILED, STAGE_TIMEOUT, STAGE_SKIPPED
 from langchain_core.messages import messages_to_dict, messages_from_dict
 
 def single_agent(origin,destination, days, budget_level, preferences, start_date):
@@ -12,22 +19,7 @@ def single_agent(origin,destination, days, budget_level, preferences, start_date
     user_message = f"我的出发地是{origin}，要去{destination}，计划{days}天，预算{budget_level}元，偏好{preferences}，出发时间为{start_date}"
     try:
         safety_check_result = safe_answer_agent.run(user_message)
-        clean_safety_check_result = clean_and_parse_json(safety_check_result)
-        safety_check_result = clean_safety_check_result if clean_safety_check_result else safety_check_result   
-        try:
-            safety_data = json.loads(safety_check_result) if isinstance(safety_check_result, str) else safety_check_result
-        except json.JSONDecodeError:
-            safety_data = safety_check_result 
-        
-        # Check if the input is allowed/travel-related
-        is_travel_related = False
-        if isinstance(safety_data, dict):
-            is_allowed = safety_data.get("is_allowed", False)
-            category = safety_data.get("category", "").lower()
-            is_travel_related = is_allowed or "旅游" in category or "旅行" in category or "travel" in category
-        elif isinstance(safety_data, str):
-            is_travel_related = "旅游" in safety_data or "旅行" in safety_data or "travel" in safety_data.lower() or '"is_allowed": true' in safety_data.lower()
-        
+        is_travel_related, safety_data = parse_safety_result(safety_check_result)
         if not is_travel_related:
             return {
                 "error": "输入内容不符合旅游相关要求",
@@ -46,141 +38,459 @@ def single_agent(origin,destination, days, budget_level, preferences, start_date
         }
     return llm_result
 
-# Function to generate travel plan
-def generate_travel_plan(origin,destination, days, budget_level, preferences, start_date):
-    # Initialize all agents once for efficiency
-    safe_answer_agent = Safe_Answer_Agent()
-    task_seperate_agent = Seperate_Task_Agent()
-    attractions_agent = Attractions_Agent()
-    traffic_agent = Traffic_Agent()
-    hotel_agent = Hotel_Agent()
-    dining_agent = Dining_Agent()
-    budget_agent = Budget_Agent()
-    plan_agent = Plan_Agent()
-    
-    # Create user message
-    user_message = f"出发地是{origin}，我要去{destination}，计划{days}天，预算{budget_level}，偏好{preferences}"
-    
-    # Step 1: Check if input is travel-related using Safe_Answer_Agent
-    try:
-        safety_check_result = safe_answer_agent.run(user_message)
-        clean_safety_check_result = clean_and_parse_json(safety_check_result)
-        safety_check_result = clean_safety_check_result if clean_safety_check_result else safety_check_result
+def build_template_tasks(origin, destination, days, budget_level, preferences, start_date):
+    """
+    根据表单字段在本地生成任务列表，结构与 Seperate_Task_Agent 的输出一致
+    表单请求的任务分解几乎固定为预算、景点、交通、美食四类，无需调用LLM
+    """
+    preference_text = "、".join(preferences) if isinstance(preferences, (list, tuple)) else str(preferences or "")
+    preference_text = preference_text or "无特殊偏好"
+    return [
+        {
+            "name": "旅行预算规划",
+            "type": "budget",
+            "description": f"根据{budget_level}预算等级，估算从{origin}到{destination}{days}天旅行的住宿、交通、餐饮、景点门票、购物等各项费用，并给出节省预算的建议，旅行偏好：{preference_text}",
+            "priority": "high"
+        },
+        {
+            "name": "目的地景点研究",
+            "type": "attraction",
+            "description": f"研究{destination}最具代表性的景点和活动，结合{days}天行程和旅行偏好（{preference_text}）推荐合适的景点，包括开放时间、门票价格、位置和游览时长，出发时间为{start_date}",
+            "priority": "high"
+        },
+        {
+            "name": "往返交通安排",
+            "type": "traffic",
+            "description": f"查询并规划从{origin}到{destination}（如飞机、火车）的往返交通方式、班次、时长及费用，出发时间为{start_date}，行程{days}天",
+            "priority": "high"
+        },
+        {
+            "name": "当地美食推荐",
+            "type": "dining",
+            "description": f"推荐{destination}当地特色美食和餐厅，考虑{budget_level}预算等级和旅行偏好（{preference_text}），提供餐厅位置、人均价格和推荐菜品",
+            "priority": "medium"
+        }
+    ]
+
+# 各阶段的超时时间（秒），可通过环境变量 STAGE_TIMEOUT_<阶段名> 覆盖
+STAGE_TIMEOUTS = {
+    "safety_check": 60,
+    "decomposition": 90,
+    "budget": 120,
+    "attractions": 300,
+    "traffic": 300,
+    "dining": 300,
+    "plan": 300,
+}
+
+# 任务类型与阶段名的对应关系
+TASK_TYPE_STAGES = {
+    "attraction": "attractions",
+    "traffic": "traffic",
+    "dining": "dining",
+}
+
+checkpoint_store = StageCheckpointStore()
+
+
+def stage_timeout(stage):
+    # 多档位任务的阶段名为 "<档位>.<阶段>"，按阶段名取超时时间
+    stage = stage.rsplit(".", 1)[-1]
+    return float(os.getenv(f"STAGE_TIMEOUT_{stage.upper()}", STAGE_TIMEOUTS.get(stage, 300)))
+
+
+def is_error_output(output):
+    """智能体捕获异常后返回的是 {"error": ...} 形式的JSON字符串，视为阶段失败"""
+    data = output
+    if isinstance(output, str):
         try:
-            safety_data = json.loads(safety_check_result) if isinstance(safety_check_result, str) else safety_check_result
+            data = json.loads(clean_json_markdown(output))
         except json.JSONDecodeError:
-            safety_data = safety_check_result
+            return False
+    return isinstance(data, dict) and set(data.keys()) == {"error"}
+
+
+def stage_marker(stage, status, error=None):
+    """失败、超时或跳过的阶段在结果中的占位标记，告知 Plan_Agent 该部分数据缺失"""
+    return {"stage": stage, "status": status, "error": error, "data_missing": True}
+
+
+class StageRunner:
+    """
+    执行旅行计划的各个阶段，并把每个阶段的输出按 task_id 保存
+    已完成的阶段直接读取检查点；失败或超时的阶段写入标记，之后可单独重试或跳过
+    """
+    def __init__(self, task_id=None, retry_stages=None, skip_stages=None, store=None):
+        self.task_id = task_id
+        self.store = store or checkpoint_store
+        self.retry_stages = set(retry_stages or [])
+        self.skip_stages = set(skip_stages or [])
+        self.checkpoints = self.store.load(task_id) if task_id else {}
+        self.degraded = {}
+
+    def cached(self, stage):
+        checkpoint = self.checkpoints.get(stage)
+        if checkpoint and checkpoint["status"] == STAGE_COMPLETED and stage not in self.retry_stages:
+            return checkpoint
+        return None
+
+    def save(self, stage, output, status=STAGE_COMPLETED, error=None):
+        if status != STAGE_COMPLETED:
+            self.degraded[stage] = {"status": status, "error": error}
+        if self.task_id:
+            self.store.save(self.task_id, stage, output, status=status, error=error)
+
+    def submit(self, stage, func, *args):
+        """
+        提交阶段到共享线程池，返回 future；阶段已完成或被跳过时返回 None
+        阶段在超时后仍可能继续执行，执行完成后照常保存检查点，供之后的重试直接使用
+        """
+        if self.cached(stage) or stage in self.skip_stages:
+            return None
+
+        def run():
+            with tracer.span(f"stage.{stage}"), usage_tracker.stage(stage):
+                output = func(*args)
+            return self.finish(stage, output)
+
+        return submit_with_context(get_agent_executor(), run)
+
+    def finish(self, stage, output):
+        """智能体返回错误时抛出异常，否则保存检查点"""
+        if is_error_output(output):
+            raise RuntimeError(json.loads(clean_json_markdown(output))["error"] if isinstance(output, str) else output["error"])
+        self.save(stage, output)
+        return output
+
+    def resolved(self, stage):
+        """已完成或被跳过的阶段直接返回 (True, 输出或标记)，否则返回 (False, None)"""
+        checkpoint = self.cached(stage)
+        if checkpoint:
+            print(f"[{stage}] 使用检查点结果")
+            return True, checkpoint["output"]
+        if stage in self.skip_stages:
+            marker = stage_marker(stage, STAGE_SKIPPED)
+            self.save(stage, marker, status=STAGE_SKIPPED)
+            return True, marker
+        return False, None
+
+    def fail(self, stage, status, error):
+        print(f"[{stage}] 阶段{status}: {error}")
+        marker = stage_marker(stage, status, error)
+        self.save(stage, marker, status=status, error=error)
+        return marker
+
+    def collect(self, stage, future):
+        """等待阶段结果；成功返回输出，失败、超时或跳过返回标记"""
+        done, output = self.resolved(stage)
+        if done:
+            return output
+        try:
+            return future.result(timeout=stage_timeout(stage))
+        except concurrent.futures.TimeoutError:
+            return self.fail(stage, STAGE_TIMEOUT, f"阶段超时（{stage_timeout(stage):.0f}秒）")
+        except Exception as e:
+            return self.fail(stage, STAGE_FAILED, str(e))
+
+    def run(self, stage, func, *args):
+        return self.collect(stage, self.submit(stage, func, *args))
+
+    def asubmit(self, stage, func, *args):
+        """
+        submit 的异步版本，在当前事件循环中创建任务；func 可以是协程函数，也可以是普通函数
+        """
+        if self.cached(stage) or stage in self.skip_stages:
+            return None
+
+        async def run():
+            with tracer.span(f"stage.{stage}"), usage_tracker.stage(stage):
+                output = func(*args)
+                if inspect.isawaitable(output):
+                    output = await output
+            return self.finish(stage, output)
+
+        return asyncio.ensure_future(run())
+
+    async def acollect(self, stage, task):
+        """collect 的异步版本；超时后阶段任务不会被取消，完成后照常保存检查点"""
+        done, output = self.resolved(stage)
+        if done:
+            return output
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout=stage_timeout(stage))
+        except asyncio.TimeoutError:
+            return self.fail(stage, STAGE_TIMEOUT, f"阶段超时（{stage_timeout(stage):.0f}秒）")
+        except Exception as e:
+            return self.fail(stage, STAGE_FAILED, str(e))
+
+    async def arun(self, stage, func, *args):
+        return await self.acollect(stage, self.asubmit(stage, func, *args))
+
+    def succeeded(self, output):
+        return not (isinstance(output, dict) and output.get("data_missing"))
+
+
+def parse_safety_result(safety_check_result):
+    """解析安全检查结果，返回 (是否与旅游相关, 解析后的数据)；结构化输出时已经是字典"""
+    clean_safety_check_result = clean_and_parse_json(safety_check_result) if isinstance(safety_check_result, str) else safety_check_result
+    safety_check_result = clean_safety_check_result if clean_safety_check_result else safety_check_result
+    try:
+        safety_data = json.loads(safety_check_result) if isinstance(safety_check_result, str) else safety_check_result
+    except json.JSONDecodeError:
+        safety_data = safety_check_result
+    
+    # Check if the input is allowed/travel-related
+    is_travel_related = False
+    if isinstance(safety_data, dict):
+        is_allowed = safety_data.get("is_allowed", False)
+        category = safety_data.get("category", "").lower()
+        is_travel_related = is_allowed or "旅游" in category or "旅行" in category or "travel" in category
+    elif isinstance(safety_data, str):
+        is_travel_related = "旅游" in safety_data or "旅行" in safety_data or "travel" in safety_data.lower() or '"is_allowed": true' in safety_data.lower()
+    return is_travel_related, safety_data
+
+
+def parse_tasks_response(tasks_response):
+    """解析 Seperate_Task_Agent 返回的任务列表"""
+    try:
+        tasks = json.loads(tasks_response) if isinstance(tasks_response, str) else tasks_response
+    except json.JSONDecodeError:
+        tasks = tasks_response
+    
+    if isinstance(tasks, dict):
+        return tasks.get("tasks", [])
+    return []
+
+
+def parse_plan_result(plan_result):
+    """解析 Plan_Agent 返回的行程JSON，结构化输出时已经是字典"""
+    with open("plan_result.json", "w", encoding="utf-8") as f:
+        f.write(plan_result if isinstance(plan_result, str) else json.dumps(plan_result, ensure_ascii=False, indent=2))
+    
+    with tracer.span("stage.plan_parse"):
+        # 清理并解析 JSON，处理可能的 markdown 代码块或格式问题
+        clean_result = clean_and_parse_json(plan_result) if isinstance(plan_result, str) else plan_result
+        if clean_result:
+            plan_result = clean_result
         
-        # Check if the input is allowed/travel-related
-        is_travel_related = False
-        if isinstance(safety_data, dict):
-            is_allowed = safety_data.get("is_allowed", False)
-            category = safety_data.get("category", "").lower()
-            is_travel_related = is_allowed or "旅游" in category or "旅行" in category or "travel" in category
-        elif isinstance(safety_data, str):
-            is_travel_related = "旅游" in safety_data or "旅行" in safety_data or "travel" in safety_data.lower() or '"is_allowed": true' in safety_data.lower()
+        # 解析 JSON
+        if isinstance(plan_result, str):
+            plan_data = json.loads(plan_result)
+        else:
+            plan_data = plan_result
         
+        # 处理双重序列化的情况（LLM 返回的 JSON 字符串被再次序列化）
+        if isinstance(plan_data, str):
+            plan_data = json.loads(plan_data)
+    
+    # 确保返回的是字典且包含 daily_plans
+    if not isinstance(plan_data, dict):
+        raise ValueError("计划数据格式错误")
+    return plan_data
+
+
+def check_safety(runner, safe_answer_agent, user_message):
+    """
+    Step 1: Check if input is travel-related using Safe_Answer_Agent
+    不相关时返回错误结果；安全检查本身失败时继续执行
+    """
+    return safety_error_result(runner, runner.run("safety_check", safe_answer_agent.run, user_message))
+
+
+async def acheck_safety(runner, safe_answer_agent, user_message):
+    return safety_error_result(runner, await runner.arun("safety_check", safe_answer_agent.arun, user_message))
+
+
+def safety_error_result(runner, safety_check_result):
+    if runner.succeeded(safety_check_result):
+        is_travel_related, safety_data = parse_safety_result(safety_check_result)
         if not is_travel_related:
             return {
                 "error": "输入内容不符合旅游相关要求",
                 "message": "请提供与旅游规划相关的内容",
                 "safety_check_result": safety_data
             }
-    except Exception as e:
-        # If safety check fails, we'll still proceed with the task separation
-        print(f"安全检查过程中出现错误: {str(e)}")
-    
-    # Step 2: Analyze and separate tasks
-    try:
-        tasks_response = task_seperate_agent.analyze_task(user_message)
-        
-        try:
-            tasks = json.loads(tasks_response) if isinstance(tasks_response, str) else tasks_response
-        except json.JSONDecodeError:
-            tasks = tasks_response
-        
-        if isinstance(tasks, dict):
-            tasks = tasks.get("tasks", [])
-        else:
-            tasks = []
-        
+    return None
+
+
+def decompose_tasks(runner, task_seperate_agent, user_message, task_mode, origin, destination, days, budget_level, preferences, start_date):
+    """Step 2: Analyze and separate tasks，失败时返回标记"""
+    if task_mode == "template":
+        tasks = runner.run("decomposition", build_template_tasks, origin, destination, days, budget_level, preferences, start_date)
+        print(f"Generated tasks (template): {tasks}")
+    else:
+        tasks = runner.run("decomposition", lambda message: parse_tasks_response(task_seperate_agent.analyze_task(message)), user_message)
         # Debug: Print generated tasks
         print(f"Generated tasks: {tasks}")
-    except Exception as e:
-        return {"error": f"任务分析失败: {str(e)}"}
+    return tasks
+
+
+async def adecompose_tasks(runner, task_seperate_agent, user_message, task_mode, origin, destination, days, budget_level, preferences, start_date):
+    if task_mode == "template":
+        tasks = await runner.arun("decomposition", build_template_tasks, origin, destination, days, budget_level, preferences, start_date)
+        print(f"Generated tasks (template): {tasks}")
+    else:
+        async def decomposition(message):
+            return parse_tasks_response(await task_seperate_agent.aanalyze_task(message))
+
+        tasks = await runner.arun("decomposition", decomposition, user_message)
+        print(f"Generated tasks: {tasks}")
+    return tasks
+
+
+def parse_budget_result(budget_result):
+    """解析 Budget_Agent 的输出：结构化输出时已经是字典，文本能解析为 JSON 时返回字典，否则原样返回"""
+    if not isinstance(budget_result, str):
+        return budget_result
+    clean_budget = clean_and_parse_json(budget_result)
+    return clean_budget if clean_budget else budget_result
+
+
+def budget_outputs(runner, budget_output):
+    """返回 (阶段输出, 可传给其他智能体的预算信息)，预算阶段失败时预算信息为空"""
+    clean_budget = budget_output if runner.succeeded(budget_output) else ""
+    print(f"Budget result: {clean_budget}")
+    return budget_output, clean_budget
+
+
+def budget_stage(budget_agent):
+    """预算阶段在线程池中执行的函数"""
+    return lambda message: parse_budget_result(budget_agent.run(message))
+
+
+def run_budget(runner, stage, budget_agent, description):
+    """预算阶段，返回 (阶段输出, 可传给其他智能体的预算信息)"""
+    return budget_outputs(runner, runner.run(stage, budget_stage(budget_agent), description))
+
+
+async def arun_budget(runner, stage, budget_agent, description):
+    async def budget_stage(message):
+        return parse_budget_result(await budget_agent.arun(message))
+
+    return budget_outputs(runner, await runner.arun(stage, budget_stage, description))
+
+
+def submit_agent_tasks(runner, tasks, agents_by_stage, budget_info="", stage_prefix="", asynchronous=False):
+    """
+    并行提交景点、交通、美食等智能体任务，返回 {阶段名: future}
+    asynchronous 为 True 时在当前事件循环中以 arun 执行，返回 {阶段名: asyncio 任务}
+    """
+    # 使用进程内共享的线程池，对外的并发由 utils.concurrency 中的自适应限制器统一控制
+    futures = {}
+    for task in tasks:
+        stage = TASK_TYPE_STAGES.get(task["type"])
+        if stage is None:
+            # Handle unknown task types
+            print(f"未处理任务类型: {task['type']}")
+            continue
+        if stage not in agents_by_stage or stage in futures:
+            continue
+        if asynchronous:
+            futures[stage] = runner.asubmit(stage_prefix + stage, agents_by_stage[stage].arun, task["description"] + budget_info)
+        else:
+            futures[stage] = runner.submit(stage_prefix + stage, agents_by_stage[stage].run, task["description"] + budget_info)
+    return futures
+
+
+def plan_stage(plan_agent):
+    """行程阶段在线程池中执行的函数"""
+    return lambda message: parse_plan_result(plan_agent.run(message))
+
+
+def build_plan(runner, stage, plan_agent, plan_input, task_id, degraded_prefixes=None):
+    """Step 3: Generate comprehensive plan using Plan_Agent"""
+    plan_data = runner.run(stage, plan_stage(plan_agent), str(plan_input))
+    return finish_plan(runner, stage, plan_data, task_id, degraded_prefixes)
+
+
+async def abuild_plan(runner, stage, plan_agent, plan_input, task_id, degraded_prefixes=None):
+    async def plan_stage(message):
+        return parse_plan_result(await plan_agent.arun(message))
+
+    plan_data = await runner.arun(stage, plan_stage, str(plan_input))
+    return finish_plan(runner, stage, plan_data, task_id, degraded_prefixes)
+
+
+def finish_plan(runner, stage, plan_data, task_id, degraded_prefixes=None):
+    """行程阶段失败时返回可重试的错误，降级时附带缺失阶段的信息"""
+    if not runner.succeeded(plan_data):
+        # 上游阶段的结果已保存，可通过 task_id 单独重试行程生成
+        return {"error": f"行程生成失败: {plan_data['error']}", "task_id": task_id, "failed_stage": stage, "retryable": True}
     
-    # Step 2: Collect outputs from all agents
-    agent_outputs = {
+    degraded = {name: info for name, info in runner.degraded.items()
+                if degraded_prefixes is None or "." not in name or name.startswith(tuple(degraded_prefixes))}
+    if degraded:
+        plan_data["degraded_stages"] = degraded
+        # 降级结果不作为最终结果缓存，重试缺失的阶段后会重新生成行程
+        if task_id:
+            checkpoint_store.delete(task_id, [stage])
+    return plan_data
+
+
+# 预算之后并行执行的研究阶段
+RESEARCH_STAGES = ("attractions", "traffic", "dining")
+
+
+def create_agents():
+    """流水线各阶段使用的智能体，按阶段名索引，每个任务创建一次"""
+    return {
+        "safety_check": Safe_Answer_Agent(),
+        "decomposition": Seperate_Task_Agent(),
+        "attractions": Attractions_Agent(),
+        "traffic": Traffic_Agent(),
+        "dining": Dining_Agent(),
+        "budget": Budget_Agent(),
+        "plan": Plan_Agent(),
+    }
+
+
+def prepare_runner(task_id, retry_stages=None, skip_stages=None):
+    """
+    创建阶段执行器，返回 (runner, 已保存的行程或 None)
+    上游阶段被重试或跳过时，行程需要重新生成
+    """
+    runner = StageRunner(task_id, retry_stages=retry_stages, skip_stages=skip_stages)
+    if runner.retry_stages or runner.skip_stages:
+        runner.retry_stages.add("plan")
+    plan_checkpoint = runner.cached("plan")
+    return runner, plan_checkpoint["output"] if plan_checkpoint else None
+
+
+def build_user_message(origin, destination, days, budget_text, preferences, user_text, task_mode):
+    """返回 (用户消息, 任务分解方式)；提供自由文本需求时作为安全检查和任务分解的输入，并使用 LLM 分解任务"""
+    user_message = f"出发地是{origin}，我要去{destination}，计划{days}天，预算{budget_text}，偏好{preferences}"
+    if user_text:
+        return f"{user_text}（{user_message}）", "llm"
+    return user_message, task_mode
+
+
+def decomposition_error(tasks, task_id):
+    return {"error": f"任务分析失败: {tasks['error']}", "task_id": task_id, "failed_stage": "decomposition", "retryable": True}
+
+
+def split_budget_task(tasks):
+    """返回 (预算任务或 None, 其他任务)：预算阶段先执行，其结果作为其他智能体的输入"""
+    budget_tasks = [task for task in tasks if task["type"] == "budget"]
+    return (budget_tasks[0] if budget_tasks else None), [task for task in tasks if task["type"] != "budget"]
+
+
+def budget_info_text(clean_budget):
+    return f"，预算信息：{clean_budget}" if clean_budget else ""
+
+
+def empty_agent_outputs():
+    return {
         "attractions": None,
         "traffic": None,
         #"hotel": None,
         "dining": None,
         "budget": None
     }
-    clean_budget = ""
-    
-    # Step 2.1: First process budget tasks to get budget information
-    budget_tasks = [task for task in tasks if task["type"] == "budget"]
-    if budget_tasks:
-        budget_task = budget_tasks[0]
-        try:
-            budget_result = budget_agent.run(budget_task["description"])
-            clean_budget = clean_and_parse_json(budget_result)
-            agent_outputs["budget"] = clean_budget if clean_budget else budget_result
-            print(f"Budget result: {clean_budget}")
-        except Exception as e:
-            print(f"处理预算任务时出错: {str(e)}")
-    
-    # Step 2.2: Process other tasks in parallel
-    other_tasks = [task for task in tasks if task["type"] != "budget"]
-    
-    # Helper function to process each task with budget information
-    def process_task(task):
-        task_type_str = task["type"]
-        try:
-            if task_type_str == "attraction":
-                # Pass budget information as a properly formatted string
-                budget_info = f"，预算信息：{clean_budget}" if clean_budget else ""
-                attraction_result = attractions_agent.run(task["description"] + budget_info)
-                clean_attraction = attraction_result
-                return "attractions", clean_attraction if clean_attraction else attraction_result
-            elif task_type_str == "traffic":
-                budget_info = f"，预算信息：{clean_budget}" if clean_budget else ""
-                traffic_result = traffic_agent.run(task["description"] + budget_info)
-                clean_traffic = traffic_result
-                return "traffic", clean_traffic if clean_traffic else traffic_result
-            # elif task_type_str == "hotel":
-            #     hotel_result = hotel_agent.run(task["description"])
-            #     clean_hotel = clean_and_parse_json(hotel_result)
-            #     return "hotel", clean_hotel if clean_hotel else hotel_result
-            elif task_type_str == "dining":
-                budget_info = f"，预算信息：{clean_budget}" if clean_budget else ""
-                dining_result = dining_agent.run(task["description"] + budget_info)
-                clean_dining = dining_result
-                return "dining", clean_dining if clean_dining else dining_result
-            else:
-                # Handle unknown task types
-                print(f"未处理任务类型: {task_type_str}")
-                return task_type_str, None
-        except Exception as e:
-            print(f"处理{task_type_str}任务时出错: {str(e)}")
-            return task_type_str, None
-    
-    # Process other tasks in parallel
-    if other_tasks:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(other_tasks), 3)) as executor:
-            # Submit all tasks to the executor
-            future_to_task = {executor.submit(process_task, task): task for task in other_tasks}
-            
-            # Collect results as they complete
-            for future in concurrent.futures.as_completed(future_to_task):
-                task_type, result = future.result()
-                if result is not None:
-                    agent_outputs[task_type] = result
-    
-    # Step 3: Generate comprehensive plan using Plan_Agent
-    # Format all agent outputs as a single message for Plan_Agent
-    plan_input = {
+
+
+def build_plan_input(destination, days, budget_level, preferences, start_date, agent_outputs):
+    """Plan_Agent 的输入：行程参数和所有智能体的输出"""
+    return {
         "destination": destination,
         "days": days,
         "budget_level": budget_level,
@@ -188,103 +498,174 @@ def generate_travel_plan(origin,destination, days, budget_level, preferences, st
         "start_date": start_date,
         "agents_data": agent_outputs
     }
-    
-    try:
-        plan_result = plan_agent.run(str(plan_input))
-        with open("plan_result.json", "w", encoding="utf-8") as f:
-            f.write(plan_result)
-        
-        # 清理并解析 JSON，处理可能的 markdown 代码块或格式问题
-        clean_result = clean_and_parse_json(plan_result)
-        if clean_result:
-            plan_result = clean_result
-        
-        # 解析 JSON
-        if isinstance(plan_result, str):
-            plan_data = json.loads(plan_result)
+
+
+# Function to generate travel plan
+def generate_travel_plan(origin,destination, days, budget_level, preferences, start_date, task_mode="llm", user_text=None,
+                         task_id=None, retry_stages=None, skip_stages=None):
+    """
+    生成旅行计划
+
+    task_mode: "llm"（默认）使用 Seperate_Task_Agent 分解任务；
+               "template" 使用本地模板生成任务列表（/api/generate-plan 等表单请求显式传入）
+    user_text: 用户的自由文本需求，提供时作为任务分解和安全检查的输入
+    task_id: 提供时各阶段输出按 task_id 保存检查点，再次调用时跳过已完成的阶段
+    retry_stages: 需要重新执行的阶段（即使已有检查点）
+    skip_stages: 直接跳过的阶段，结果中以标记代替
+    """
+    runner, cached_plan = prepare_runner(task_id, retry_stages, skip_stages)
+    if cached_plan:
+        return cached_plan
+    agents = create_agents()
+    user_message, task_mode = build_user_message(origin, destination, days, budget_level, preferences, user_text, task_mode)
+
+    safety_error = check_safety(runner, agents["safety_check"], user_message)
+    if safety_error:
+        return safety_error
+
+    tasks = decompose_tasks(runner, agents["decomposition"], user_message, task_mode, origin, destination, days, budget_level, preferences, start_date)
+    if not runner.succeeded(tasks):
+        return decomposition_error(tasks, task_id)
+
+    # Step 2.1: First process budget tasks to get budget information
+    agent_outputs = empty_agent_outputs()
+    budget_task, other_tasks = split_budget_task(tasks)
+    clean_budget = ""
+    if budget_task:
+        agent_outputs["budget"], clean_budget = run_budget(runner, "budget", agents["budget"], budget_task["description"])
+
+    # Step 2.2: Process other tasks in parallel
+    futures = submit_agent_tasks(runner, other_tasks, {stage: agents[stage] for stage in RESEARCH_STAGES}, budget_info_text(clean_budget))
+    for stage, future in futures.items():
+        agent_outputs[stage] = runner.collect(stage, future)
+
+    # Step 3: Generate comprehensive plan using Plan_Agent
+    plan_input = build_plan_input(destination, days, budget_level, preferences, start_date, agent_outputs)
+    return build_plan(runner, "plan", agents["plan"], plan_input, task_id)
+
+
+async def agenerate_travel_plan(origin, destination, days, budget_level, preferences, start_date, task_mode="llm", user_text=None,
+                                task_id=None, retry_stages=None, skip_stages=None):
+    """
+    generate_travel_plan 的异步版本，参数和返回值相同，阶段顺序和各阶段的输入输出与同步版本共用上面的函数
+    各智能体通过 arun 调用模型，景点、交通、美食阶段在同一个事件循环中并发执行，
+    等待模型响应时不占用线程，适合在一个进程内同时处理大量任务
+    """
+    runner, cached_plan = prepare_runner(task_id, retry_stages, skip_stages)
+    if cached_plan:
+        return cached_plan
+    agents = create_agents()
+    user_message, task_mode = build_user_message(origin, destination, days, budget_level, preferences, user_text, task_mode)
+
+    safety_error = await acheck_safety(runner, agents["safety_check"], user_message)
+    if safety_error:
+        return safety_error
+
+    tasks = await adecompose_tasks(runner, agents["decomposition"], user_message, task_mode, origin, destination, days, budget_level, preferences, start_date)
+    if not runner.succeeded(tasks):
+        return decomposition_error(tasks, task_id)
+
+    agent_outputs = empty_agent_outputs()
+    budget_task, other_tasks = split_budget_task(tasks)
+    clean_budget = ""
+    if budget_task:
+        agent_outputs["budget"], clean_budget = await arun_budget(runner, "budget", agents["budget"], budget_task["description"])
+
+    futures = submit_agent_tasks(runner, other_tasks, {stage: agents[stage] for stage in RESEARCH_STAGES}, budget_info_text(clean_budget),
+                                 asynchronous=True)
+    outputs = await asyncio.gather(*(runner.acollect(stage, future) for stage, future in futures.items()))
+    agent_outputs.update(zip(futures.keys(), outputs))
+
+    plan_input = build_plan_input(destination, days, budget_level, preferences, start_date, agent_outputs)
+    return await abuild_plan(runner, "plan", agents["plan"], plan_input, task_id)
+
+
+# 与预算无关、可在多个预算档位之间共享的智能体阶段
+SHARED_VARIANT_STAGES = ("attractions", "traffic")
+DEFAULT_BUDGET_LEVELS = ["经济", "中等", "豪华"]
+
+
+def generate_travel_plan_variants(origin, destination, days, budget_levels, preferences, start_date, task_mode="llm", user_text=None,
+                                  task_id=None, retry_stages=None, skip_stages=None):
+    """
+    同一行程的多个预算档位（如 经济 / 中等 / 豪华）
+    安全检查、任务分解和与预算无关的景点、交通研究只执行一次，
+    预算、美食和 Plan_Agent 按档位并行执行；各档位的阶段名为 "<档位>.<阶段>"
+
+    Returns:
+        {"budget_levels": [...], "variants": {档位: 行程或错误信息}}
+    """
+    budget_levels = list(budget_levels or DEFAULT_BUDGET_LEVELS)
+    runner = StageRunner(task_id, retry_stages=retry_stages, skip_stages=skip_stages)
+    # 共享阶段被重试或跳过时所有档位的行程都要重新生成，档位内的阶段只影响该档位
+    changed = runner.retry_stages | runner.skip_stages
+    for level in budget_levels:
+        if any("." not in stage or stage.startswith(f"{level}.") for stage in changed):
+            runner.retry_stages.add(f"{level}.plan")
+    cached_plans = {level: runner.cached(f"{level}.plan") for level in budget_levels}
+    if all(cached_plans.values()):
+        return {"budget_levels": budget_levels,
+                "variants": {level: checkpoint["output"] for level, checkpoint in cached_plans.items()}}
+
+    agents = create_agents()
+    levels_text = "/".join(budget_levels)
+    user_message, task_mode = build_user_message(origin, destination, days, f"{levels_text}多个档位", preferences, user_text, task_mode)
+
+    safety_error = check_safety(runner, agents["safety_check"], user_message)
+    if safety_error:
+        return safety_error
+
+    tasks = decompose_tasks(runner, agents["decomposition"], user_message, task_mode, origin, destination, days, levels_text, preferences, start_date)
+    if not runner.succeeded(tasks):
+        return decomposition_error(tasks, task_id)
+
+    # 与预算无关的研究阶段只执行一次，不附带预算信息
+    shared_tasks = [task for task in tasks if TASK_TYPE_STAGES.get(task["type"]) in SHARED_VARIANT_STAGES]
+    shared_futures = submit_agent_tasks(runner, shared_tasks, {stage: agents[stage] for stage in SHARED_VARIANT_STAGES})
+
+    # 各档位按阶段并行推进（预算 → 美食 → 行程），每个阶段都提交到共享线程池，
+    # 调用线程只负责等待结果，不为档位单独创建线程
+    levels = [level for level in budget_levels if not cached_plans[level]]
+    level_tasks = {}
+    for level in levels:
+        # 与预算相关的任务描述按档位生成
+        if task_mode == "template":
+            level_tasks[level] = split_budget_task(build_template_tasks(origin, destination, days, level, preferences, start_date))
         else:
-            plan_data = plan_result
-        
-        # 处理双重序列化的情况（LLM 返回的 JSON 字符串被再次序列化）
-        if isinstance(plan_data, str):
-            plan_data = json.loads(plan_data)
-        
-        # 确保返回的是字典且包含 daily_plans
-        if not isinstance(plan_data, dict):
-            return {"error": "计划数据格式错误"}
-        
-        return plan_data
-        # Extract necessary data from plan_agent result
-        daily_plans = plan_data.get("daily_plans", [])
-        total_cost = plan_data.get("total_cost", 0)
-        acc_cost = plan_data.get("accommodation_cost", 0)
-        attractions = plan_data.get("attractions", [])
-        transport = plan_data.get("transport", {})
-        
-        # Generate summary
-        summary = f"# {destination}{days}日游规划\n\n"
-        summary += f"**出发日期**: {start_date}\n"
-        summary += f"**预算等级**: {budget_level}\n"
-        summary += f"**旅游偏好**: {', '.join(preferences) if preferences else '无特殊偏好'}\n"
-        summary += f"**总预算**: ¥{total_cost:.0f}\n"
-        summary += f"**日均预算**: ¥{total_cost/days:.0f}\n\n"
-        
-        # Generate detailed plan
-        detailed_plan = "## 详细行程安排\n\n"
-        for day_plan in daily_plans:
-            detailed_plan += f"### 第{day_plan['day']}天 ({day_plan['date']})\n\n"
-            detailed_plan += f"**当日预算**: ¥{day_plan['total_day_cost']:.0f}\n\n"
-            for activity in day_plan['activities']:
-                detailed_plan += f"- **{activity['time']}**: {activity['activity']} ({activity['location']})\n"
-                # Add attraction description if available
-                if activity['activity'] in [attr['name'] for attr in attractions]:
-                    attr_desc = next((attr['description'] for attr in attractions if attr['name'] == activity['activity']), '')
-                    if attr_desc:
-                        detailed_plan += f"  - 描述: {attr_desc}\n"
-                detailed_plan += f"  - 耗时: {activity['duration']}小时\n"
-                if int(activity['cost']) > 0:
-                    detailed_plan += f"  - 费用: ¥{activity['cost']}\n"
-            detailed_plan += "\n"
-        
-        # Generate budget breakdown
-        budget_breakdown = "## 预算明细\n\n"
-        budget_breakdown += f"- **住宿费用**: ¥{acc_cost:.0f} ({days-1}晚)\n"
-        transport_total = sum(day.get('transport_cost', 0) for day in daily_plans)
-        budget_breakdown += f"- **交通费用**: ¥{transport_total:.0f}\n"
-        food_total = sum(day.get('food_cost', 0) for day in daily_plans)
-        budget_breakdown += f"- **餐饮费用**: ¥{food_total:.0f}\n"
-        attraction_total = total_cost - acc_cost - transport_total - food_total
-        budget_breakdown += f"- **景点门票**: ¥{max(0, attraction_total):.0f}\n"
-        budget_breakdown += f"- **总费用**: ¥{total_cost:.0f}\n"
-        
-        # # Generate travel tips
-        # tips = "## 旅游小贴士\n\n"
-        # tips += f"1. 当地交通建议: {transport.get('local', '请参考行程中的交通安排')}\n"
-        # expensive_attractions = [attr['name'] for attr in attractions if attr.get('price', 0) > 200]
-        # if expensive_attractions:
-        #     tips += f"2. 建议提前预订门票，尤其是热门景点如{'、'.join(expensive_attractions)}\n"
-        # # Add destination-specific food recommendation
-        # if destination == '北京':
-        #     tips += "3. 当地特色美食推荐: 北京烤鸭\n"
-        # elif destination == '上海':
-        #     tips += "3. 当地特色美食推荐: 小笼包\n"
-        # elif destination == '重庆' or destination == '成都':
-        #     tips += "3. 当地特色美食推荐: 火锅\n"
-        # else:
-        #     tips += "3. 当地特色美食推荐: 请参考行程中的餐饮安排\n"
-        # tips += "4. 请随身携带身份证件\n"
-        # tips += "5. 关注天气变化，合理安排行程\n"
-        
-        return {
-            "summary": summary,
-            "detailed": detailed_plan,
-            "budget": budget_breakdown,
-            #"tips": tips,
-            "daily_plans": daily_plans,
-            "total_cost": total_cost
-        }
-    except Exception as e:
-        return {"error": f"行程生成失败: {str(e)}"}
+            level_tasks[level] = split_budget_task([dict(task, description=f"{task['description']}，预算等级：{level}") for task in tasks])
+    agent_outputs = {level: empty_agent_outputs() for level in levels}
+
+    budget_futures = {level: runner.submit(f"{level}.budget", budget_stage(agents["budget"]), level_tasks[level][0]["description"])
+                      for level in levels if level_tasks[level][0]}
+    budget_infos = {level: "" for level in levels}
+    for level, future in budget_futures.items():
+        agent_outputs[level]["budget"], clean_budget = budget_outputs(runner, runner.collect(f"{level}.budget", future))
+        budget_infos[level] = budget_info_text(clean_budget)
+
+    variant_futures = {}
+    for level in levels:
+        variant_tasks = [task for task in level_tasks[level][1] if TASK_TYPE_STAGES.get(task["type"]) not in SHARED_VARIANT_STAGES]
+        variant_futures[level] = submit_agent_tasks(runner, variant_tasks, {"dining": agents["dining"]}, budget_infos[level],
+                                                    stage_prefix=f"{level}.")
+    # 共享阶段的结果由所有档位共同使用
+    shared_outputs = {stage: runner.collect(stage, future) for stage, future in shared_futures.items()}
+    for level in levels:
+        for stage, future in variant_futures[level].items():
+            agent_outputs[level][stage] = runner.collect(f"{level}.{stage}", future)
+        agent_outputs[level].update(shared_outputs)
+
+    plan_futures = {}
+    for level in levels:
+        plan_input = build_plan_input(destination, days, level, preferences, start_date, agent_outputs[level])
+        plan_futures[level] = runner.submit(f"{level}.plan", plan_stage(agents["plan"]), str(plan_input))
+    variants = {}
+    for level in budget_levels:
+        if cached_plans[level]:
+            variants[level] = cached_plans[level]["output"]
+            continue
+        plan_data = runner.collect(f"{level}.plan", plan_futures[level])
+        variants[level] = finish_plan(runner, f"{level}.plan", plan_data, task_id, degraded_prefixes=[f"{level}."])
+    return {"budget_levels": budget_levels, "variants": variants}
 
 def agent_test():
     """
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# 与 benchmarks 一样，从 backbond_python 目录导入 utils 等模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 导入模块时会创建全局缓存和检查点存储，测试中使用临时数据库，不写入工作目录
+_test_dir = tempfile.mkdtemp(prefix="travel_agent_tests_")
+os.environ.setdefault("CACHE_DB", os.path.join(_test_dir, "cache.db"))
+os.environ.setdefault("CHECKPOINT_DB", os.path.join(_test_dir, "checkpoints.db"))
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from utils.concurrency import AdaptiveLimiter
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def test_additive_increase_about_one_per_limit_successes():
+    limiter = AdaptiveLimiter("test", initial=4, max_limit=64, latency_target=10.0)
+    for _ in range(4):
+        with limiter.slot():
+            pass
+    assert 4.9 < limiter.limit < 5.0
+    assert limiter.stats()["requests"] == 4 and limiter.stats()["in_flight"] == 0
+
+
+def test_increase_stops_at_max_limit():
+    limiter = AdaptiveLimiter("test", initial=2, max_limit=3)
+    for _ in range(20):
+        with limiter.slot():
+            pass
+    assert limiter.limit == 3
+
+
+def test_throttle_halves_limit_with_cooldown():
+    limiter = AdaptiveLimiter("test", initial=16, min_limit=2, cooldown=60.0)
+    for _ in range(2):
+        with pytest.raises(Throttled):
+            with limiter.slot():
+                raise Throttled()
+    # 冷却时间内同一批在途请求的限流只减小一次
+    assert limiter.limit == 8
+    assert limiter.stats()["throttled"] == 2
+
+
+def test_decrease_stops_at_min_limit():
+    limiter = AdaptiveLimiter("test", initial=4, min_limit=3, cooldown=0.0)
+    for _ in range(3):
+        with limiter.slot() as mark_throttled:
+            mark_throttled()
+    assert limiter.limit == 3
+
+
+def test_slow_response_decreases_limit():
+    limiter = AdaptiveLimiter("test", initial=8, latency_target=0.5, cooldown=0.0)
+    limiter.acquire()
+    limiter.release(2.0)
+    assert limiter.limit == 4 and limiter.stats()["slow"] == 1
+
+
+def test_other_errors_keep_limit():
+    limiter = AdaptiveLimiter("test", initial=8)
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError("bad response")
+    assert limiter.limit == 8 and limiter.stats()["errors"] == 1
+
+
+def test_limit_caps_in_flight_requests():
+    limiter = AdaptiveLimiter("test", initial=2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release(0.0)
+    assert limiter.try_acquire()
+
+
+def test_async_waiter_woken_by_release():
+    limiter = AdaptiveLimiter("test", initial=1)
+
+    async def main():
+        order = []
+
+        async def request(name):
+            async with limiter.aslot():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(request("a"), request("b"))
+        return order
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert limiter.stats()["in_flight"] == 0
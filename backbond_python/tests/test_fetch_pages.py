@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("requests")
+
+import agent_tools
+from agent_tools import fetch_pages
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    """按 URL 配置下载耗时和结果：{url: (秒数, 结果)}"""
+    responses = {}
+
+    def get_url_content(url):
+        delay, page = responses[url]
+        time.sleep(delay)
+        return page
+
+    monkeypatch.setattr(agent_tools, "get_url_content", get_url_content)
+    return responses
+
+
+def url_data(*urls):
+    return [{"url": url} for url in urls]
+
+
+def test_pages_returned_in_rank_order(pages):
+    pages.update({"a": (0.3, {"clean_text": "A"}), "b": (0.1, {"clean_text": "B"}), "c": (0.0, {"clean_text": "C"})})
+    assert fetch_pages(url_data("a", "b", "c"), max_pages=3, fanout=3, deadline=5) == ["A", "B", "C"]
+
+
+def test_returns_once_enough_pages_succeed(pages):
+    pages.update({"a": (1.0, {"clean_text": "A"}), "b": (0.0, {"clean_text": "B"}), "c": (0.0, {"clean_text": "C"})})
+    start = time.monotonic()
+    assert fetch_pages(url_data("a", "b", "c"), max_pages=2, fanout=3, deadline=5) == ["B", "C"]
+    assert time.monotonic() - start < 0.8
+
+
+def test_deadline_returns_completed_pages_in_rank_order(pages):
+    pages.update({"a": (1.0, {"clean_text": "A"}), "b": (0.1, {"clean_text": "B"}), "c": (0.0, {"clean_text": "C"}),
+                  "d": (1.0, {"clean_text": "D"})})
+    start = time.monotonic()
+    assert fetch_pages(url_data("a", "b", "c", "d"), max_pages=3, fanout=4, deadline=0.3) == ["B", "C"]
+    assert time.monotonic() - start < 0.8
+
+
+def test_failed_pages_and_results_beyond_fanout_are_skipped(pages):
+    pages.update({"a": (0.0, {"error": "HTTP 503"}), "b": (0.0, {"clean_text": "B"}), "c": (0.0, {"clean_text": "C"})})
+    assert fetch_pages(url_data("a", "b", "c"), max_pages=2, fanout=2, deadline=5) == ["B"]
+    assert fetch_pages([], max_pages=2) == []
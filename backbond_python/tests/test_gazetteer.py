@@ -0,0 +1,42 @@
+import pytest
+
+from utils.gazetteer import Gazetteer
+
+
+@pytest.fixture(scope="module")
+def gazetteer():
+    gazetteer = Gazetteer(coords_file="")
+    gazetteer.load()
+    assert gazetteer.stations, "缺少 useful_scripts/railway_stations_*.json"
+    return gazetteer
+
+
+@pytest.mark.parametrize("text", ["长城", "泰山", "八达岭", "武当山", "峨眉山"])
+def test_landmarks_named_like_stations_are_not_resolved(gazetteer, text):
+    assert text in gazetteer.stations
+    assert gazetteer.resolve(text) is None
+
+
+@pytest.mark.parametrize("text", ["泰山站", "八达岭火车站"])
+def test_explicit_station_suffix_resolves_station(gazetteer, text):
+    entry = gazetteer.resolve(text)
+    assert entry["station"] == text.replace("火车站", "").replace("站", "")
+    assert entry["query"] == f"{entry['station']}站"
+
+
+@pytest.mark.parametrize("text", ["北京", "北京市", "beijing", "Bei Jing", "四川省成都市", "四川成都"])
+def test_city_spellings_resolve_to_canonical_city(gazetteer, text):
+    entry = gazetteer.resolve(text)
+    assert entry["station"] is None
+    assert entry["query"] == entry["city"]
+    assert entry["city"] in ("北京", "成都")
+
+
+def test_station_telecode_and_pinyin(gazetteer):
+    assert gazetteer.resolve("BXP")["station"] == "北京西"
+    assert gazetteer.resolve("beijingxi")["station"] == "北京西"
+    assert gazetteer.resolve("北京西站")["city"] == "北京"
+
+
+def test_free_form_address_is_not_resolved(gazetteer):
+    assert gazetteer.resolve("上海市浦东新区世纪大道") is None
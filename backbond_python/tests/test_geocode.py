@@ -0,0 +1,78 @@
+import uuid
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+
+import utils.geocode as geocode
+from utils.geocode import Geocoder, AMAP_BATCH_SIZE
+
+
+@pytest.fixture
+def amap(monkeypatch):
+    """替换高德批量地理编码，记录每批请求的地址；failing 中的地址解析失败"""
+    monkeypatch.setattr(geocode.gazetteer, "enabled", False)
+    calls = {"batches": [], "failing": set(), "raise": False}
+    lock = threading.Lock()
+
+    def batch_geocode(addresses):
+        with lock:
+            calls["batches"].append(list(addresses))
+        if calls["raise"]:
+            raise ConnectionError("reset")
+        return [None if address in calls["failing"] else
+                {"address": address, "location": "104.06,30.67", "citycode": "028", "adcode": "510104"}
+                for address in addresses]
+
+    monkeypatch.setattr(geocode, "amap_batch_geocode", batch_geocode)
+    return calls
+
+
+def addresses(count):
+    prefix = uuid.uuid4().hex[:8]
+    return [f"成都{prefix}地点{index}" for index in range(count)]
+
+
+def test_misses_are_sent_in_batches(amap):
+    names = addresses(2 * AMAP_BATCH_SIZE + 3)
+    # 重复和只有空白不同的地址只请求一次
+    results = Geocoder().geocode_many(names + [names[0], f" {names[1]} "])
+    assert sorted(len(batch) for batch in amap["batches"]) == [3, AMAP_BATCH_SIZE, AMAP_BATCH_SIZE]
+    assert sorted(address for batch in amap["batches"] for address in batch) == sorted(names)
+    assert all(results[name]["location"] == "104.06,30.67" for name in names)
+    assert results[f" {names[1]} "]["address"] == f" {names[1]} "
+
+
+def test_cache_hits_skip_requests(amap):
+    names = addresses(3)
+    Geocoder().geocode_many(names)
+    amap["batches"].clear()
+    geocoder = Geocoder()
+    results = geocoder.geocode_many(names + addresses(1))
+    assert len(amap["batches"]) == 1 and len(amap["batches"][0]) == 1
+    assert all(results[name]["citycode"] == "028" for name in names)
+    assert geocoder.stats()["hits"] == 3 and geocoder.stats()["misses"] == 1
+
+
+def test_failures_are_not_cached(amap):
+    names = addresses(3)
+    amap["failing"].add(names[1])
+    geocoder = Geocoder()
+    results = geocoder.geocode_many(names)
+    assert results[names[1]] is None and results[names[0]] is not None
+    assert geocoder.stats()["failures"] == 1
+    amap["batches"].clear()
+    amap["failing"].clear()
+    assert geocoder.geocode(names[1])["location"] == "104.06,30.67"
+    assert amap["batches"] == [[names[1]]]
+
+
+def test_request_errors_are_not_cached(amap):
+    names = addresses(2)
+    amap["raise"] = True
+    assert Geocoder().geocode_many(names) == {name: None for name in names}
+    amap["raise"] = False
+    amap["batches"].clear()
+    Geocoder().geocode_many(names)
+    assert sorted(amap["batches"][0]) == sorted(names)
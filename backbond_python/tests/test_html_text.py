@@ -0,0 +1,78 @@
+import codecs
+
+from utils.html_text import extract_text_stream, detect_charset, is_text_content_type
+
+
+def html(body, head=""):
+    return f"<html><head>{head}<title>t</title></head><body>{body}</body></html>"
+
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+class CountingChunks:
+    """记录被读取的块数，用于确认提前停止读取"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+def test_byte_cap_stops_reading():
+    data = html("<p>成都景点介绍，门票六十元。</p>" * 5000).encode("utf-8")
+    chunks = CountingChunks(chunked(data, 1024))
+    text, info = extract_text_stream(chunks, "text/html; charset=utf-8", max_chars=10 ** 6, max_bytes=10000)
+    assert info["bytes_read"] == 10000 and info["truncated"]
+    assert chunks.read == 10
+    assert text.startswith("t") and "成都景点介绍" in text
+
+
+def test_stops_once_enough_text_is_collected():
+    data = html("<p>宽窄巷子位于成都市青羊区。</p>" * 5000).encode("utf-8")
+    chunks = CountingChunks(chunked(data, 8192))
+    text, info = extract_text_stream(chunks, "text/html", max_chars=100)
+    assert len(text) == 100 and info["truncated"]
+    assert chunks.read < len(chunks.chunks)
+
+
+def test_small_document_is_read_completely():
+    data = html("<script>var x = '脚本';</script><nav>首页</nav><p>正文</p>").encode("utf-8")
+    text, info = extract_text_stream(chunked(data, 7), "text/html")
+    assert text == "t\n正文"
+    assert codecs.lookup(info["encoding"]).name == "utf-8"
+    assert info["bytes_read"] == len(data) and not info["truncated"]
+
+
+def test_multibyte_characters_split_across_chunks():
+    data = html("<p>" + "峨眉山金顶" * 2000 + "</p>").encode("utf-8")
+    text, info = extract_text_stream(chunked(data, 3001), "text/html; charset=utf-8", max_chars=10 ** 6)
+    assert "�" not in text and text.endswith("峨眉山金顶")
+
+
+def test_charset_from_content_type():
+    data = html("<p>重庆火锅</p>" * 500).encode("gbk")
+    text, info = extract_text_stream(chunked(data, 1000), "text/html; charset=GBK")
+    assert info["encoding"] == "gb18030" and "重庆火锅" in text
+
+
+def test_charset_from_meta_tag():
+    data = html("<p>兴义万峰林</p>", head='<meta http-equiv="Content-Type" content="text/html; charset=gb2312">').encode("gbk")
+    text, info = extract_text_stream([data], "text/html")
+    assert info["encoding"] == "gb18030" and "兴义万峰林" in text
+
+
+def test_charset_precedence():
+    head = codecs.BOM_UTF8 + b'<meta charset="gbk">'
+    assert detect_charset("text/html; charset=iso-8859-1", head) == "utf-8-sig"
+    assert detect_charset("text/html; charset=utf-8", b'<meta charset="gbk">') == "utf-8"
+    assert detect_charset("text/html; charset=unknown-charset", b'<meta charset="gbk">') == "gb18030"
+
+
+def test_text_content_types():
+    assert is_text_content_type("text/html; charset=utf-8") and is_text_content_type(None)
+    assert not is_text_content_type("application/pdf")
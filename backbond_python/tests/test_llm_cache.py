@@ -0,0 +1,17 @@
+from utils.llm_cache import LLMResponseCache
+
+
+def request(**extra):
+    return dict({"model": "m", "tools": [], "messages": [{"role": "user", "content": "预算"}]}, **extra)
+
+
+def test_key_separates_structured_and_text_requests():
+    schema = {"type": "json_schema", "json_schema": {"name": "budget"}}
+    assert LLMResponseCache.make_key(request()) != LLMResponseCache.make_key(request(response_format=schema))
+    assert (LLMResponseCache.make_key(request(response_format={"type": "json_object"}))
+            != LLMResponseCache.make_key(request(response_format=schema)))
+
+
+def test_key_separates_model_params():
+    assert (LLMResponseCache.make_key(request(params={"temperature": 0, "max_tokens": 256}))
+            != LLMResponseCache.make_key(request(params={"temperature": 0.7})))
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
+
+from utils.message_compaction import compact_messages, digest_tool_result, DIGEST_PREFIX, OMITTED_CONTENT
+
+PAGE = "宽窄巷子位于成都市青羊区，门票免费，全天开放。" + "这里的街巷风景很好看，适合慢慢散步拍照留念。" * 40
+
+
+def tool_round(index, content=PAGE):
+    call_id = f"call_{index}"
+    return [AIMessage(content="", tool_calls=[{"name": "get_search_result", "args": {"query": str(index)}, "id": call_id}]),
+            ToolMessage(content=json.dumps([content], ensure_ascii=False), tool_call_id=call_id, name="get_search_result")]
+
+
+def conversation(rounds):
+    messages = [SystemMessage(content="你是景点推荐助手"), HumanMessage(content="推荐成都景点")]
+    for index in range(rounds):
+        messages += tool_round(index)
+    return messages
+
+
+def test_under_budget_is_unchanged():
+    messages = conversation(2)
+    assert compact_messages(messages, budget=10 ** 6) == (messages, 0, 0)
+
+
+def test_last_tool_result_is_kept():
+    messages = conversation(3)
+    compacted, changed, saved = compact_messages(messages, budget=100, digest_chars=200)
+    assert changed == 2 and saved > 0
+    # 模型还没看过的最新工具结果保持原样
+    assert compacted[-1] is messages[-1]
+    for message in compacted[2:-2]:
+        if isinstance(message, ToolMessage):
+            assert message.content.startswith((DIGEST_PREFIX, OMITTED_CONTENT))
+    # 图的状态中仍保留完整历史
+    assert messages[3].content.startswith("[")
+
+
+def test_tool_call_pairing_is_preserved():
+    messages = conversation(3)
+    compacted, _, _ = compact_messages(messages, budget=1, digest_chars=100)
+    assert len(compacted) == len(messages)
+    for original, message in zip(messages, compacted):
+        assert type(message) is type(original)
+        if isinstance(message, ToolMessage):
+            assert message.tool_call_id == original.tool_call_id and message.name == original.name
+        if isinstance(message, AIMessage):
+            assert message is original
+    # 超出预算时从最早的工具结果开始整条省略
+    assert compacted[3].content == OMITTED_CONTENT
+
+
+def test_digest_keeps_facts():
+    digest = digest_tool_result(json.dumps([PAGE], ensure_ascii=False), max_chars=100)
+    assert digest.startswith(DIGEST_PREFIX)
+    assert "门票免费" in digest and len(digest) < len(PAGE)
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from utils.concurrency import AdaptiveLimiter
+from utils.rate_limit import CircuitBreaker, CircuitOpenError, EndpointGuard
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def fail(status_code):
+    def func():
+        raise StatusError(status_code)
+    return func
+
+
+def open_guard(reset_timeout=0.0, probe_timeout=60.0):
+    """返回一个已经熔断、冷却时间为 reset_timeout 的 EndpointGuard"""
+    guard = EndpointGuard("test", max_retries=0)
+    guard.breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=reset_timeout,
+                                   probe_timeout=probe_timeout)
+    with pytest.raises(StatusError):
+        guard.call(fail(503))
+    assert guard.breaker.state == "open"
+    return guard
+
+
+def test_non_retryable_probe_reopens_breaker():
+    guard = open_guard()
+    with pytest.raises(StatusError):
+        guard.call(fail(400))
+    assert guard.breaker.state == "open"
+    assert not guard.breaker.probing
+    # 冷却结束后放行新的探测请求，成功后恢复
+    assert guard.call(lambda: "ok") == "ok"
+    assert guard.breaker.state == "closed"
+
+
+def test_cancelled_probe_reopens_breaker():
+    guard = open_guard()
+
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(guard.acall(cancelled))
+    assert guard.breaker.state == "open"
+    assert not guard.breaker.probing
+
+
+def test_lost_probe_times_out():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.0, probe_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.before_call() is True
+    # 探测请求没有结束（例如线程丢失），超过 probe_timeout 后放行新的探测
+    assert breaker.before_call() is True
+
+
+def test_concurrent_call_rejected_during_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.0, probe_timeout=60.0)
+    breaker.record_failure()
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.finish_probe(True)
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_retried_429_reported_to_limiter(monkeypatch):
+    monkeypatch.setattr("utils.rate_limit.backoff_delay", lambda attempt, error=None: 0.0)
+    limiter = AdaptiveLimiter("llm_test", initial=8, cooldown=0.0)
+    guard = EndpointGuard("test", max_retries=3)
+    responses = iter([StatusError(429), StatusError(429), "ok"])
+
+    def func():
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert guard.call(func, limiter=limiter) == "ok"
+    stats = limiter.stats()
+    assert stats["throttled"] == 2
+    assert stats["limit"] < 8
+    assert stats["in_flight"] == 0
@@ -0,0 +1,73 @@
+import uuid
+
+import pytest
+
+from utils.search_cache import SearchResultCache, classify_query, normalize_query
+
+
+@pytest.mark.parametrize("query, query_class, ttl", [
+    ("成都明天天气", "realtime", 3600),
+    ("重庆到成都高铁余票", "realtime", 3600),
+    ("宽窄巷子开放时间", "hours", 6 * 3600),
+    ("都江堰门票价格", "hours", 6 * 3600),
+    ("成都必吃美食推荐", "listing", 7 * 86400),
+    ("兴义景点攻略", "listing", 7 * 86400),
+    ("成都简介", "general", 86400),
+])
+def test_query_class_ttl(query, query_class, ttl):
+    assert classify_query(normalize_query(query)) == (query_class, ttl)
+
+
+def test_ttl_env_override(monkeypatch):
+    monkeypatch.setenv("SEARCH_CACHE_TTL_HOURS", "60")
+    assert classify_query("门票") == ("hours", 60)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SearchResultCache(enabled=True)
+    cache.stored_ttls = {}
+    store_set = cache.store.set
+
+    def record_set(key, value, ttl=None):
+        cache.stored_ttls[key] = ttl
+        return store_set(key, value, ttl=ttl)
+
+    monkeypatch.setattr(cache.store, "set", record_set)
+    return cache
+
+
+def search_stub(calls):
+    def search(query, freshness):
+        calls.append(query)
+        return {"data": {"webPages": {"value": [{"url": f"http://example.com/{uuid.uuid4()}"}]}}}
+    return search
+
+
+def test_stored_with_class_ttl_and_reused(cache):
+    calls = []
+    query = f"宽窄巷子开放时间 {uuid.uuid4()}"
+    first = cache.get_or_search(query, "noLimit", search_stub(calls))
+    # 规范化后相同的查询命中缓存
+    assert cache.get_or_search(f"  {query.upper()} ", "noLimit", search_stub(calls)) == first
+    assert len(calls) == 1
+    assert list(cache.stored_ttls.values()) == [6 * 3600]
+    assert cache.stats()["classes"]["hours"] == {"hits": 1, "misses": 1, "stored": 1, "hit_rate": 0.5}
+
+
+def test_freshness_caps_ttl(cache):
+    cache.get_or_search(f"成都美食推荐 {uuid.uuid4()}", "oneDay", search_stub([]))
+    assert list(cache.stored_ttls.values()) == [3 * 3600]
+
+
+def test_failed_response_not_cached(cache):
+    calls = []
+
+    def failing(query, freshness):
+        calls.append(query)
+        return {"code": 429, "msg": "rate limited"}
+
+    query = f"成都天气 {uuid.uuid4()}"
+    cache.get_or_search(query, "noLimit", failing)
+    cache.get_or_search(query, "noLimit", failing)
+    assert len(calls) == 2 and cache.stored_ttls == {}
@@ -0,0 +1,168 @@
+import json
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("langchain_openai")
+
+import route_generate
+from route_generate import StageRunner, prepare_runner, finish_plan, generate_travel_plan_variants, DEFAULT_BUDGET_LEVELS
+from utils.checkpoint import StageCheckpointStore, STAGE_COMPLETED, STAGE_FAILED, STAGE_TIMEOUT, STAGE_SKIPPED
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StageCheckpointStore(str(tmp_path / "checkpoints.db"))
+
+
+class Calls:
+    """记录阶段函数的调用次数"""
+    def __init__(self, output="ok"):
+        self.output = output
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+        return self.output
+
+
+def test_store_save_load_delete(store):
+    store.save("t1", "budget", {"total": 100})
+    store.save("t1", "dining", None, status=STAGE_FAILED, error="boom")
+    store.save("t2", "budget", "other")
+    checkpoints = store.load("t1")
+    assert checkpoints["budget"]["status"] == STAGE_COMPLETED and checkpoints["budget"]["output"] == {"total": 100}
+    assert checkpoints["dining"]["status"] == STAGE_FAILED and checkpoints["dining"]["error"] == "boom"
+    store.delete("t1", ["dining"])
+    assert set(store.load("t1")) == {"budget"}
+    store.delete("t1")
+    assert store.load("t1") == {} and set(store.load("t2")) == {"budget"}
+
+
+def test_completed_stage_is_reused(store):
+    stage = Calls({"total": 100})
+    assert StageRunner("t", store=store).run("budget", stage, "预算") == {"total": 100}
+    assert StageRunner("t", store=store).run("budget", stage, "预算") == {"total": 100}
+    assert stage.count == 1
+
+
+def test_retry_stage_runs_again(store):
+    stage = Calls("v1")
+    StageRunner("t", store=store).run("budget", stage, "预算")
+    stage.output = "v2"
+    assert StageRunner("t", store=store, retry_stages=["budget"]).run("budget", stage, "预算") == "v2"
+    assert stage.count == 2 and store.load("t")["budget"]["output"] == "v2"
+
+
+def test_skipped_stage_writes_marker(store):
+    stage = Calls()
+    runner = StageRunner("t", store=store, skip_stages=["dining"])
+    output = runner.run("dining", stage, "美食")
+    assert stage.count == 0
+    assert output["status"] == STAGE_SKIPPED and not runner.succeeded(output)
+    assert runner.degraded == {"dining": {"status": STAGE_SKIPPED, "error": None}}
+    assert store.load("t")["dining"]["status"] == STAGE_SKIPPED
+
+
+def test_error_output_fails_stage(store):
+    runner = StageRunner("t", store=store)
+    output = runner.run("traffic", Calls(json.dumps({"error": "交通推荐失败: 429"})), "交通")
+    assert output["status"] == STAGE_FAILED and output["error"] == "交通推荐失败: 429"
+    assert store.load("t")["traffic"]["status"] == STAGE_FAILED
+    # 失败的阶段不作为检查点复用
+    assert StageRunner("t", store=store).run("traffic", Calls("ok"), "交通") == "ok"
+
+
+def test_timeout_degrades_and_late_result_is_saved(store, monkeypatch):
+    monkeypatch.setenv("STAGE_TIMEOUT_DINING", "0.05")
+
+    def slow(message):
+        time.sleep(0.3)
+        return "late"
+
+    runner = StageRunner("t", store=store)
+    future = runner.submit("dining", slow, "美食")
+    output = runner.collect("dining", future)
+    assert output["status"] == STAGE_TIMEOUT and output["data_missing"]
+    assert "dining" in runner.degraded
+    # 超时的阶段继续执行，完成后保存检查点，重试时直接使用
+    assert future.result(timeout=5) == "late"
+    assert store.load("t")["dining"]["status"] == STAGE_COMPLETED
+
+
+def test_level_stage_uses_stage_timeout(store, monkeypatch):
+    monkeypatch.setenv("STAGE_TIMEOUT_PLAN", "7")
+    assert route_generate.stage_timeout("经济.plan") == 7
+
+
+def test_prepare_runner_invalidates_plan_on_retry_or_skip(monkeypatch, store):
+    monkeypatch.setattr(route_generate, "checkpoint_store", store)
+    StageRunner("t", store=store).run("plan", Calls({"daily_plans": []}), "行程")
+    assert prepare_runner("t")[1] == {"daily_plans": []}
+    runner, plan = prepare_runner("t", retry_stages=["dining"])
+    assert plan is None and "plan" in runner.retry_stages
+    runner, plan = prepare_runner("t", skip_stages=["traffic"])
+    assert plan is None and "plan" in runner.retry_stages
+
+
+def test_degraded_plan_is_not_cached(monkeypatch, store):
+    monkeypatch.setattr(route_generate, "checkpoint_store", store)
+    runner = StageRunner("t", store=store, skip_stages=["经济.dining"])
+    runner.run("经济.dining", Calls(), "美食")
+    plan = runner.run("经济.plan", Calls({"daily_plans": []}), "行程")
+    result = finish_plan(runner, "经济.plan", plan, "t", degraded_prefixes=["经济."])
+    assert set(result["degraded_stages"]) == {"经济.dining"}
+    assert "经济.plan" not in store.load("t")
+    # 其他档位的降级阶段不影响该档位
+    other = runner.run("中等.plan", Calls({"daily_plans": []}), "行程")
+    assert "degraded_stages" not in finish_plan(runner, "中等.plan", other, "t", degraded_prefixes=["中等."])
+
+
+class FakeAgent:
+    def __init__(self, name, output, calls):
+        self.name = name
+        self.output = output
+        self.calls = calls
+
+    def run(self, message):
+        self.calls.append(self.name)
+        return self.output
+
+
+@pytest.fixture
+def variant_task(monkeypatch, tmp_path):
+    """所有阶段都已完成的多档位任务，返回 (task_id, 智能体调用记录)"""
+    monkeypatch.chdir(tmp_path)
+    task_id = f"test-{uuid.uuid4()}"
+    outputs = {"safety_check": {"is_allowed": True, "category": "旅游"}, "attractions": "景点", "traffic": "交通",
+               "dining": "美食", "budget": {"total": 100}, "plan": {"daily_plans": []}}
+    calls = []
+    monkeypatch.setattr(route_generate, "create_agents", lambda: {
+        "decomposition": None, **{name: FakeAgent(name, output, calls) for name, output in outputs.items()}})
+    generate_travel_plan_variants("重庆", "兴义", 3, DEFAULT_BUDGET_LEVELS, [], "2026-02-11", task_mode="template", task_id=task_id)
+    assert calls.count("plan") == len(DEFAULT_BUDGET_LEVELS)
+    calls.clear()
+    return task_id, calls
+
+
+def test_variants_reuse_cached_plans(variant_task):
+    task_id, calls = variant_task
+    result = generate_travel_plan_variants("重庆", "兴义", 3, DEFAULT_BUDGET_LEVELS, [], "2026-02-11", task_mode="template", task_id=task_id)
+    assert calls == []
+    assert all(variant == {"daily_plans": []} for variant in result["variants"].values())
+
+
+def test_retrying_level_stage_only_regenerates_that_level(variant_task):
+    task_id, calls = variant_task
+    generate_travel_plan_variants("重庆", "兴义", 3, DEFAULT_BUDGET_LEVELS, [], "2026-02-11", task_mode="template", task_id=task_id,
+                                  retry_stages=["中等.dining"])
+    assert sorted(calls) == ["dining", "plan"]
+
+
+def test_retrying_shared_stage_regenerates_every_level(variant_task):
+    task_id, calls = variant_task
+    generate_travel_plan_variants("重庆", "兴义", 3, DEFAULT_BUDGET_LEVELS, [], "2026-02-11", task_mode="template", task_id=task_id,
+                                  retry_stages=["traffic"])
+    assert sorted(calls) == ["plan"] * len(DEFAULT_BUDGET_LEVELS) + ["traffic"]
@@ -0,0 +1,82 @@
+import json
+from collections import OrderedDict
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("langchain_openai")
+
+from agent import Seperate_Task_Agent
+from route_generate import build_template_tasks, split_budget_task, TASK_TYPE_STAGES
+
+
+def test_template_tasks_cover_every_stage():
+    tasks = build_template_tasks("重庆", "兴义", 3, "中等", ["休闲", "美食"], "2026-02-11")
+    assert [task["type"] for task in tasks] == ["budget", "attraction", "traffic", "dining"]
+    assert all(set(task) == {"name", "type", "description", "priority"} for task in tasks)
+    assert {TASK_TYPE_STAGES[task["type"]] for task in tasks[1:]} == {"attractions", "traffic", "dining"}
+    budget_task, other_tasks = split_budget_task(tasks)
+    assert budget_task["type"] == "budget" and len(other_tasks) == 3
+
+
+def test_template_tasks_use_form_fields():
+    tasks = {task["type"]: task["description"] for task in build_template_tasks("重庆", "兴义", 3, "豪华", ["休闲", "美食"], "2026-02-11")}
+    assert "豪华" in tasks["budget"] and "休闲、美食" in tasks["budget"]
+    assert "兴义" in tasks["attraction"] and "2026-02-11" in tasks["attraction"]
+    assert "从重庆到兴义" in tasks["traffic"]
+    assert "豪华" in tasks["dining"]
+
+
+def test_template_tasks_without_preferences():
+    tasks = build_template_tasks("重庆", "兴义", 3, "经济", [], "2026-02-11")
+    assert "无特殊偏好" in tasks[0]["description"]
+
+
+@pytest.fixture
+def task_agent(monkeypatch):
+    # 不初始化模型，替换模型调用并统计次数；每个测试使用独立的缓存
+    monkeypatch.setattr(Seperate_Task_Agent, "_task_cache", OrderedDict())
+    agent = Seperate_Task_Agent.__new__(Seperate_Task_Agent)
+    agent.calls = []
+    agent.build_messages = lambda message: [message]
+
+    def invoke_structured(messages):
+        agent.calls.append(messages[0])
+        return object(), {"tasks": [{"name": messages[0], "type": "attraction", "description": messages[0], "priority": "high"}]}
+
+    agent.invoke_structured = invoke_structured
+    return agent
+
+
+def test_normalize_message_ignores_punctuation_width_case_and_spaces():
+    assert (Seperate_Task_Agent.normalize_message(" 我想去 成都，玩三天！ Budget ")
+            == Seperate_Task_Agent.normalize_message("我想去成都,玩三天!budget"))
+    assert Seperate_Task_Agent.normalize_message("去成都") != Seperate_Task_Agent.normalize_message("去重庆")
+
+
+def test_decomposition_cache_hit_and_miss(task_agent):
+    first = task_agent.analyze_task("我想去成都，玩三天")
+    assert task_agent.analyze_task("我想去成都, 玩三天") == first
+    assert len(task_agent.calls) == 1
+    task_agent.analyze_task("我想去重庆，玩三天")
+    assert len(task_agent.calls) == 2
+    assert json.loads(first)["tasks"][0]["description"] == "我想去成都，玩三天"
+
+
+def test_decomposition_cache_evicts_least_recently_used(task_agent, monkeypatch):
+    monkeypatch.setattr(Seperate_Task_Agent, "_task_cache_size", 2)
+    task_agent.analyze_task("去成都")
+    task_agent.analyze_task("去重庆")
+    task_agent.analyze_task("去成都")
+    task_agent.analyze_task("去兴义")
+    assert len(task_agent.calls) == 3
+    task_agent.analyze_task("去成都")
+    assert len(task_agent.calls) == 3
+    task_agent.analyze_task("去重庆")
+    assert len(task_agent.calls) == 4
+
+
+def test_failed_decomposition_is_not_cached(task_agent):
+    task_agent.invoke_structured = lambda messages: (_ for _ in ()).throw(RuntimeError("boom"))
+    assert "error" in json.loads(task_agent.analyze_task("去成都"))
+    assert Seperate_Task_Agent.normalize_message("去成都") not in Seperate_Task_Agent._task_cache
@@ -0,0 +1,47 @@
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("langchain_openai")
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agent import Tool_Agent, Attractions_Agent
+
+
+def make_agent(tool_model=None, atool_model=None):
+    # 不初始化模型，只替换执行工具循环的方法
+    agent = Attractions_Agent.__new__(Attractions_Agent)
+    agent.model_chain = []
+    agent.tool_model = tool_model
+    agent.atool_model = atool_model
+    return agent
+
+
+def final_state(message, model, run_stats=None):
+    return {"messages": [HumanMessage(content=message), AIMessage(content="景点列表")]}
+
+
+def test_final_content_returns_last_message_content():
+    state = {"messages": [HumanMessage(content="问题"), AIMessage(content="最终答案")]}
+    assert Tool_Agent.final_content(state) == "最终答案"
+
+
+def test_run_returns_final_content_not_state():
+    assert make_agent(tool_model=final_state).run("成都景点") == "景点列表"
+
+
+def test_arun_returns_final_content_not_state():
+    async def atool_model(message, model, run_stats=None):
+        return final_state(message, model, run_stats)
+
+    assert asyncio.run(make_agent(atool_model=atool_model).arun("成都景点")) == "景点列表"
+
+
+def test_run_failure_returns_error_json():
+    def failing(message, model, run_stats=None):
+        raise RuntimeError("boom")
+
+    assert json.loads(make_agent(tool_model=failing).run("成都景点")) == {"error": "景点推荐失败: boom"}
@@ -0,0 +1,67 @@
+import time
+import threading
+
+import pytest
+
+from utils.url_cache import UrlContentCache
+
+
+def fetch_concurrently(cache, url, fetch, waiters=3):
+    """第一个调用在 fetch 中阻塞，其余调用在它完成前发起，返回各调用的结果或异常"""
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def blocking_fetch(url, validators=None):
+        calls.append(url)
+        started.set()
+        release.wait(5)
+        return fetch(url)
+
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(cache.get_or_fetch(url, blocking_fetch))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    assert started.wait(5)
+    threads += [threading.Thread(target=call) for _ in range(waiters)]
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return calls, outcomes
+
+
+def test_waiters_share_the_leaders_failed_result():
+    cache = UrlContentCache(enabled=True)
+    failure = {"error": "HTTP 503"}
+    calls, outcomes = fetch_concurrently(cache, "https://example.com/a-failed-page", lambda url: failure)
+    assert len(calls) == 1
+    assert outcomes == [failure] * 4
+    assert cache.stats()["waited"] == 3
+
+
+def test_waiters_reraise_the_leaders_error():
+    cache = UrlContentCache(enabled=True)
+
+    def fetch(url):
+        raise ConnectionError("reset")
+
+    calls, outcomes = fetch_concurrently(cache, "https://example.com/a-broken-page", fetch)
+    assert len(calls) == 1
+    assert len(outcomes) == 4 and all(isinstance(outcome, ConnectionError) for outcome in outcomes)
+
+
+def test_successful_fetch_is_cached():
+    cache = UrlContentCache(enabled=True)
+    page = {"url": "https://example.com/page", "text": "内容"}
+    calls, outcomes = fetch_concurrently(cache, "https://example.com/page?utm_source=x", lambda url: page)
+    assert len(calls) == 1 and outcomes == [page] * 4
+    assert cache.get_or_fetch("https://example.com/page", lambda url: pytest.fail("不应重新下载")) == page
@@ -0,0 +1,58 @@
+import uuid
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("langchain_openai")
+
+import agent
+from benchmarks.stubs import LatencyModel, StubLLMBackend, StubChatModel
+from route_generate import generate_travel_plan_variants, DEFAULT_BUDGET_LEVELS
+from utils.llm_cache import llm_cache
+
+
+class CountingBackend(StubLLMBackend):
+    """按智能体统计模型调用次数；不调用工具，每次运行只调用一次模型"""
+    def __init__(self):
+        super().__init__(LatencyModel("fixed", median=0), tool_calls_per_run=0)
+        self.runs = Counter()
+
+    def respond(self, agent_name, messages, tools, model_name=None):
+        with self.lock:
+            self.runs[agent_name] += 1
+        return super().respond(agent_name, messages, tools, model_name)
+
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MODEL", "stub-model")
+    monkeypatch.setenv("BASE_URL", "http://stub-llm.local")
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    monkeypatch.setattr(llm_cache, "enabled", False)
+    backend = CountingBackend()
+    monkeypatch.setattr(agent, "ChatOpenAI", lambda **kwargs: StubChatModel(backend, **kwargs))
+    return backend
+
+
+@pytest.mark.parametrize("task_mode", ["template", "llm"])
+def test_shared_stages_run_once_and_level_stages_once_per_level(backend, task_mode):
+    result = generate_travel_plan_variants("重庆", "成都", 3, DEFAULT_BUDGET_LEVELS, ["美食"], "2026-05-01",
+                                           task_mode=task_mode, task_id=f"test-{uuid.uuid4()}")
+    assert result["budget_levels"] == DEFAULT_BUDGET_LEVELS
+    assert all("daily_plans" in result["variants"][level] for level in DEFAULT_BUDGET_LEVELS)
+    levels = len(DEFAULT_BUDGET_LEVELS)
+    assert backend.runs["Safe_Answer_Agent"] == 1
+    assert backend.runs["Seperate_Task_Agent"] == (1 if task_mode == "llm" else 0)
+    assert backend.runs["Attractions_Agent"] == 1
+    assert backend.runs["Traffic_Agent"] == 1
+    assert backend.runs["Budget_Agent"] == levels
+    assert backend.runs["Dining_Agent"] == levels
+    assert backend.runs["Plan_Agent"] == levels
+
+
+def test_single_level(backend):
+    result = generate_travel_plan_variants("重庆", "成都", 2, ["豪华"], [], "2026-05-01", task_mode="template")
+    assert list(result["variants"]) == ["豪华"]
+    assert backend.runs["Budget_Agent"] == backend.runs["Plan_Agent"] == 1
@@ -0,0 +1,51 @@
+"""
+生成离线地名库（utils.gazetteer）的坐标文件
+
+对车站数据中的每个城市（加 --stations 时还包括每个车站）调用一次高德批量地理编码，
+结果写入 useful_scripts/city_coords.json。之后这些城市/车站的 location_transform 不再请求高德。
+需要在 .env 中配置 gaode_api_key，在 backbond_python 目录下运行：
+    python useful_scripts/build_city_coords.py
+    python useful_scripts/build_city_coords.py --stations --output useful_scripts/city_coords.json
+"""
+
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from utils.gazetteer import gazetteer, GAZETTEER_COORDS_FILE
+from utils.geocode import amap_batch_geocode, AMAP_BATCH_SIZE
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成地名库坐标文件")
+    parser.add_argument("--stations", action="store_true", help="同时解析每个车站的坐标")
+    parser.add_argument("--output", default=GAZETTEER_COORDS_FILE, help="坐标文件路径")
+    args = parser.parse_args(argv)
+    load_dotenv()
+
+    gazetteer.load()
+    names = sorted(gazetteer.cities)
+    if args.stations:
+        names += sorted(f"{station}站" for station in gazetteer.stations)
+    names = list(dict.fromkeys(names))
+
+    coords = {}
+    for start in range(0, len(names), AMAP_BATCH_SIZE):
+        batch = names[start:start + AMAP_BATCH_SIZE]
+        for name, result in zip(batch, amap_batch_geocode(batch)):
+            if result is not None:
+                coords[name] = {"location": result["location"], "citycode": result["citycode"], "adcode": result["adcode"]}
+        print(f"已解析 {min(start + AMAP_BATCH_SIZE, len(names))}/{len(names)}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(coords, f, ensure_ascii=False, indent=2)
+    print(f"共 {len(coords)}/{len(names)} 个地点有坐标，已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import functools
+
+# 录制/回放配置
+# CASSETTE_MODE: off（默认，直接调用）/ record（调用并录制）/ replay（只从录制文件回放，不访问网络）
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "./cassettes")
+CASSETTE_NAME = os.getenv("CASSETTE_NAME", "default")
+# 回放时是否按录制时的耗时进行等待，以及等待时间的缩放比例
+CASSETTE_REPLAY_LATENCY = os.getenv("CASSETTE_REPLAY_LATENCY", "0") == "1"
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "1.0"))
+
+# 请求中会随时间变化的内容（如提示词里的当前时间），计算键时统一替换
+_VOLATILE_PATTERNS = [
+    re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}"),
+]
+
+
+class CassetteMissError(Exception):
+    """回放模式下找不到对应的录制记录"""
+
+
+class CassetteReplayError(Exception):
+    """录制时调用抛出了异常，回放时原样抛出"""
+
+
+def normalize_request(value):
+    """将请求转为可稳定序列化的结构，去除易变内容"""
+    if isinstance(value, str):
+        for pattern in _VOLATILE_PATTERNS:
+            value = pattern.sub("<time>", value)
+        return value
+    if isinstance(value, dict):
+        return {str(key): normalize_request(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_request(item) for item in value]
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return normalize_request(str(value))
+
+
+class Cassette:
+    """
+    外部调用的录制/回放
+    每条记录为一行 JSON：{"kind", "key", "request", "response", "error", "latency"}
+    同一个键录制了多次时，回放按录制顺序依次返回，用完后重复最后一条
+    """
+
+    def __init__(self, mode=CASSETTE_MODE, cassette_dir=CASSETTE_DIR, name=CASSETTE_NAME,
+                 replay_latency=CASSETTE_REPLAY_LATENCY, latency_scale=CASSETTE_LATENCY_SCALE):
+        self.mode = mode
+        self.path = os.path.join(cassette_dir, f"{name}.jsonl")
+        self.replay_latency = replay_latency
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.interactions = {}
+        self.replay_index = {}
+        if self.mode == "replay":
+            self.load()
+
+    @property
+    def enabled(self):
+        return self.mode in ("record", "replay")
+
+    def load(self):
+        """读取录制文件"""
+        self.interactions = {}
+        self.replay_index = {}
+        if not os.path.exists(self.path):
+            print(f"录制文件不存在: {self.path}")
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                self.interactions.setdefault(record["key"], []).append(record)
+
+    @staticmethod
+    def make_key(kind, request):
+        payload = json.dumps(normalize_request(request), ensure_ascii=False, sort_keys=True)
+        return f"{kind}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def _append(self, record):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def _replay(self, kind, key, wait=True):
+        with self.lock:
+            records = self.interactions.get(key)
+            if not records:
+                raise CassetteMissError(f"{kind} 请求没有录制记录: {key}")
+            index = self.replay_index.get(key, 0)
+            self.replay_index[key] = index + 1
+            record = records[min(index, len(records) - 1)]
+        if wait and self.replay_latency and record.get("latency"):
+            time.sleep(record["latency"] * self.latency_scale)
+        return record
+
+    def call(self, kind, request, func, serialize=None, deserialize=None):
+        """
+        按当前模式执行一次外部调用
+
+        Args:
+            kind: 调用类型，如 llm、search、fetch_page、geocode、route
+            request: 请求内容（用于计算键，需可转为 JSON）
+            func: 无参函数，执行真实调用
+            serialize: 将响应转换为可 JSON 序列化的结构
+            deserialize: 将录制的结构还原为响应
+        """
+        if not self.enabled:
+            return func()
+        key = self.make_key(kind, request)
+        if self.mode == "replay":
+            record = self._replay(kind, key)
+            if record.get("error"):
+                raise CassetteReplayError(record["error"])
+            response = record["response"]
+            return deserialize(response) if deserialize else response
+
+        start = time.time()
+        try:
+            response = func()
+        except Exception as e:
+            self._append({"kind": kind, "key": key, "request": normalize_request(request),
+                          "response": None, "error": f"{type(e).__name__}: {str(e)}",
+                          "latency": round(time.time() - start, 4)})
+            raise
+        self._append({"kind": kind, "key": key, "request": normalize_request(request),
+                      "response": serialize(response) if serialize else response, "error": None,
+                      "latency": round(time.time() - start, 4)})
+        return response
+
+    async def acall(self, kind, request, coro_func, serialize=None, deserialize=None):
+        """call() 的异步版本，coro_func 为返回协程的无参函数"""
+        if not self.enabled:
+            return await coro_func()
+        key = self.make_key(kind, request)
+        if self.mode == "replay":
+            record = self._replay(kind, key, wait=False)
+            if self.replay_latency and record.get("latency"):
+                await asyncio.sleep(record["latency"] * self.latency_scale)
+            if record.get("error"):
+                raise CassetteReplayError(record["error"])
+            response = record["response"]
+            return deserialize(response) if deserialize else response
+
+        start = time.time()
+        try:
+            response = await coro_func()
+        except Exception as e:
+            self._append({"kind": kind, "key": key, "request": normalize_request(request),
+                          "response": None, "error": f"{type(e).__name__}: {str(e)}",
+                          "latency": round(time.time() - start, 4)})
+            raise
+        self._append({"kind": kind, "key": key, "request": normalize_request(request),
+                      "response": serialize(response) if serialize else response, "error": None,
+                      "latency": round(time.time() - start, 4)})
+        return response
+
+
+cassette = Cassette()
+
+
+def recorded(kind):
+    """
+    装饰器：对函数调用进行录制/回放，以函数名和参数作为请求
+    函数返回值需可 JSON 序列化
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            request = {"function": func.__name__, "args": list(args), "kwargs": kwargs}
+            return cassette.call(kind, request, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import json
+from datetime import datetime, timedelta
+
+# 阶段状态
+STAGE_COMPLETED = "completed"
+STAGE_FAILED = "failed"
+STAGE_TIMEOUT = "timeout"
+STAGE_SKIPPED = "skipped"
+
+
+class StageCheckpointStore:
+    """
+    按 task_id 保存旅行计划各阶段（安全检查、任务分解、各智能体、行程生成）的输出，
+    失败或超时的阶段可以单独重试或跳过，已成功的阶段不再重复执行
+    """
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv("CHECKPOINT_DB", "checkpoints.db")
+        self.init_db()
+
+    def init_db(self):
+        """初始化数据库表"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stage_checkpoints (
+                    task_id TEXT,
+                    stage TEXT,
+                    status TEXT,  -- 'completed' / 'failed' / 'timeout' / 'skipped'
+                    output TEXT,  -- JSON formatted stage output
+                    error TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (task_id, stage)
+                )
+            ''')
+            conn.commit()
+
+    def save(self, task_id, stage, output=None, status=STAGE_COMPLETED, error=None):
+        """保存阶段输出（覆盖同一阶段的旧记录）"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT OR REPLACE INTO stage_checkpoints (task_id, stage, status, output, error, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)',
+                (task_id, stage, status, json.dumps(output, ensure_ascii=False, default=str), error)
+            )
+            conn.commit()
+
+    def load(self, task_id):
+        """获取任务的全部阶段记录: {stage: {"status", "output", "error", "updated_at"}}"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT stage, status, output, error, updated_at FROM stage_checkpoints WHERE task_id = ?',
+                (task_id,)
+            )
+            results = cursor.fetchall()
+        return {
+            stage: {
+                "status": status,
+                "output": json.loads(output) if output else None,
+                "error": error,
+                "updated_at": updated_at
+            }
+            for stage, status, output, error, updated_at in results
+        }
+
+    def delete(self, task_id, stages=None):
+        """删除任务的阶段记录，stages 为空时删除全部"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            if stages:
+                cursor.executemany(
+                    'DELETE FROM stage_checkpoints WHERE task_id = ? AND stage = ?',
+                    [(task_id, stage) for stage in stages]
+                )
+            else:
+                cursor.execute('DELETE FROM stage_checkpoints WHERE task_id = ?', (task_id,))
+            conn.commit()
+
+    def cleanup_expired(self, expiration_hours=24):
+        """清理过期的阶段记录"""
+        expiration_time = datetime.now() - timedelta(hours=expiration_hours)
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'DELETE FROM stage_checkpoints WHERE updated_at < ?',
+                (expiration_time.strftime('%Y-%m-%d %H:%M:%S'),)
+            )
+            conn.commit()
+            return cursor.rowcount
@@ -0,0 +1,296 @@
+import os
+import time
+import asyncio
+import threading
+import functools
+import concurrent.futures
+from contextlib import contextmanager, asynccontextmanager
+
+# 进程内共享的智能体执行线程池大小（所有任务共用）
+AGENT_EXECUTOR_WORKERS = int(os.getenv("AGENT_EXECUTOR_WORKERS", "32"))
+# 工具内部并发下载网页等 I/O 操作共用的线程池大小，实际对外并发仍由 fetch 等限制器控制
+IO_EXECUTOR_WORKERS = int(os.getenv("IO_EXECUTOR_WORKERS", "32"))
+# 工具内部按条目并发查询（如逐个查询景点）共用的线程池大小；这些查询自身会把下载提交到 I/O 线程池
+LOOKUP_EXECUTOR_WORKERS = int(os.getenv("LOOKUP_EXECUTOR_WORKERS", "16"))
+
+# 各上游的默认并发限制：(初始值, 最小值, 最大值, 延迟目标秒数)
+DEFAULT_LIMITS = {
+    "llm": (8, 1, 64, 60.0),
+    "search": (4, 1, 32, 5.0),
+    "fetch": (16, 2, 64, 10.0),
+}
+
+
+def is_throttle_error(error):
+    """判断异常是否为限流（429）"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code == 429 or "429" in str(error) or "rate limit" in str(error).lower()
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发限制
+    成功且延迟未超过目标时加性增长（每完成 limit 个请求约 +1），
+    遇到限流（429）或延迟超过目标时乘性减小；减小后有冷却时间，避免同一批在途请求反复减小
+    """
+
+    def __init__(self, name, initial=8, min_limit=1, max_limit=64, latency_target=None,
+                 decrease_factor=0.5, cooldown=2.0):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        # 异步调用方的等待者：[(事件循环, future)]，释放名额时在各自的事件循环中唤醒
+        self._async_waiters = []
+        self.last_decrease = 0.0
+        self.stats_data = {"requests": 0, "throttled": 0, "slow": 0, "errors": 0, "waiting": 0,
+                           "wait_time": 0.0, "latency_ewma": None}
+
+    def acquire(self):
+        start = time.time()
+        with self.condition:
+            self.stats_data["waiting"] += 1
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.stats_data["waiting"] -= 1
+            self.in_flight += 1
+            self.stats_data["wait_time"] += time.time() - start
+
+    def try_acquire(self):
+        """不等待地尝试占用一个名额"""
+        with self.condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    async def aacquire(self):
+        """异步等待名额，不占用线程"""
+        start = time.time()
+        while not self.try_acquire():
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            with self.condition:
+                self._async_waiters.append((loop, waiter))
+            # 加入等待列表后再检查一次，避免错过刚刚发生的释放
+            if self.try_acquire():
+                with self.condition:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+                break
+            await waiter
+        with self.condition:
+            self.stats_data["wait_time"] += time.time() - start
+
+    def release(self, latency, throttled=False, error=False):
+        with self.condition:
+            self.in_flight -= 1
+            self.stats_data["requests"] += 1
+            ewma = self.stats_data["latency_ewma"]
+            self.stats_data["latency_ewma"] = latency if ewma is None else ewma * 0.9 + latency * 0.1
+            slow = self.latency_target is not None and latency > self.latency_target
+            if throttled:
+                self.stats_data["throttled"] += 1
+            elif slow:
+                self.stats_data["slow"] += 1
+            elif error:
+                self.stats_data["errors"] += 1
+            if throttled or slow:
+                now = time.time()
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+            elif not error:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+            async_waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in async_waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    @contextmanager
+    def slot(self):
+        """
+        占用一个并发名额，退出时根据耗时和异常调整限制
+        可调用 yield 出的 mark_throttled() 标记上游返回了 429（未抛出异常的情况）
+        """
+        self.acquire()
+        state = {"throttled": False}
+
+        def mark_throttled():
+            state["throttled"] = True
+
+        start = time.time()
+        try:
+            yield mark_throttled
+        except Exception as e:
+            self.release(time.time() - start, throttled=is_throttle_error(e), error=True)
+            raise
+        else:
+            self.release(time.time() - start, throttled=state["throttled"])
+
+    @asynccontextmanager
+    async def aslot(self):
+        """slot() 的异步版本"""
+        await self.aacquire()
+        state = {"throttled": False}
+
+        def mark_throttled():
+            state["throttled"] = True
+
+        start = time.time()
+        try:
+            yield mark_throttled
+        except Exception as e:
+            self.release(time.time() - start, throttled=is_throttle_error(e), error=True)
+            raise
+        else:
+            self.release(time.time() - start, throttled=state["throttled"])
+
+    def stats(self):
+        with self.condition:
+            data = dict(self.stats_data)
+            data.update({"limit": round(self.limit, 2), "in_flight": self.in_flight,
+                         "min_limit": self.min_limit, "max_limit": self.max_limit,
+                         "latency_target": self.latency_target})
+        if data["latency_ewma"] is not None:
+            data["latency_ewma"] = round(data["latency_ewma"], 4)
+        data["wait_time"] = round(data["wait_time"], 4)
+        return data
+
+
+def _build_limiter(name):
+    initial, min_limit, max_limit, latency_target = DEFAULT_LIMITS.get(name, (8, 1, 64, None))
+    prefix = f"CONCURRENCY_{name.upper()}_"
+    target = os.getenv(prefix + "LATENCY_TARGET")
+    return AdaptiveLimiter(
+        name,
+        initial=int(os.getenv(prefix + "INITIAL", initial)),
+        min_limit=int(os.getenv(prefix + "MIN", min_limit)),
+        max_limit=int(os.getenv(prefix + "MAX", max_limit)),
+        latency_target=float(target) if target else latency_target,
+    )
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """获取指定上游（llm / search / fetch 等）的进程级并发限制器"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = _build_limiter(name)
+        return _limiters[name]
+
+
+def limited(name):
+    """
+    装饰器：函数执行期间占用指定上游的并发名额
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_limiter(name).slot():
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_agent_executor = None
+_agent_executor_lock = threading.Lock()
+
+
+def get_agent_executor():
+    """进程内共享的智能体执行线程池，替代每个任务各自创建的线程池"""
+    global _agent_executor
+    with _agent_executor_lock:
+        if _agent_executor is None:
+            _agent_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=AGENT_EXECUTOR_WORKERS, thread_name_prefix="agent")
+        return _agent_executor
+
+
+def set_agent_executor_workers(max_workers):
+    """调整共享线程池大小（用于基准测试），旧线程池中的任务会继续执行完"""
+    global _agent_executor, AGENT_EXECUTOR_WORKERS
+    with _agent_executor_lock:
+        old_executor = _agent_executor
+        AGENT_EXECUTOR_WORKERS = max_workers
+        _agent_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="agent")
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+_io_executor = None
+_io_executor_lock = threading.Lock()
+
+
+def get_io_executor():
+    """进程内共享的 I/O 线程池，工具函数并发下载网页时使用，与智能体线程池分开，避免互相占满"""
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            _io_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=IO_EXECUTOR_WORKERS, thread_name_prefix="io")
+        return _io_executor
+
+
+_lookup_executor = None
+_lookup_executor_lock = threading.Lock()
+
+
+def get_lookup_executor():
+    """
+    进程内共享的查询线程池：其中的任务会等待 I/O 线程池中的下载，
+    因此不能与 I/O 线程池或智能体线程池共用，否则线程池可能被互相等待的线程占满
+    """
+    global _lookup_executor
+    with _lookup_executor_lock:
+        if _lookup_executor is None:
+            _lookup_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=LOOKUP_EXECUTOR_WORKERS, thread_name_prefix="lookup")
+        return _lookup_executor
+
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """进程内共享的后台事件循环（在守护线程中运行），异步流水线的任务都提交到这里"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name="async-pipeline", daemon=True).start()
+        return _event_loop
+
+
+def submit_coroutine(coro):
+    """从任意线程把协程提交到共享事件循环，返回 concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def concurrency_stats():
+    """所有限制器和共享线程池的状态，用于监控接口"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {
+        "agent_executor_workers": AGENT_EXECUTOR_WORKERS,
+        "io_executor_workers": IO_EXECUTOR_WORKERS,
+        "lookup_executor_workers": LOOKUP_EXECUTOR_WORKERS,
+        "limiters": {name: limiter.stats() for name, limiter in limiters.items()},
+    }
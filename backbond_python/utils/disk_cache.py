@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# 所有本地缓存共用一个 SQLite 文件，按 namespace 区分
+CACHE_DB = os.getenv("CACHE_DB", "cache.db")
+
+
+class DiskCache:
+    """
+    基于 SQLite 的本地缓存，支持 TTL 过期和按条目数/字节数淘汰（最久未访问的先淘汰）
+    值以 JSON 保存；同一进程内所有线程共用，多个进程可共享同一个数据库文件
+    """
+    def __init__(self, namespace, db_path=None, default_ttl=86400, max_entries=10000, max_bytes=200 * 1024 * 1024):
+        self.namespace = namespace
+        self.db_path = db_path or CACHE_DB
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes_since_evict = 0
+        self.init_db()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def init_db(self):
+        """初始化数据库表"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT,
+                    key TEXT,
+                    value TEXT,  -- JSON formatted value
+                    created_at REAL,
+                    expires_at REAL,
+                    last_access REAL,
+                    size INTEGER,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_cache_access ON cache_entries (namespace, last_access)')
+            conn.commit()
+
+    def get_entry(self, key):
+        """获取缓存条目 {"value", "created_at", "expires_at"}，不存在或已过期返回 None"""
+        now = time.time()
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT value, created_at, expires_at FROM cache_entries WHERE namespace = ? AND key = ?',
+                (self.namespace, key)
+            )
+            row = cursor.fetchone()
+            if row and row[2] is not None and row[2] < now:
+                cursor.execute('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', (self.namespace, key))
+                row = None
+            elif row:
+                cursor.execute(
+                    'UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND key = ?',
+                    (now, self.namespace, key)
+                )
+            conn.commit()
+        with self.lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not row:
+            return None
+        return {"value": json.loads(row[0]), "created_at": row[1], "expires_at": row[2]}
+
+    def get(self, key, default=None):
+        entry = self.get_entry(key)
+        return entry["value"] if entry else default
+
+    def set(self, key, value, ttl=None):
+        """写入缓存，ttl 为秒数（None 使用默认值，0 表示不过期）"""
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False, default=str)
+        with self.connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (namespace, key, value, created_at, expires_at, last_access, size) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.namespace, key, data, now, now + ttl if ttl else None, now, len(data.encode('utf-8')))
+            )
+            conn.commit()
+        with self.lock:
+            self._writes_since_evict += 1
+            should_evict = self._writes_since_evict >= 50
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def delete(self, key):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', (self.namespace, key))
+            conn.commit()
+
+    def evict(self):
+        """删除过期条目，并按最久未访问淘汰超出条目数或字节数上限的部分"""
+        now = time.time()
+        removed = 0
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at < ?',
+                           (self.namespace, now))
+            removed += cursor.rowcount
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?', (self.namespace,))
+            count, total_bytes = cursor.fetchone()
+            if count > self.max_entries or total_bytes > self.max_bytes:
+                cursor.execute(
+                    'SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY last_access ASC',
+                    (self.namespace,)
+                )
+                stale_keys = []
+                for key, size in cursor.fetchall():
+                    if count <= self.max_entries and total_bytes <= self.max_bytes:
+                        break
+                    stale_keys.append((self.namespace, key))
+                    count -= 1
+                    total_bytes -= size
+                cursor.executemany('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', stale_keys)
+                removed += len(stale_keys)
+            conn.commit()
+        with self.lock:
+            self.evictions += removed
+        return removed
+
+    def stats(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?', (self.namespace,))
+            entries, total_bytes = cursor.fetchone()
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,169 @@
+import os
+import re
+import glob
+import json
+import threading
+
+# 离线地名库：由 useful_scripts/railway_station_crawler.py 爬取的 12306 车站数据构建，
+# 不需要网络即可把出发地/目的地（城市名、车站名、拼音）解析为规范的城市和车站编码
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "useful_scripts")
+GAZETTEER_ENABLED = os.getenv("GAZETTEER", "1") == "1"
+# 车站数据文件，默认使用 useful_scripts 中最新的 railway_stations_*.json
+GAZETTEER_STATIONS_FILE = os.getenv("GAZETTEER_STATIONS_FILE", "")
+# 可选的坐标文件 {名称: {"location", "citycode", "adcode"}}，名称为城市名或"车站名站"，
+# 由 useful_scripts/build_city_coords.py 生成；有坐标的地点完全不需要请求高德
+GAZETTEER_COORDS_FILE = os.getenv("GAZETTEER_COORDS_FILE", os.path.join(SCRIPTS_DIR, "city_coords.json"))
+
+# 地址开头的省份/自治区（如"四川省成都市"），只在剩余部分能匹配时去掉
+_PROVINCE_PREFIX = re.compile(r"^(.{2,3}?省|内蒙古自治区|广西壮族自治区|西藏自治区|宁夏回族自治区|新疆维吾尔自治区|"
+                              r"河北|山西|辽宁|吉林|黑龙江|江苏|浙江|安徽|福建|江西|山东|河南|湖北|湖南|广东|海南|"
+                              r"四川|贵州|云南|陕西|甘肃|青海|内蒙古|广西|西藏|宁夏|新疆)")
+_STATION_SUFFIXES = ("火车站", "高铁站", "站")
+_CITY_SUFFIXES = ("市",)
+_PUNCTUATION = re.compile(r"[\s,.，。·'’\-_/]+")
+# 12306 车站电报码，如 BXP（北京西）
+_TELECODE = re.compile(r"^[A-Z]{3}$")
+
+
+def latest_stations_file():
+    files = sorted(glob.glob(os.path.join(SCRIPTS_DIR, "railway_stations_*.json")))
+    return files[-1] if files else None
+
+
+def _strip_suffix(text, suffixes):
+    for suffix in suffixes:
+        if text.endswith(suffix) and len(text) > len(suffix):
+            return text[:-len(suffix)]
+    return None
+
+
+class Gazetteer:
+    """
+    离线地名库：按车站名、城市名和拼音建立索引，resolve 返回规范的城市、车站和编码
+    数据在第一次查询时加载；只匹配完整的城市/车站名称，详细地址（如街道、景点）不在地名库中，仍由高德解析
+    """
+    def __init__(self, stations_file=None, coords_file=None, enabled=GAZETTEER_ENABLED):
+        self.enabled = enabled
+        self.stations_file = stations_file or GAZETTEER_STATIONS_FILE or latest_stations_file()
+        self.coords_file = coords_file or GAZETTEER_COORDS_FILE
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.stations = {}
+        self.cities = {}
+        self.pinyin = {}
+        self.telecodes = {}
+        self.coords = {}
+        self.counters = {"hits": 0, "misses": 0, "with_coords": 0}
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            try:
+                with open(self.stations_file, "r", encoding="utf-8") as f:
+                    records = json.load(f)
+            except (TypeError, OSError, ValueError) as e:
+                print(f"地名库车站数据加载失败: {str(e)}")
+                records = []
+            station_pinyin = {}
+            for record in records:
+                name = record.get("station_name")
+                city = record.get("destination") or name
+                if not name:
+                    continue
+                self.stations[name] = {"station": name, "city": city, "telecode": record.get("telecode"),
+                                       "region_code": record.get("region_code"), "pinyin": record.get("pinyin")}
+                self.cities.setdefault(city, []).append(name)
+                if record.get("telecode"):
+                    self.telecodes[record["telecode"]] = name
+                if record.get("pinyin"):
+                    station_pinyin.setdefault(record["pinyin"], []).append(name)
+            # 拼音优先对应城市的同名车站（如 beijing -> 北京），其余只保留没有歧义的
+            for pinyin, names in station_pinyin.items():
+                main = [name for name in names if name in self.cities]
+                if len(main) == 1 or len(names) == 1:
+                    self.pinyin[pinyin] = (main or names)[0]
+            if self.coords_file and os.path.exists(self.coords_file):
+                try:
+                    with open(self.coords_file, "r", encoding="utf-8") as f:
+                        self.coords = {name: value for name, value in json.load(f).items()
+                                       if isinstance(value, dict) and value.get("location")}
+                except (OSError, ValueError) as e:
+                    print(f"地名库坐标文件加载失败: {str(e)}")
+            self.loaded = True
+
+    def _city_entry(self, city):
+        names = self.cities[city]
+        main = self.stations[city] if city in names else self.stations[names[0]]
+        return {"city": city, "station": None, "telecode": main["telecode"], "region_code": main["region_code"],
+                "pinyin": self.stations[city]["pinyin"] if city in names else None, "query": city}
+
+    def _station_entry(self, name):
+        station = self.stations[name]
+        return dict(station, query=f"{name}站")
+
+    def _match(self, text):
+        """
+        车站只在明确指定时匹配：以"站"/"火车站"结尾，或为车站拼音；
+        与车站同名的其他地点（如"长城"、"泰山"是景点，也是车站名）不匹配，仍由高德解析
+        """
+        station_name = _strip_suffix(text, _STATION_SUFFIXES)
+        if station_name and station_name in self.stations:
+            return self._station_entry(station_name)
+        city_name = _strip_suffix(text, _CITY_SUFFIXES) or text
+        if city_name in self.cities:
+            return self._city_entry(city_name)
+        station_name = self.pinyin.get(text)
+        if station_name:
+            return self._city_entry(station_name) if station_name in self.cities else self._station_entry(station_name)
+        return None
+
+    def resolve(self, text):
+        """
+        把城市名、车站名、车站拼音或电报码（如"成都市"、"四川成都"、"成都东站"、"Chengdu"、"ICW"）解析为
+        {"city", "station", "telecode", "region_code", "pinyin", "query"}，query 为地理编码使用的规范名称；
+        坐标文件中有该地点时附带 location、citycode、adcode。无法识别时返回 None
+        """
+        if not self.enabled or not text:
+            return None
+        if not self.loaded:
+            self.load()
+        station_name = self.telecodes.get(str(text).strip()) if _TELECODE.match(str(text).strip()) else None
+        if station_name:
+            return self._finish(self._station_entry(station_name))
+        key = _PUNCTUATION.sub("", str(text)).lower()
+        entry = self._match(key) if key else None
+        if entry is None and key:
+            stripped = _PROVINCE_PREFIX.sub("", key)
+            entry = self._match(stripped) if stripped and stripped != key else None
+        return self._finish(entry)
+
+    def _finish(self, entry):
+        """统计命中情况，并附带坐标文件中的坐标"""
+        with self.lock:
+            self.counters["hits" if entry else "misses"] += 1
+        if entry is None:
+            return None
+        coords = self.coords.get(entry["query"])
+        if coords:
+            entry.update(location=coords["location"], citycode=coords.get("citycode"), adcode=coords.get("adcode"))
+            with self.lock:
+                self.counters["with_coords"] += 1
+        return entry
+
+    def canonical_city(self, text):
+        """返回规范的城市名，无法识别时返回原文本"""
+        entry = self.resolve(text)
+        return entry["city"] if entry else text
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / lookups, 4) if lookups else None
+        data.update(enabled=self.enabled, loaded=self.loaded, stations=len(self.stations), cities=len(self.cities),
+                    coords=len(self.coords))
+        return data
+
+
+gazetteer = Gazetteer()
@@ -0,0 +1,165 @@
+import os
+import re
+import threading
+import concurrent.futures
+
+from utils.disk_cache import DiskCache
+from utils.tracing import traced, submit_with_context
+from utils.cassette import recorded
+from utils.concurrency import get_limiter, get_io_executor
+from utils.http_client import http_client
+from utils.gazetteer import gazetteer
+
+AMAP_GEOCODE_URL = "https://restapi.amap.com/v3/geocode/geo"
+# 高德批量地理编码每次最多 10 个地址
+AMAP_BATCH_SIZE = 10
+# 地理编码缓存时间（秒），城市和地标的坐标几乎不变，默认 90 天
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", str(90 * 86400)))
+
+# 返回结果中保留的字段
+GEOCODE_FIELDS = ("location", "citycode", "adcode", "province", "city", "district", "formatted_address", "level")
+# 地名库识别出的地点附带的字段
+GAZETTEER_FIELDS = ("city", "station", "telecode", "region_code")
+
+
+def normalize_address(address):
+    """规范化地址作为缓存键：统一全角/半角标点、去除空白并转为小写"""
+    text = str(address or "").strip().lower()
+    text = text.translate(str.maketrans("，。：；！？（）【】", ",.:;!?()[]"))
+    return re.sub(r"\s+", "", text)
+
+
+def _geocode_result(address, geocode):
+    """把高德返回的一条 geocode 转为结果字典，没有坐标时返回 None"""
+    if not isinstance(geocode, dict) or not geocode.get("location"):
+        return None
+    result = {"address": address}
+    for field in GEOCODE_FIELDS:
+        value = geocode.get(field)
+        # 高德对缺失的字段返回空列表
+        result[field] = value if isinstance(value, str) and value else None
+    return result
+
+
+def _gazetteer_fields(entry):
+    return {f"gazetteer_{field}": entry.get(field) for field in GAZETTEER_FIELDS}
+
+
+def _gazetteer_result(address, entry):
+    """地名库中带坐标的地点直接组成结果，不请求高德"""
+    result = {field: None for field in GEOCODE_FIELDS}
+    result.update(address=address, location=entry["location"], citycode=entry.get("citycode"),
+                  adcode=entry.get("adcode"), city=entry["city"], formatted_address=entry["query"],
+                  level="火车站" if entry.get("station") else "市", source="gazetteer")
+    result.update(_gazetteer_fields(entry))
+    return result
+
+
+@traced("http.amap_geocode")
+@recorded("geocode")
+def amap_batch_geocode(addresses):
+    """
+    调用高德批量地理编码（最多 AMAP_BATCH_SIZE 个地址），返回与 addresses 顺序一致的结果列表，解析失败的为 None
+    """
+    params = {"key": os.getenv("gaode_api_key"), "address": "|".join(addresses), "batch": "true" if len(addresses) > 1 else "false"}
+    with get_limiter("amap").slot() as mark_throttled:
+        response = http_client.get(AMAP_GEOCODE_URL, params=params)
+        if response.status_code == 429:
+            mark_throttled()
+    if response.status_code != 200:
+        print(f"地理编码请求异常: {response.status_code}")
+        return [None] * len(addresses)
+    data = response.json()
+    if data.get("status") != "1":
+        print(f"位置信息获取失败: {data.get('info')}")
+        return [None] * len(addresses)
+    geocodes = data.get("geocodes") or []
+    return [_geocode_result(address, geocodes[index] if index < len(geocodes) else None)
+            for index, address in enumerate(addresses)]
+
+
+class Geocoder:
+    """
+    带本地缓存的地理编码：先查离线地名库（utils.gazetteer），城市/车站解析为规范名称，有坐标时直接返回；
+    其余按规范化地址查 SQLite 缓存（utils.disk_cache），未命中的地址按批并发请求高德；解析失败的地址不缓存
+    """
+    def __init__(self, ttl=GEOCODE_CACHE_TTL):
+        self.store = DiskCache("geocode", default_ttl=ttl)
+        self.lock = threading.Lock()
+        self.counters = {"gazetteer": 0, "hits": 0, "misses": 0, "failures": 0, "requests": 0}
+
+    def _count(self, field, amount=1):
+        with self.lock:
+            self.counters[field] += amount
+
+    def geocode_many(self, addresses):
+        """
+        批量地理编码，返回 {地址: 结果}，结果包含 location、citycode、adcode 等字段，解析失败的为 None
+        相同的地址（规范化后）只解析一次；"北京市"、"beijing" 等写法由地名库统一为同一个规范名称，共用缓存
+        """
+        results = {}
+        pending = {}
+        queries = {}
+        known = {}
+        for address in addresses:
+            if address in results:
+                continue
+            entry = gazetteer.resolve(address)
+            if entry and entry.get("location"):
+                self._count("gazetteer")
+                results[address] = _gazetteer_result(address, entry)
+                continue
+            # 地名库识别的地点用规范名称查缓存和请求高德
+            query = entry["query"] if entry else address
+            key = normalize_address(query)
+            if not key:
+                continue
+            if entry:
+                known[address] = _gazetteer_fields(entry)
+            cached = self.store.get(key)
+            if cached is not None:
+                self._count("hits")
+                results[address] = dict(cached, address=address, **known.get(address, {}))
+            else:
+                pending.setdefault(key, []).append(address)
+                queries.setdefault(key, query)
+                results[address] = None
+        if not pending:
+            return results
+        self._count("misses", len(pending))
+
+        keys = list(pending)
+        batches = [keys[start:start + AMAP_BATCH_SIZE] for start in range(0, len(keys), AMAP_BATCH_SIZE)]
+        executor = get_io_executor()
+        futures = {submit_with_context(executor, amap_batch_geocode, [queries[key] for key in batch]): batch
+                   for batch in batches}
+        for future in concurrent.futures.as_completed(futures):
+            self._count("requests")
+            try:
+                batch_results = future.result()
+            except Exception as e:
+                print(f"地理编码失败: {str(e)}")
+                batch_results = [None] * len(futures[future])
+            for key, result in zip(futures[future], batch_results):
+                if result is None:
+                    self._count("failures")
+                    continue
+                self.store.set(key, result)
+                for address in pending[key]:
+                    results[address] = dict(result, address=address, **known.get(address, {}))
+        return results
+
+    def geocode(self, address):
+        return self.geocode_many([address]).get(address)
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / lookups, 4) if lookups else None
+        data["disk"] = self.store.stats()
+        data["gazetteer_index"] = gazetteer.stats()
+        return data
+
+
+geocoder = Geocoder()
@@ -0,0 +1,231 @@
+import os
+import re
+import codecs
+from html.parser import HTMLParser
+
+# 网页正文保留的最大字符数
+PAGE_TEXT_CHARS = int(os.getenv("PAGE_TEXT_CHARS", "2000"))
+# 提取引擎：stream（标准库流式解析，可边下载边提取，默认）/ lxml（C 实现，需要安装 lxml，只用于完整文档）
+HTML_EXTRACTOR = os.getenv("HTML_EXTRACTOR", "stream")
+# 每次喂给解析器的字符数，收集到足够的正文后不再继续解析
+FEED_CHUNK_CHARS = 16 * 1024
+# 下载网页的字节上限，超过后停止读取
+PAGE_MAX_BYTES = int(os.getenv("PAGE_MAX_BYTES", str(1024 * 1024)))
+# 检测编码前先缓存的字节数（<meta charset> 一般在文档开头）
+SNIFF_BYTES = 4096
+
+# 可以提取正文的内容类型，其余（PDF、图片、压缩包等）不下载
+TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain", "text/xml", "application/xml")
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.I)
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+# 国内网页常见的编码声明按其超集解码
+_CHARSET_ALIASES = {"gb2312": "gb18030", "gbk": "gb18030", "x-gbk": "gb18030"}
+
+# 内容不属于正文的标签，其中的文本全部丢弃
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "nav", "header", "footer", "aside", "form",
+             "select", "button"}
+# 块级标签，前后换行
+BLOCK_TAGS = {"p", "div", "br", "li", "tr", "section", "article", "h1", "h2", "h3", "h4", "h5", "h6", "td", "th",
+              "dd", "dt", "table", "ul", "ol", "blockquote", "pre"}
+# 没有结束标签的元素，不影响跳过的层级
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+_SPACES = re.compile(r"[ \t\r\f\v　\xa0]+")
+
+
+class TextExtractor(HTMLParser):
+    """
+    流式提取网页正文：跳过脚本、样式、导航等内容，收集到 max_chars 个字符后停止
+    可以逐块 feed（例如边下载边提取），feed 返回 True 表示已经收集够，不需要再读取后续内容
+    """
+    def __init__(self, max_chars=PAGE_TEXT_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+        self.skip_depth = 0
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS and tag not in VOID_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_data(self, data):
+        if self.skip_depth or self.done:
+            return
+        text = _SPACES.sub(" ", data).strip()
+        if not text:
+            return
+        if self.parts and not self.parts[-1].endswith("\n"):
+            text = " " + text
+        self.parts.append(text)
+        self.length += len(text)
+        if self.length >= self.max_chars:
+            self.done = True
+
+    def _newline(self):
+        if self.parts and not self.parts[-1].endswith("\n"):
+            self.parts.append("\n")
+            self.length += 1
+
+    def feed(self, data):
+        """逐块解析，返回是否已收集到足够的正文"""
+        for start in range(0, len(data), FEED_CHUNK_CHARS):
+            if self.done:
+                break
+            super().feed(data[start:start + FEED_CHUNK_CHARS])
+        return self.done
+
+    @property
+    def text(self):
+        return "".join(self.parts).strip()[:self.max_chars]
+
+
+def _extract_stream(html, max_chars):
+    extractor = TextExtractor(max_chars)
+    extractor.feed(html)
+    if not extractor.done:
+        extractor.close()
+    return extractor.text
+
+
+def _extract_lxml(html, max_chars):
+    import lxml.html
+    from lxml import etree
+
+    root = lxml.html.fromstring(html)
+    etree.strip_elements(root, *SKIP_TAGS, with_tail=False)
+    etree.strip_tags(root, etree.Comment)
+    parts = []
+    length = 0
+
+    def add(text):
+        nonlocal length
+        text = _SPACES.sub(" ", text or "").strip()
+        if text:
+            parts.append(text)
+            length += len(text) + 1
+
+    for event, element in etree.iterwalk(root, events=("start", "end")):
+        if event == "start":
+            if element.tag in BLOCK_TAGS:
+                parts.append("\n")
+            add(element.text)
+        else:
+            if element.tag in BLOCK_TAGS:
+                parts.append("\n")
+            if element is not root:
+                add(element.tail)
+        if length >= max_chars:
+            break
+    return re.sub(r" ?\n[\n ]*", "\n", " ".join(parts)).strip()[:max_chars]
+
+
+def extract_text(html, max_chars=PAGE_TEXT_CHARS, engine=None):
+    """
+    提取网页正文，最多 max_chars 个字符
+    engine 默认取 HTML_EXTRACTOR；lxml 未安装或解析失败时使用 stream
+    """
+    engine = engine or HTML_EXTRACTOR
+    if engine == "lxml":
+        try:
+            return _extract_lxml(html, max_chars)
+        except Exception:
+            pass
+    return _extract_stream(html, max_chars)
+
+
+def is_text_content_type(content_type):
+    """没有 Content-Type 的响应按网页处理"""
+    if not content_type:
+        return True
+    return content_type.split(";")[0].strip().lower() in TEXT_CONTENT_TYPES
+
+
+def _valid_charset(charset):
+    if not charset:
+        return None
+    charset = _CHARSET_ALIASES.get(charset.strip().strip("\"'").lower(), charset.strip().strip("\"'").lower())
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        return None
+    return charset
+
+
+def detect_charset(content_type, head):
+    """
+    确定网页编码：BOM > Content-Type 中的 charset > <meta charset> > charset_normalizer 猜测 > utf-8
+    head 为文档开头的若干字节
+    """
+    for bom, charset in _BOMS:
+        if head.startswith(bom):
+            return charset
+    match = re.search(r"charset=([^;\s]+)", content_type or "", re.I)
+    charset = _valid_charset(match.group(1)) if match else None
+    if charset:
+        return charset
+    match = _META_CHARSET.search(head)
+    charset = _valid_charset(match.group(1).decode("ascii", "ignore")) if match else None
+    if charset:
+        return charset
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(head).best()
+        charset = _valid_charset(best.encoding) if best else None
+    except ImportError:
+        charset = None
+    return charset or "utf-8"
+
+
+def extract_text_stream(chunks, content_type=None, max_chars=PAGE_TEXT_CHARS, max_bytes=PAGE_MAX_BYTES):
+    """
+    从字节块迭代器（如 response.iter_content()）边读取边提取正文
+    读取的字节数达到 max_bytes 或正文已收集够时停止读取后续内容
+    返回 (正文, {"encoding", "bytes_read", "truncated"})，truncated 表示没有读完整个文档
+    """
+    extractor = TextExtractor(max_chars)
+    decoder = None
+    encoding = None
+    head = b""
+    received = 0
+    truncated = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if received + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - received]
+            truncated = True
+        received += len(chunk)
+        if decoder is None:
+            head += chunk
+            if len(head) < SNIFF_BYTES and not truncated:
+                continue
+            encoding = detect_charset(content_type, head)
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            chunk, head = head, b""
+        if extractor.feed(decoder.decode(chunk)):
+            truncated = True
+            break
+        if truncated:
+            break
+    if decoder is None:
+        encoding = detect_charset(content_type, head)
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    if not extractor.done:
+        extractor.feed(decoder.decode(head, final=True))
+    if not extractor.done:
+        extractor.close()
+    return extractor.text, {"encoding": encoding, "bytes_read": received, "truncated": truncated}
@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 对外HTTP请求的默认超时（秒），调用方可以按请求传入 timeout 覆盖
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+# 连接池：缓存连接池的域名数、每个域名保持的连接数
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "64"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+# 连接错误和 429/5xx 的重试次数（只重试 GET 等幂等请求，付费的搜索 POST 不重试）
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+# 使用 HTTP/2 的域名，逗号分隔（需要安装 httpx[http2]，未安装时使用 HTTP/1.1）
+HTTP2_HOSTS = {host.strip().lower() for host in os.getenv("HTTP2_HOSTS", "").split(",") if host.strip()}
+
+
+def build_session():
+    """创建带连接池、keep-alive 和重试的 Session"""
+    session = requests.Session()
+    retry = Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF,
+                  status_forcelist=(429, 500, 502, 503, 504), respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def build_http2_client():
+    """HTTP2_HOSTS 非空且安装了 httpx[http2] 时创建 HTTP/2 客户端，否则返回 None"""
+    if not HTTP2_HOSTS:
+        return None
+    try:
+        import httpx
+        import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    except ImportError:
+        print("未安装 httpx[http2]，HTTP2_HOSTS 中的域名使用 HTTP/1.1")
+        return None
+    limits = httpx.Limits(max_connections=HTTP_POOL_MAXSIZE * len(HTTP2_HOSTS), max_keepalive_connections=HTTP_POOL_MAXSIZE)
+    return httpx.Client(http2=True, limits=limits, transport=httpx.HTTPTransport(http2=True, retries=HTTP_RETRIES))
+
+
+class _HttpxRaw:
+    """
+    把 httpx 的流式响应包装为 requests.Response.raw：iter_content 按块读取（与 HTTP/1.1 一样可以提前停止），
+    关闭 requests.Response 时关闭 httpx 的响应
+    """
+    def __init__(self, response):
+        self.response = response
+
+    def stream(self, chunk_size=None, decode_content=True):
+        import httpx
+        try:
+            yield from self.response.iter_bytes(chunk_size)
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+    def close(self):
+        self.response.close()
+
+
+def _requests_response(response, stream=False):
+    """把 httpx 的响应转换为 requests.Response，调用方不需要区分协议；stream 为 True 时响应体按需读取"""
+    result = requests.models.Response()
+    result.status_code = response.status_code
+    result.headers = requests.structures.CaseInsensitiveDict(response.headers)
+    if stream:
+        result.raw = _HttpxRaw(response)
+    else:
+        result._content = response.content
+        result._content_consumed = True
+    result.url = str(response.url)
+    # 流式响应还没有读取响应体，只按响应头确定编码
+    result.encoding = requests.utils.get_encoding_from_headers(result.headers) if stream else response.encoding
+    result.reason = response.reason_phrase
+    return result
+
+
+def _empty_stats():
+    return {"requests": 0, "errors": 0, "http2": 0, "status": {}, "latency_total": 0.0, "latency_ewma": None}
+
+
+class HttpClient:
+    """
+    所有对外HTTP请求共用的客户端：按域名复用连接（keep-alive）、默认超时、幂等请求重试，
+    HTTP2_HOSTS 中的域名使用 HTTP/2；按域名统计请求数、错误、状态码和延迟
+    """
+    def __init__(self):
+        self.session = build_session()
+        self.http2 = build_http2_client()
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _record(self, host, latency, status_code=None, error=False, http2=False):
+        with self.lock:
+            stats = self.hosts.setdefault(host, _empty_stats())
+            stats["requests"] += 1
+            stats["latency_total"] += latency
+            ewma = stats["latency_ewma"]
+            stats["latency_ewma"] = latency if ewma is None else ewma * 0.9 + latency * 0.1
+            if http2:
+                stats["http2"] += 1
+            if error:
+                stats["errors"] += 1
+            if status_code is not None:
+                status_class = f"{status_code // 100}xx"
+                stats["status"][status_class] = stats["status"].get(status_class, 0) + 1
+
+    def _send_http2(self, method, url, timeout, kwargs):
+        import httpx
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        stream = kwargs.get("stream", False)
+        try:
+            request = self.http2.build_request(method, url, params=kwargs.get("params"), headers=kwargs.get("headers"),
+                                               content=kwargs.get("data"), json=kwargs.get("json"),
+                                               timeout=httpx.Timeout(read, connect=connect))
+            # stream=True 时只读取响应头，响应体由调用方按块读取（网页下载的字节上限和提前结束）
+            response = self.http2.send(request, stream=stream, follow_redirects=kwargs.get("allow_redirects", True))
+        except httpx.HTTPError as e:
+            # 与 requests 的异常类型保持一致，调用方统一捕获 requests.RequestException
+            raise requests.ConnectionError(str(e)) from e
+        return _requests_response(response, stream)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        发送请求，返回 requests.Response
+        timeout 为秒数或 (连接超时, 读取超时)，默认使用 HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT
+        """
+        timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        host = urlsplit(url).netloc.lower()
+        use_http2 = self.http2 is not None and host in HTTP2_HOSTS
+        start = time.time()
+        try:
+            if use_http2:
+                response = self._send_http2(method, url, timeout, kwargs)
+            else:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+        except Exception:
+            self._record(host, time.time() - start, error=True, http2=use_http2)
+            raise
+        self._record(host, time.time() - start, status_code=response.status_code,
+                     error=response.status_code >= 400, http2=use_http2)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            hosts = {host: dict(stats, status=dict(stats["status"])) for host, stats in self.hosts.items()}
+        for stats in hosts.values():
+            stats["latency_avg"] = round(stats.pop("latency_total") / stats["requests"], 4) if stats["requests"] else None
+            if stats["latency_ewma"] is not None:
+                stats["latency_ewma"] = round(stats["latency_ewma"], 4)
+        return {"http2_hosts": sorted(HTTP2_HOSTS), "http2_enabled": self.http2 is not None, "hosts": hosts}
+
+
+http_client = HttpClient()
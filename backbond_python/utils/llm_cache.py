@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+from utils.disk_cache import DiskCache
+
+# LLM 响应缓存配置
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+# 不使用缓存的智能体，逗号分隔，如 "Plan_Agent,Traffic_Agent"
+LLM_CACHE_DISABLED_AGENTS = {name.strip() for name in os.getenv("LLM_CACHE_DISABLED_AGENTS", "").split(",") if name.strip()}
+
+# 提示词中精确到秒的时间只保留日期，避免同一天内的相同请求因时间不同而无法命中
+_TIMESTAMP_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})[ T]\d{2}:\d{2}:\d{2}")
+
+
+def normalize_content(content):
+    if isinstance(content, str):
+        content = _TIMESTAMP_PATTERN.sub(r"\1", content)
+        return re.sub(r"\s+", " ", content).strip()
+    if isinstance(content, list):
+        return [normalize_content(item) for item in content]
+    if isinstance(content, dict):
+        return {key: normalize_content(value) for key, value in content.items()}
+    return content
+
+
+class LLMResponseCache:
+    """
+    所有智能体共用的LLM响应缓存
+    键由模型、生成参数、绑定的工具、结构化输出格式、系统提示词哈希和规范化后的消息组成；值为 message_to_dict 序列化后的响应
+    """
+    def __init__(self, enabled=LLM_CACHE_ENABLED, ttl=LLM_CACHE_TTL, disabled_agents=None):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.disabled_agents = set(LLM_CACHE_DISABLED_AGENTS if disabled_agents is None else disabled_agents)
+        self.store = DiskCache("llm", default_ttl=ttl, max_entries=LLM_CACHE_MAX_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES)
+        self.lock = threading.Lock()
+        self.latency_saved = 0.0
+        self.agent_stats = {}
+
+    def enabled_for(self, agent_name):
+        return self.enabled and agent_name not in self.disabled_agents
+
+    @staticmethod
+    def make_key(request):
+        """
+        request: {"model", "tools", "messages": [{"role", "content", ...}], "response_format", "params"}
+        response_format 和 params（temperature、max_tokens 等）不同的请求使用不同的键
+        系统提示词单独哈希，其余消息规范化空白和时间后参与哈希
+        """
+        messages = request.get("messages", [])
+        system_prompt = "\n".join(str(m.get("content")) for m in messages if m.get("role") == "system")
+        system_hash = hashlib.sha256(normalize_content(system_prompt).encode("utf-8")).hexdigest()
+        payload = {
+            "model": request.get("model"),
+            "tools": request.get("tools"),
+            "response_format": request.get("response_format"),
+            "params": request.get("params"),
+            "system": system_hash,
+            "messages": [normalize_content(m) for m in messages if m.get("role") != "system"],
+        }
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _count(self, agent_name, field, latency=0.0):
+        with self.lock:
+            stats = self.agent_stats.setdefault(agent_name, {"hits": 0, "misses": 0, "latency_saved": 0.0})
+            stats[field] += 1
+            stats["latency_saved"] += latency
+            self.latency_saved += latency
+
+    def lookup(self, agent_name, request):
+        """命中时返回缓存的响应（dict），并累计节省的延迟"""
+        entry = self.store.get(self.make_key(request))
+        if entry is None:
+            self._count(agent_name, "misses")
+            return None
+        self._count(agent_name, "hits", entry.get("latency", 0.0))
+        return entry["response"]
+
+    def save(self, agent_name, request, response, latency):
+        """保存响应及其耗时；空响应不缓存"""
+        data = response.get("data", {})
+        if not data.get("content") and not data.get("tool_calls"):
+            return
+        self.store.set(self.make_key(request), {"agent": agent_name, "response": response, "latency": latency})
+
+    def stats(self):
+        data = self.store.stats()
+        with self.lock:
+            data["latency_saved"] = round(self.latency_saved, 3)
+            data["agents"] = {name: dict(stats, latency_saved=round(stats["latency_saved"], 3))
+                              for name, stats in self.agent_stats.items()}
+        data["enabled"] = self.enabled
+        data["disabled_agents"] = sorted(self.disabled_agents)
+        return data
+
+
+llm_cache = LLMResponseCache()
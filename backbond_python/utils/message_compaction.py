@@ -0,0 +1,96 @@
+import os
+import re
+import json
+
+from langchain_core.messages import ToolMessage
+
+# 工具循环中每次发送给模型的上下文预算（按 token 估算），可通过 TOOL_CONTEXT_BUDGET_<智能体名> 单独配置
+TOOL_CONTEXT_BUDGET = int(os.getenv("TOOL_CONTEXT_BUDGET", "6000"))
+# 已被模型使用过的工具结果压缩后保留的最大字符数
+TOOL_RESULT_DIGEST_CHARS = int(os.getenv("TOOL_RESULT_DIGEST_CHARS", "600"))
+
+# 旅游信息中有用的句子通常包含这些词或数字（价格、时间、地址等）
+FACT_KEYWORDS = ("门票", "票价", "价格", "免费", "开放", "营业", "时间", "地址", "位于", "电话", "人均",
+                 "推荐", "特色", "必吃", "招牌", "车次", "航班", "高铁", "地铁", "公交", "时长", "距离", "建议")
+_SENTENCE = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]?")
+_HAS_NUMBER = re.compile(r"\d")
+
+DIGEST_PREFIX = "[已使用的工具结果摘要] "
+OMITTED_CONTENT = "[工具结果已省略：模型已在之前的回答中使用过该结果]"
+
+
+def message_tokens(messages):
+    """按字符数估计消息的 token 数（中文约 1~2 字符/token，与 utils.rate_limit 的估算一致）"""
+    chars = 0
+    for message in messages:
+        content = getattr(message, "content", None)
+        if content is None and isinstance(message, dict):
+            content = message.get("content")
+        chars += len(str(content or ""))
+    return chars // 2
+
+
+def extract_facts(text, max_chars):
+    """从网页文本中抽取含数字或关键词的句子（去重并保持原顺序），最多 max_chars 个字符"""
+    facts = []
+    seen = set()
+    length = 0
+    for match in _SENTENCE.finditer(text):
+        sentence = " ".join(match.group().split())
+        if len(sentence) < 6 or sentence in seen:
+            continue
+        if not (_HAS_NUMBER.search(sentence) or any(keyword in sentence for keyword in FACT_KEYWORDS)):
+            continue
+        seen.add(sentence)
+        if length + len(sentence) > max_chars:
+            facts.append(sentence[:max(max_chars - length, 0)])
+            break
+        facts.append(sentence)
+        length += len(sentence)
+    return "".join(facts)
+
+
+def digest_tool_result(content, max_chars=TOOL_RESULT_DIGEST_CHARS):
+    """把工具结果缩减为抽取出的事实；结果为网页文本列表时按页平均分配字符数"""
+    try:
+        pages = json.loads(content)
+    except (TypeError, json.JSONDecodeError):
+        pages = None
+    if isinstance(pages, list) and pages and all(isinstance(page, str) for page in pages):
+        per_page = max(max_chars // len(pages), 50)
+        digest = " | ".join(filter(None, (extract_facts(page, per_page) for page in pages)))
+    else:
+        digest = extract_facts(str(content), max_chars)
+    return DIGEST_PREFIX + (digest or "未包含可用信息")
+
+
+def compact_messages(messages, budget=TOOL_CONTEXT_BUDGET, digest_chars=TOOL_RESULT_DIGEST_CHARS):
+    """
+    压缩工具循环中发送给模型的历史消息，返回 (压缩后的消息, 压缩的工具结果数, 节省的 token 数)
+    只处理模型已经看过的工具结果（其后已有模型回复）：先缩减为抽取出的事实，
+    仍超出预算时从最早的开始整条省略；系统提示词、用户消息、模型回复和最新一轮的工具结果保持不变
+    """
+    last_ai = max((index for index, message in enumerate(messages) if getattr(message, "type", None) == "ai"), default=-1)
+    consumed = [index for index, message in enumerate(messages[:last_ai])
+                if isinstance(message, ToolMessage) and isinstance(message.content, str)
+                and not message.content.startswith((DIGEST_PREFIX, OMITTED_CONTENT))]
+    original_tokens = message_tokens(messages)
+    if not consumed or original_tokens <= budget:
+        return messages, 0, 0
+
+    compacted = list(messages)
+
+    def replace(index, content):
+        message = messages[index]
+        compacted[index] = ToolMessage(content=content, tool_call_id=message.tool_call_id, name=message.name)
+
+    for index in consumed:
+        digest = digest_tool_result(messages[index].content, digest_chars)
+        if len(digest) < len(messages[index].content):
+            replace(index, digest)
+    for index in consumed:
+        if message_tokens(compacted) <= budget:
+            break
+        replace(index, OMITTED_CONTENT)
+    changed = sum(1 for index in consumed if compacted[index] is not messages[index])
+    return compacted, changed, original_tokens - message_tokens(compacted)
@@ -0,0 +1,93 @@
+import os
+import re
+import threading
+
+import yaml
+
+# 模型路由配置文件和使用的档案在首次路由时读取（环境变量 MODEL_ROUTING_FILE / MODEL_ROUTING_PROFILE），
+# 此时 .env 已经加载
+DEFAULT_ROUTING_FILE = "./model_routing.yaml"
+
+# 可以直接传给 ChatOpenAI 的路由参数
+MODEL_PARAMS = ("max_tokens", "temperature", "top_p", "timeout", "max_retries")
+
+
+def _expand(value):
+    """展开 ${变量}，未设置的环境变量展开为空字符串"""
+    if not isinstance(value, str):
+        return value
+    return re.sub(r"\$\{(\w+)\}", lambda match: os.environ.get(match.group(1), ""), value).strip()
+
+
+class ModelRouter:
+    """
+    按智能体类名选择模型、接口和参数，返回 [主模型, 备用模型...] 的参数列表
+    配置文件不存在或档案中没有可用模型时，使用环境变量 MODEL / BASE_URL / OPENAI_API_KEY
+    """
+    def __init__(self, path=None, profile=None):
+        self.path = path
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.config = None
+
+    def load(self):
+        """读取配置文件"""
+        with self.lock:
+            if self.config is None:
+                if self.path is None:
+                    self.path = os.getenv("MODEL_ROUTING_FILE", DEFAULT_ROUTING_FILE)
+                if self.profile is None:
+                    self.profile = os.getenv("MODEL_ROUTING_PROFILE", "default")
+                if os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self.config = yaml.safe_load(f) or {}
+                else:
+                    self.config = {}
+            return self.config
+
+    def set_profile(self, profile):
+        self.load()
+        self.profile = profile
+
+    def profiles(self):
+        return sorted(self.load().get("profiles", {}))
+
+    def resolve_model(self, name, params):
+        """把模型名解析为 ChatOpenAI 参数；未在 models 中定义的名称按模型名直接使用"""
+        model = self.load().get("models", {}).get(name, {"model": name})
+        model_name = _expand(model.get("model"))
+        if not model_name:
+            return None
+        resolved = {
+            "model_name": model_name,
+            "base_url": _expand(model.get("base_url")) or os.environ.get("BASE_URL"),
+            "api_key": _expand(model.get("api_key")) or os.environ.get("OPENAI_API_KEY"),
+        }
+        for key in MODEL_PARAMS:
+            value = params.get(key, model.get(key))
+            if value is not None:
+                resolved[key] = value
+        return resolved
+
+    def route(self, agent_name):
+        """返回智能体的模型链（ChatOpenAI 参数列表），第一个为主模型"""
+        profile = self.load().get("profiles", {}).get(self.profile, {})
+        spec = dict(profile.get("default") or {})
+        spec.update((profile.get("agents") or {}).get(agent_name) or {})
+        names = [spec["model"]] if spec.get("model") else []
+        names += [name for name in spec.get("fallbacks") or [] if name not in names]
+        chain = []
+        for name in names:
+            resolved = self.resolve_model(name, spec)
+            if resolved and resolved not in chain:
+                chain.append(resolved)
+        if not chain:
+            chain.append({
+                "model_name": os.environ["MODEL"],
+                "base_url": os.environ["BASE_URL"],
+                "api_key": os.environ["OPENAI_API_KEY"],
+            })
+        return chain
+
+
+model_router = ModelRouter()
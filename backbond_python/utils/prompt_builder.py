@@ -0,0 +1,112 @@
+import re
+import time
+import string
+import hashlib
+import threading
+
+from utils.usage import extract_usage
+
+# 模板占位符在静态部分中的称呼，例如 "时间建议在{time}之后" 编译为 "时间建议在当前时间之后"
+PLACEHOLDER_LABELS = {
+    "time": "当前时间",
+    "question": "用户输入",
+}
+
+# 只声明一个变量的行（如 "当前时间：{time}"），编译时移到提示词末尾
+_DECLARATION_LINE = re.compile(r"^\s*[^\s{}]+[：:]\s*\{(\w+)\}\s*$")
+
+
+def current_time_text():
+    """每次组装提示词时取当前时间，长时间运行的服务不会使用启动时的时间"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+
+class CompiledPrompt:
+    """
+    编译后的系统提示词：静态说明在前、可变的值在末尾的简短后缀中
+    静态前缀对同一个智能体的所有请求完全相同，服务端的提示词前缀缓存可以命中
+    """
+    def __init__(self, name, template):
+        self.name = name
+        static_lines = []
+        self.suffix_lines = []
+        for line in template.splitlines():
+            match = _DECLARATION_LINE.match(line)
+            if match:
+                self.suffix_lines.append((match.group(1), line.strip()))
+            else:
+                static_lines.append(line)
+        fields = {field for _, field, _, _ in string.Formatter().parse(template) if field}
+        labels = {field: PLACEHOLDER_LABELS.get(field, field) for field in fields}
+        prefix = "\n".join(static_lines).format(**labels).strip()
+        self.prefix = re.sub(r"\n\s*\n(\s*\n)+", "\n\n", prefix)
+        self.prefix_hash = hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()[:12]
+
+    def render(self, **values):
+        """
+        组装完整的系统提示词，只输出提供了值的后缀行
+        用户输入已在用户消息中，不需要再放进系统提示词
+        """
+        suffix = [line.format(**{field: values[field]}) for field, line in self.suffix_lines if field in values]
+        if not suffix:
+            return self.prefix
+        return self.prefix + "\n\n" + "\n".join(suffix)
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compile_prompt(prompt_config):
+    """编译 config.py 中加载的 YAML 提示词，同一个提示词只编译一次"""
+    name = prompt_config.get("name") or hashlib.sha256(prompt_config["prompt"].encode("utf-8")).hexdigest()[:12]
+    with _compiled_lock:
+        if name not in _compiled:
+            _compiled[name] = CompiledPrompt(name, prompt_config["prompt"])
+        return _compiled[name]
+
+
+def prompt_token_usage(response):
+    """从模型响应中取出 (输入 token 数, 命中前缀缓存的 token 数)，服务端没有返回缓存信息时命中数为 None"""
+    usage = extract_usage(response)
+    return usage["input"], usage["cached"]
+
+
+class PromptCacheStats:
+    """按智能体统计服务端返回的提示词前缀缓存命中情况"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.agents = {}
+
+    def record(self, agent_name, response):
+        input_tokens, cached = prompt_token_usage(response)
+        with self.lock:
+            stats = self.agents.setdefault(agent_name, {"requests": 0, "reported": 0, "hit_requests": 0,
+                                                        "input_tokens": 0, "cached_tokens": 0})
+            stats["requests"] += 1
+            if cached is None:
+                return
+            stats["reported"] += 1
+            stats["input_tokens"] += input_tokens
+            stats["cached_tokens"] += cached
+            if cached:
+                stats["hit_requests"] += 1
+
+    def stats(self):
+        with self.lock:
+            agents = {name: dict(stats) for name, stats in self.agents.items()}
+        for stats in agents.values():
+            stats["hit_rate"] = round(stats["hit_requests"] / stats["reported"], 4) if stats["reported"] else None
+            stats["cached_token_ratio"] = round(stats["cached_tokens"] / stats["input_tokens"], 4) if stats["input_tokens"] else None
+        input_tokens = sum(stats["input_tokens"] for stats in agents.values())
+        cached_tokens = sum(stats["cached_tokens"] for stats in agents.values())
+        return {
+            "input_tokens": input_tokens,
+            "cached_tokens": cached_tokens,
+            "cached_token_ratio": round(cached_tokens / input_tokens, 4) if input_tokens else None,
+            "prefixes": {name: prompt.prefix_hash for name, prompt in _compiled.items()},
+            "agents": agents,
+        }
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from contextlib import nullcontext
+
+from utils.usage import extract_usage
+
+# 各模型的配额（每分钟请求数 rpm、每分钟 token 数 tpm），JSON 格式：{"模型名": {"rpm": 500, "tpm": 200000}}
+# 未单独配置的模型使用 LLM_RPM / LLM_TPM，0 表示不限制
+LLM_RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", "{}") or "{}")
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+# 调用前预估的输出 token 数，调用结束后按实际用量修正
+LLM_OUTPUT_TOKENS_ESTIMATE = int(os.getenv("LLM_OUTPUT_TOKENS_ESTIMATE", "512"))
+
+# 限流（429）、服务端错误（5xx）和超时的重试：指数退避 + 随机抖动
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30.0"))
+
+# 熔断：连续失败 LLM_BREAKER_FAILURES 次后熔断 LLM_BREAKER_RESET 秒，期间直接拒绝请求，之后放行一个探测请求
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+# 探测请求的最长时间，超过后视为丢失，允许新的探测请求，避免熔断器一直停在 half_open
+LLM_BREAKER_PROBE_TIMEOUT = float(os.getenv("LLM_BREAKER_PROBE_TIMEOUT", "120"))
+
+
+class CircuitOpenError(Exception):
+    """熔断期间拒绝的请求"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"模型服务 {name} 暂不可用（熔断中），{retry_after:.0f} 秒后重试")
+        self.retry_after = retry_after
+
+
+def is_retryable_error(error):
+    """限流、服务端错误、超时和连接错误可以重试；请求参数错误（4xx）直接抛出"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    text = str(error).lower()
+    name = type(error).__name__.lower()
+    return ("429" in text or "rate limit" in text or "timeout" in name or "connection" in name
+            or "timed out" in text or isinstance(error, (TimeoutError, ConnectionError)))
+
+
+def retry_after_seconds(error):
+    """服务端通过 Retry-After 响应头给出的等待时间"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, error=None):
+    """第 attempt 次重试前的等待时间（full jitter），服务端给出 Retry-After 时不少于该值"""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    retry_after = retry_after_seconds(error) if error is not None else None
+    return max(delay, min(retry_after, LLM_BACKOFF_MAX)) if retry_after else delay
+
+
+def estimate_tokens(messages):
+    """按字符数粗略估计请求的 token 数（中文约 1~2 字符/token），加上预估的输出 token"""
+    chars = 0
+    for message in messages:
+        content = getattr(message, "content", None)
+        if content is None and isinstance(message, dict):
+            content = message.get("content")
+        chars += len(str(content or ""))
+    return chars // 2 + LLM_OUTPUT_TOKENS_ESTIMATE
+
+
+class TokenBucket:
+    """
+    令牌桶：每分钟补充 rate_per_minute 个令牌，容量为一分钟的量
+    先预扣令牌再等待（余额可以为负），并发请求按到达顺序排队，不会同时醒来再次超额
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """预扣 amount 个令牌，返回需要等待的秒数；单次超过容量的请求按容量计算，避免永远等待"""
+        if not self.enabled:
+            return 0.0
+        with self.lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount):
+        """按实际用量修正预扣的令牌（amount 为正时补扣，为负时退还）"""
+        if not self.enabled or not amount:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+    def available(self):
+        if not self.enabled:
+            return None
+        with self.lock:
+            self._refill()
+            return round(self.tokens, 1)
+
+
+class CircuitBreaker:
+    """
+    熔断器：closed（正常）→ 连续失败达到阈值 → open（拒绝请求）→ 冷却结束 → half_open（放行一个探测请求）
+    探测成功恢复 closed，以任何方式结束（包括不可重试的错误和取消）但没有成功时重新进入 open；
+    探测超过 probe_timeout 仍未结束时视为丢失，放行新的探测请求
+    """
+
+    def __init__(self, name, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET,
+                 probe_timeout=LLM_BREAKER_PROBE_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.lock = threading.Lock()
+        self.counters = {"opened": 0, "rejected": 0}
+
+    def retry_after(self):
+        """熔断剩余时间，未熔断时返回 0"""
+        with self.lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        """检查是否放行请求，返回本次请求是否为探测请求；熔断中抛出 CircuitOpenError"""
+        with self.lock:
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "closed":
+                return False
+            if self.state == "half_open" and (not self.probing or now - self.probe_started >= self.probe_timeout):
+                self.probing = True
+                self.probe_started = now
+                return True
+            self.counters["rejected"] += 1
+            if self.state == "half_open":
+                retry_after = min(self.reset_timeout, self.probe_started + self.probe_timeout - now)
+            else:
+                retry_after = self.opened_at + self.reset_timeout - now
+        raise CircuitOpenError(self.name, max(0.0, retry_after))
+
+    def finish_probe(self, succeeded):
+        """探测请求结束时调用（放在 finally 中）：没有成功且仍处于探测状态时重新熔断"""
+        if succeeded:
+            self.record_success()
+            return
+        with self.lock:
+            if self.state == "half_open" and self.probing:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+                self.counters["opened"] += 1
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.counters["opened"] += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def stats(self):
+        retry_after = self.retry_after()
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.failures,
+                    "retry_after": round(retry_after, 1), **self.counters}
+
+
+class EndpointGuard:
+    """
+    单个模型服务的调用保护：rpm/tpm 令牌桶限速、可重试错误的指数退避，以及熔断
+    所有任务和线程共用同一个实例，重试和限速在进程内统一协调
+    """
+
+    def __init__(self, name, rpm=0, tpm=0, max_retries=LLM_MAX_RETRIES):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker(name)
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "rate_limited": 0, "wait_time": 0.0}
+
+    def _reserve(self, estimate):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimate))
+        if wait:
+            with self.lock:
+                self.counters["rate_limited"] += 1
+                self.counters["wait_time"] += wait
+        return wait
+
+    def _settle(self, estimate, response):
+        self.tokens.adjust(extract_usage(response)["total"] - estimate if response is not None else -estimate)
+
+    def _failed(self, attempt, error):
+        """记录一次失败，返回重试前的等待时间；不可重试或已用完重试次数时返回 None"""
+        retryable = is_retryable_error(error)
+        if retryable:
+            self.breaker.record_failure()
+        with self.lock:
+            if not retryable or attempt >= self.max_retries or self.breaker.state == "open":
+                self.counters["failures"] += 1
+                return None
+            self.counters["retries"] += 1
+        return backoff_delay(attempt, error)
+
+    def call(self, func, estimate=LLM_OUTPUT_TOKENS_ESTIMATE, limiter=None):
+        """
+        在限速和熔断保护下调用 func()，可重试的错误按退避时间重试
+        limiter 为 utils.concurrency 的并发限制器时，每次尝试单独占用名额（限速和退避等待期间不占用），
+        每个 429 都会报告给限制器
+        """
+        with self.lock:
+            self.counters["calls"] += 1
+        attempt = 0
+        while True:
+            probe = self.breaker.before_call()
+            succeeded = False
+            try:
+                time.sleep(self._reserve(estimate))
+                with limiter.slot() if limiter is not None else nullcontext():
+                    response = func()
+                succeeded = True
+            except Exception as e:
+                self._settle(estimate, None)
+                delay = self._failed(attempt, e)
+                if delay is None:
+                    raise
+                error = e
+            finally:
+                if probe:
+                    self.breaker.finish_probe(succeeded)
+            if succeeded:
+                self.breaker.record_success()
+                self._settle(estimate, response)
+                return response
+            print(f"模型服务 {self.name} 调用失败，{delay:.1f} 秒后第 {attempt + 1} 次重试: {str(error)}")
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, coro_func, estimate=LLM_OUTPUT_TOKENS_ESTIMATE, limiter=None):
+        """call 的异步版本，等待限速和退避时不占用线程"""
+        with self.lock:
+            self.counters["calls"] += 1
+        attempt = 0
+        while True:
+            probe = self.breaker.before_call()
+            succeeded = False
+            try:
+                await asyncio.sleep(self._reserve(estimate))
+                async with limiter.aslot() if limiter is not None else nullcontext():
+                    response = await coro_func()
+                succeeded = True
+            except Exception as e:
+                self._settle(estimate, None)
+                delay = self._failed(attempt, e)
+                if delay is None:
+                    raise
+                error = e
+            finally:
+                if probe:
+                    self.breaker.finish_probe(succeeded)
+            if succeeded:
+                self.breaker.record_success()
+                self._settle(estimate, response)
+                return response
+            print(f"模型服务 {self.name} 调用失败，{delay:.1f} 秒后第 {attempt + 1} 次重试: {str(error)}")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+        data["wait_time"] = round(data["wait_time"], 4)
+        data.update({
+            "rpm": self.requests.capacity or None,
+            "tpm": self.tokens.capacity or None,
+            "requests_available": self.requests.available(),
+            "tokens_available": self.tokens.available(),
+            "breaker": self.breaker.stats(),
+        })
+        return data
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(model_name):
+    """获取模型服务的进程级调用保护，按模型名区分配额"""
+    name = model_name or "default"
+    with _guards_lock:
+        if name not in _guards:
+            limits = LLM_RATE_LIMITS.get(name) or LLM_RATE_LIMITS.get("default") or {}
+            _guards[name] = EndpointGuard(name, rpm=float(limits.get("rpm", LLM_RPM)),
+                                          tpm=float(limits.get("tpm", LLM_TPM)))
+        return _guards[name]
+
+
+def unavailable_retry_after():
+    """
+    所有已使用过的模型服务都处于熔断中时返回最短的剩余熔断时间，用于直接拒绝新任务；否则返回 None
+    """
+    with _guards_lock:
+        guards = list(_guards.values())
+    if not guards:
+        return None
+    remaining = [guard.breaker.retry_after() for guard in guards]
+    return min(remaining) if all(remaining) else None
+
+
+def rate_limit_stats():
+    """各模型服务的限速、重试和熔断状态，用于监控接口"""
+    with _guards_lock:
+        guards = dict(_guards)
+    return {name: guard.stats() for name, guard in guards.items()}
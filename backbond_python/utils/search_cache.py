@@ -0,0 +1,97 @@
+import os
+import re
+import hashlib
+import threading
+
+from utils.disk_cache import DiskCache
+
+# 搜索结果缓存配置
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE", "1") == "1"
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "50000"))
+
+# 查询分类及默认缓存时间（秒），按顺序匹配关键词，可通过 SEARCH_CACHE_TTL_<分类> 覆盖
+#   realtime: 天气、余票等实时信息
+#   hours:    开放时间、门票价格、班次等会变动的信息
+#   listing:  美食、景点推荐、攻略等长期稳定的内容
+QUERY_CLASSES = (
+    ("realtime", ("天气", "实时", "今天", "今日", "余票", "路况"), 3600),
+    ("hours", ("开放时间", "营业时间", "门票", "票价", "价格", "班次", "车次", "航班", "时刻表", "开放"), 6 * 3600),
+    ("listing", ("美食", "小吃", "特色", "推荐", "攻略", "景点", "必去", "必吃", "餐厅", "酒店", "住宿"), 7 * 86400),
+)
+DEFAULT_QUERY_CLASS = "general"
+DEFAULT_QUERY_TTL = 86400
+
+# freshness 参数限定了结果的时效，缓存时间不超过对应的上限
+FRESHNESS_MAX_TTL = {"oneDay": 3 * 3600, "oneWeek": 86400, "oneMonth": 7 * 86400}
+
+
+def normalize_query(query):
+    """规范化查询：统一全角/半角标点、去除空白并转为小写"""
+    text = query.strip().lower()
+    text = text.translate(str.maketrans("，。：；！？（）【】“”‘’", ",.:;!?()[]\"\"''"))
+    return re.sub(r"\s+", "", text)
+
+
+def classify_query(query):
+    """返回 (查询分类, 缓存时间)"""
+    for name, keywords, ttl in QUERY_CLASSES:
+        if any(keyword in query for keyword in keywords):
+            return name, int(os.getenv(f"SEARCH_CACHE_TTL_{name.upper()}", ttl))
+    return DEFAULT_QUERY_CLASS, int(os.getenv(f"SEARCH_CACHE_TTL_{DEFAULT_QUERY_CLASS.upper()}", DEFAULT_QUERY_TTL))
+
+
+class SearchResultCache:
+    """
+    搜索API响应缓存，键为规范化的查询和 freshness，按查询分类设置过期时间
+    只缓存成功的响应（包含 data 字段），按分类统计命中情况
+    """
+    def __init__(self, enabled=SEARCH_CACHE_ENABLED):
+        self.enabled = enabled
+        self.store = DiskCache("search", default_ttl=DEFAULT_QUERY_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+        self.lock = threading.Lock()
+        self.classes = {}
+
+    @staticmethod
+    def make_key(query, freshness):
+        return hashlib.sha256(f"{freshness}:{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _count(self, query_class, field):
+        with self.lock:
+            stats = self.classes.setdefault(query_class, {"hits": 0, "misses": 0, "stored": 0})
+            stats[field] += 1
+
+    def get_or_search(self, query, freshness, search):
+        """命中缓存时直接返回，否则调用 search(query, freshness) 并缓存成功的响应"""
+        if not self.enabled:
+            return search(query, freshness)
+        query_class, ttl = classify_query(normalize_query(query))
+        ttl = min(ttl, FRESHNESS_MAX_TTL.get(freshness, ttl))
+        key = self.make_key(query, freshness)
+        cached = self.store.get(key)
+        if cached is not None:
+            self._count(query_class, "hits")
+            return cached
+        self._count(query_class, "misses")
+        response = search(query, freshness)
+        if isinstance(response, dict) and response.get("data"):
+            self.store.set(key, response, ttl=ttl)
+            self._count(query_class, "stored")
+        return response
+
+    def stats(self):
+        with self.lock:
+            classes = {name: dict(stats) for name, stats in self.classes.items()}
+        for stats in classes.values():
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        hits = sum(stats["hits"] for stats in classes.values())
+        lookups = hits + sum(stats["misses"] for stats in classes.values())
+        return {
+            "enabled": self.enabled,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "classes": classes,
+            "disk": self.store.stats(),
+        }
+
+
+search_cache = SearchResultCache()
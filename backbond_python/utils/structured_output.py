@@ -0,0 +1,172 @@
+import os
+import json
+import threading
+
+# 结构化输出模式：
+#   json_schema（默认）: 使用 response_format 的 JSON Schema，服务端不支持时自动降级到 json_object
+#   json_object: 只要求输出合法 JSON（如 DeepSeek 的 JSON 模式）
+#   off: 不使用结构化输出，按文本解析
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "json_schema").lower()
+STRUCTURED_MODES = ("json_schema", "json_object")
+
+_NUMBER = {"type": "number"}
+_STRING = {"type": "string"}
+
+# 各智能体输出的 JSON Schema，与 roleplay 中提示词的输出格式示例一致
+OUTPUT_SCHEMAS = {
+    "safety_verdict": {
+        "type": "object",
+        "properties": {
+            "is_allowed": {"type": "boolean"},
+            "category": _STRING,
+            "reason": _STRING,
+        },
+        "required": ["is_allowed", "category", "reason"],
+    },
+    "budget": {
+        "type": "object",
+        "properties": {
+            "total_estimated_cost": _NUMBER,
+            "daily_estimated_cost": _NUMBER,
+            "breakdown": {
+                "type": "object",
+                "properties": {key: _NUMBER for key in
+                               ("accommodation", "transport", "food", "attractions", "shopping", "miscellaneous")},
+            },
+            "saving_tips": {"type": "array", "items": _STRING},
+        },
+        "required": ["total_estimated_cost", "daily_estimated_cost", "breakdown"],
+    },
+    "tasks": {
+        "type": "object",
+        "properties": {
+            "tasks": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": _STRING,
+                        "type": {"type": "string", "enum": ["budget", "attraction", "traffic", "dining", "hotel", "plan"]},
+                        "description": _STRING,
+                        "priority": {"type": "string", "enum": ["high", "medium", "low"]},
+                    },
+                    "required": ["name", "type", "description"],
+                },
+            },
+        },
+        "required": ["tasks"],
+    },
+    "daily_plans": {
+        "type": "object",
+        "properties": {
+            "daily_plans": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "day": {"type": "integer"},
+                        "date": _STRING,
+                        "activities": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "time": _STRING,
+                                    "activity": _STRING,
+                                    "location": _STRING,
+                                    "duration": _NUMBER,
+                                    "cost": _NUMBER,
+                                },
+                                "required": ["time", "activity", "location"],
+                            },
+                        },
+                        "accommodation": _STRING,
+                        "total_day_cost": _NUMBER,
+                        "transport_cost": _NUMBER,
+                    },
+                    "required": ["day", "date", "activities"],
+                },
+            },
+            "total_cost": _NUMBER,
+            "accommodation_cost": _NUMBER,
+            "attractions": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"name": _STRING, "description": _STRING, "price": _NUMBER},
+                    "required": ["name"],
+                },
+            },
+            "transport": {"type": "object", "properties": {"local": _STRING}},
+        },
+        "required": ["daily_plans"],
+    },
+}
+
+
+def response_format(schema_name, mode):
+    """生成 OpenAI 兼容接口的 response_format 参数"""
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema_name, "schema": OUTPUT_SCHEMAS[schema_name], "strict": False},
+    }
+
+
+def is_unsupported_error(error):
+    """判断异常是否为服务端不支持 response_format（而不是普通的调用失败）"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    text = str(error).lower()
+    mentions_format = "response_format" in text or "json_schema" in text or "json_object" in text
+    return mentions_format and (status_code in (400, 422, None) or "not support" in text or "unsupported" in text)
+
+
+class StructuredOutputSupport:
+    """
+    记录各模型支持的结构化输出模式
+    某个模型返回"不支持"后，本进程内不再对它尝试该模式
+    """
+    def __init__(self, mode=STRUCTURED_OUTPUT):
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.unsupported = set()
+        self.counters = {"structured": 0, "parse_fallback": 0, "unsupported": 0}
+
+    @property
+    def enabled(self):
+        return self.mode in STRUCTURED_MODES
+
+    def modes_for(self, model_name):
+        """按优先级返回该模型可以尝试的模式"""
+        if not self.enabled:
+            return []
+        modes = STRUCTURED_MODES[STRUCTURED_MODES.index(self.mode):]
+        with self.lock:
+            return [mode for mode in modes if (model_name, mode) not in self.unsupported]
+
+    def mark_unsupported(self, model_name, mode, error):
+        print(f"模型 {model_name} 不支持结构化输出模式 {mode}，降级处理: {str(error)}")
+        with self.lock:
+            self.unsupported.add((model_name, mode))
+            self.counters["unsupported"] += 1
+
+    def parse(self, content):
+        """解析结构化输出；内容不是 JSON 对象时返回 None，由调用方使用原有的文本解析"""
+        try:
+            data = json.loads(content)
+        except (TypeError, json.JSONDecodeError):
+            data = None
+        with self.lock:
+            self.counters["structured" if isinstance(data, dict) else "parse_fallback"] += 1
+        return data if isinstance(data, dict) else None
+
+    def stats(self):
+        with self.lock:
+            return {"mode": self.mode, "unsupported_models": sorted(f"{model}:{mode}" for model, mode in self.unsupported),
+                    **self.counters}
+
+
+structured_output = StructuredOutputSupport()
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 链路追踪配置
+TRACE_DIR = os.getenv("TRACE_DIR", "./traces")
+# 导出格式，逗号分隔：json（本地格式）、otlp（OTLP/JSON 格式，可导入 Jaeger/Tempo 等）
+TRACE_EXPORT = [fmt.strip() for fmt in os.getenv("TRACE_EXPORT", "json,otlp").split(",") if fmt.strip()]
+TRACE_MAX_IN_MEMORY = int(os.getenv("TRACE_MAX_IN_MEMORY", "200"))
+
+# 当前线程/协程所在的 span，通过 contextvars 在线程池之间传递
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一次耗时操作的记录"""
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.thread = threading.current_thread().name
+        self.start_time = time.time()
+        self.end_time = None
+        self.status = "ok"
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        self.end_time = time.time()
+        if error is not None:
+            self.status = "error"
+            self.error = str(error)
+
+    @property
+    def duration(self):
+        end = self.end_time if self.end_time is not None else time.time()
+        return end - self.start_time
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "thread": self.thread,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": round(self.duration, 4),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """一个任务（task_id）对应的全部 span"""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.end_time = None
+
+    def add_span(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self.lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": round((self.end_time or time.time()) - self.start_time, 4),
+            "spans": spans,
+        }
+
+    def to_otlp(self):
+        """转换为 OTLP/JSON（ExportTraceServiceRequest）格式"""
+        otlp_trace_id = uuid.uuid5(uuid.NAMESPACE_URL, str(self.trace_id)).hex
+        with self.lock:
+            spans = list(self.spans)
+        otlp_spans = []
+        for span in spans:
+            otlp_span = {
+                "traceId": otlp_trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(int(span.start_time * 1e9)),
+                "endTimeUnixNano": str(int((span.end_time or time.time()) * 1e9)),
+                "attributes": [
+                    {"key": key, "value": {"stringValue": value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)}}
+                    for key, value in span.attributes.items()
+                ] + [{"key": "thread.name", "value": {"stringValue": span.thread}}],
+                "status": {"code": 2, "message": span.error} if span.status == "error" else {"code": 1},
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            otlp_spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": "travel_agent"}},
+                    {"key": "task.id", "value": {"stringValue": str(self.trace_id)}},
+                ]},
+                "scopeSpans": [{"scope": {"name": "utils.tracing"}, "spans": otlp_spans}],
+            }]
+        }
+
+
+class Tracer:
+    """
+    进程内链路追踪器
+    每个 task_id 对应一个 Trace，span 通过 contextvars 自动嵌套
+    """
+
+    def __init__(self, trace_dir=TRACE_DIR, export_formats=TRACE_EXPORT, max_in_memory=TRACE_MAX_IN_MEMORY):
+        self.trace_dir = trace_dir
+        self.export_formats = export_formats
+        self.max_in_memory = max_in_memory
+        self.traces = OrderedDict()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def start_trace(self, trace_id, **attributes):
+        """为一个任务开启追踪，退出时导出到本地文件"""
+        trace = Trace(trace_id)
+        with self.lock:
+            self.traces[trace_id] = trace
+            while len(self.traces) > self.max_in_memory:
+                self.traces.popitem(last=False)
+        root = Span(trace, "task", attributes=attributes)
+        trace.add_span(root)
+        token = _current_span.set(root)
+        error = None
+        try:
+            yield trace
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            root.finish(error)
+            trace.end_time = root.end_time
+            _current_span.reset(token)
+            self.export(trace)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        记录一个子 span；当前上下文没有追踪时不做任何记录
+        """
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(parent.trace, name, parent_id=parent.span_id, attributes=attributes)
+        parent.trace.add_span(span)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            span.finish(error)
+            _current_span.reset(token)
+
+    def current_trace_id(self):
+        span = _current_span.get()
+        return span.trace.trace_id if span is not None else None
+
+    def export(self, trace):
+        """将追踪结果导出为 JSON / OTLP 文件"""
+        if not self.export_formats:
+            return
+        try:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            if "json" in self.export_formats:
+                with open(os.path.join(self.trace_dir, f"{trace.trace_id}.json"), "w", encoding="utf-8") as f:
+                    json.dump(trace.to_dict(), f, ensure_ascii=False, indent=2, default=str)
+            if "otlp" in self.export_formats:
+                with open(os.path.join(self.trace_dir, f"{trace.trace_id}.otlp.json"), "w", encoding="utf-8") as f:
+                    json.dump(trace.to_otlp(), f, ensure_ascii=False, default=str)
+        except OSError as e:
+            print(f"追踪导出失败: {str(e)}")
+
+    def get_trace(self, trace_id):
+        """获取追踪结果，优先取内存中的，其次读取导出的文件"""
+        with self.lock:
+            trace = self.traces.get(trace_id)
+        if trace is not None:
+            return trace.to_dict()
+        path = os.path.join(self.trace_dir, f"{trace_id}.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+
+tracer = Tracer()
+
+
+def traced(name=None, **static_attributes):
+    """
+    装饰器：为函数调用记录 span，并把参数记录为 span 属性
+    使用 functools.wraps 保留函数签名和文档，可直接用于 LangChain 工具
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            attributes = dict(static_attributes)
+            if args:
+                attributes["args"] = [str(arg)[:200] for arg in args]
+            if kwargs:
+                attributes["kwargs"] = {key: str(value)[:200] for key, value in kwargs.items()}
+            with tracer.span(span_name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """
+    向线程池提交任务时携带当前上下文，使子线程中的 span 挂在当前 span 之下
+    """
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
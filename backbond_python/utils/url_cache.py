@@ -0,0 +1,166 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from utils.disk_cache import DiskCache
+
+# 网页内容缓存配置
+URL_CACHE_ENABLED = os.getenv("URL_CACHE", "1") == "1"
+# 内容在 URL_CACHE_TTL 秒内直接使用；过期后带 ETag / Last-Modified 重新验证，未修改时继续使用
+URL_CACHE_TTL = int(os.getenv("URL_CACHE_TTL", "86400"))
+# 过期条目在磁盘上保留的时间（用于重新验证），超过后删除
+URL_CACHE_RETAIN = int(os.getenv("URL_CACHE_RETAIN", str(7 * 86400)))
+URL_CACHE_MEMORY_SIZE = int(os.getenv("URL_CACHE_MEMORY_SIZE", "512"))
+URL_CACHE_MAX_ENTRIES = int(os.getenv("URL_CACHE_MAX_ENTRIES", "50000"))
+
+# 规范化时去掉的跟踪参数
+_TRACKING_PARAMS = ("utm_", "spm", "from_source", "share_token")
+
+
+def normalize_url(url):
+    """
+    规范化URL作为缓存键：协议和域名小写、去掉默认端口、片段和跟踪参数，查询参数排序
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(":", 1)[-1]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith(_TRACKING_PARAMS))
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(query), ""))
+
+
+class _Flight:
+    """正在进行的一次下载，等待的调用直接使用其结果或异常"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class UrlContentCache:
+    """
+    网页内容缓存：进程内 LRU + 磁盘（utils.disk_cache）
+    同一URL同时只有一个请求在下载，其余调用等待并共享其结果（包括失败）；下载失败的结果不缓存
+    """
+    def __init__(self, enabled=URL_CACHE_ENABLED, ttl=URL_CACHE_TTL, memory_size=URL_CACHE_MEMORY_SIZE):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.store = DiskCache("url_content", default_ttl=URL_CACHE_RETAIN, max_entries=URL_CACHE_MAX_ENTRIES)
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "revalidated": 0, "fetches": 0, "waited": 0}
+
+    @staticmethod
+    def make_key(url):
+        return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+    def _count(self, field):
+        with self.lock:
+            self.counters[field] += 1
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_size:
+                self.memory.popitem(last=False)
+
+    def _lookup(self, key):
+        """返回 (条目, 是否仍在有效期内)，优先读内存"""
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+        if entry is None:
+            entry = self.store.get(key)
+            if entry is None:
+                return None, False
+            self._remember(key, entry)
+            field = "disk_hits"
+        else:
+            field = "memory_hits"
+        fresh = entry["fetched_at"] + self.ttl > time.time()
+        if fresh:
+            self._count(field)
+        return entry, fresh
+
+    def _save(self, key, entry):
+        self._remember(key, entry)
+        self.store.set(key, entry)
+
+    def get_or_fetch(self, url, fetch):
+        """
+        返回URL的内容（与 fetch 的返回值结构相同）
+        fetch(url, validators=None) 负责下载，validators 为重新验证时的 {"etag", "last_modified"}；
+        服务端返回 304 时 fetch 应返回 {"not_modified": True}
+        """
+        if not self.enabled:
+            return fetch(url)
+        key = self.make_key(url)
+        entry, fresh = self._lookup(key)
+        if fresh:
+            return entry["content"]
+
+        with self.lock:
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = _Flight()
+        if not leader:
+            # 其他线程正在下载同一个URL，等待后直接使用其结果；下载失败时也不再重复请求
+            flight.event.wait()
+            self._count("waited")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._fetch(key, url, entry, fetch)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            flight.event.set()
+
+    def _fetch(self, key, url, entry, fetch):
+        validators = None
+        if entry is not None and (entry.get("etag") or entry.get("last_modified")):
+            validators = {"etag": entry.get("etag"), "last_modified": entry.get("last_modified")}
+        self._count("fetches")
+        # 不需要重新验证时只传 URL，与录制/回放的请求保持一致
+        result = fetch(url, validators) if validators else fetch(url)
+        if validators and result.get("not_modified"):
+            self._count("revalidated")
+            self._save(key, dict(entry, fetched_at=time.time()))
+            return entry["content"]
+        if result.get("error") or result.get("not_modified"):
+            return result
+        self._save(key, {
+            "content": result,
+            "etag": result.get("etag"),
+            "last_modified": result.get("last_modified"),
+            "fetched_at": time.time(),
+        })
+        return result
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters, memory_entries=len(self.memory), enabled=self.enabled)
+        # 重新验证（304）属于下载请求，但没有重新传输内容，计为命中
+        lookups = data["memory_hits"] + data["disk_hits"] + data["fetches"]
+        data["hit_rate"] = round((data["memory_hits"] + data["disk_hits"] + data["revalidated"]) / lookups, 4) if lookups else None
+        data["disk"] = self.store.stats()
+        return data
+
+
+url_cache = UrlContentCache()
@@ -0,0 +1,150 @@
+import os
+import json
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from utils.tracing import tracer
+
+# 模型单价（每百万 token），JSON 格式：{"模型名": {"input": 2.0, "output": 8.0, "cached_input": 0.5}}
+# 未配置单价的模型只统计 token 数，不计算费用
+LLM_PRICES = json.loads(os.getenv("LLM_PRICES", "{}") or "{}")
+# 内存中保留用量明细的任务数
+USAGE_MAX_TASKS = int(os.getenv("USAGE_MAX_TASKS", "1000"))
+
+# 当前所在的流水线阶段，由 StageRunner 设置，通过 contextvars 传递到线程池和协程中
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+# 不在任何阶段内的调用（如单景点接口）归入该阶段
+UNSTAGED = "unstaged"
+
+
+def extract_usage(response):
+    """
+    从模型响应中取出 token 用量 {"input", "output", "total", "cached"}
+    兼容 langchain 的 usage_metadata 以及 OpenAI / DeepSeek 返回的原始 token_usage；
+    服务端没有返回缓存信息时 cached 为 None
+    """
+    usage = getattr(response, "usage_metadata", None) or {}
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    cached = (usage.get("input_token_details") or {}).get("cache_read")
+    if cached is None:
+        cached = token_usage.get("prompt_cache_hit_tokens")
+    if cached is None:
+        cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    input_tokens = usage.get("input_tokens") or token_usage.get("prompt_tokens") or 0
+    output_tokens = usage.get("output_tokens") or token_usage.get("completion_tokens") or 0
+    total_tokens = usage.get("total_tokens") or token_usage.get("total_tokens") or input_tokens + output_tokens
+    return {"input": input_tokens, "output": output_tokens, "total": total_tokens, "cached": cached}
+
+
+def estimate_cost(model, usage):
+    """按 LLM_PRICES 计算费用，未配置单价时返回 None"""
+    price = LLM_PRICES.get(model) or LLM_PRICES.get("default")
+    if not price:
+        return None
+    cached = usage.get("cached") or 0
+    cached_price = price.get("cached_input", price.get("input", 0))
+    return ((usage["input"] - cached) * price.get("input", 0)
+            + cached * cached_price
+            + usage["output"] * price.get("output", 0)) / 1_000_000
+
+
+def _empty():
+    return {"calls": 0, "cache_hits": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+            "cached_tokens": 0, "cost": 0.0}
+
+
+def _add(bucket, usage, cost):
+    bucket["calls"] += 1
+    bucket["input_tokens"] += usage["input"]
+    bucket["output_tokens"] += usage["output"]
+    bucket["total_tokens"] += usage["total"]
+    bucket["cached_tokens"] += usage.get("cached") or 0
+    bucket["cost"] += cost or 0.0
+
+
+def _rounded(bucket):
+    return dict(bucket, cost=round(bucket["cost"], 6))
+
+
+class UsageTracker:
+    """
+    统计每次LLM调用的 token 用量和费用
+    按智能体、阶段（多档位的 "<档位>.<阶段>" 按阶段名汇总）和任务（trace id）聚合
+    """
+    def __init__(self, max_tasks=USAGE_MAX_TASKS):
+        self.lock = threading.Lock()
+        self.max_tasks = max_tasks
+        self.totals = _empty()
+        self.by_agent = {}
+        self.by_stage = {}
+        self.by_model = {}
+        self.tasks = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        """标记当前代码所在的阶段"""
+        token = _current_stage.set(name)
+        try:
+            yield
+        finally:
+            _current_stage.reset(token)
+
+    def record(self, agent_name, model, response, cache_hit=False):
+        """
+        记录一次模型调用，返回本次用量
+        命中本地LLM响应缓存的调用不产生费用，只计入 cache_hits
+        """
+        stage = _current_stage.get() or UNSTAGED
+        task_id = tracer.current_trace_id()
+        usage = extract_usage(response)
+        cost = None if cache_hit else estimate_cost(model, usage)
+        with self.lock:
+            task = None
+            if task_id:
+                if task_id not in self.tasks:
+                    self.tasks[task_id] = {"totals": _empty(), "agents": {}, "stages": {}}
+                    while len(self.tasks) > self.max_tasks:
+                        self.tasks.popitem(last=False)
+                task = self.tasks[task_id]
+            buckets = [
+                self.by_agent.setdefault(agent_name, _empty()),
+                self.by_stage.setdefault(stage.rsplit(".", 1)[-1], _empty()),
+                self.by_model.setdefault(model or "unknown", _empty()),
+            ]
+            if task is not None:
+                buckets += [task["totals"], task["agents"].setdefault(agent_name, _empty()),
+                            task["stages"].setdefault(stage, _empty())]
+            for bucket in [self.totals] + buckets:
+                if cache_hit:
+                    bucket["cache_hits"] += 1
+                else:
+                    _add(bucket, usage, cost)
+        return dict(usage, cost=cost, stage=stage)
+
+    def task_usage(self, task_id):
+        """任务的用量明细，没有记录时返回 None"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None
+            return {
+                "totals": _rounded(task["totals"]),
+                "agents": {name: _rounded(bucket) for name, bucket in task["agents"].items()},
+                "stages": {name: _rounded(bucket) for name, bucket in task["stages"].items()},
+            }
+
+    def stats(self):
+        with self.lock:
+            return {
+                "totals": _rounded(self.totals),
+                "agents": {name: _rounded(bucket) for name, bucket in self.by_agent.items()},
+                "stages": {name: _rounded(bucket) for name, bucket in self.by_stage.items()},
+                "models": {name: _rounded(bucket) for name, bucket in self.by_model.items()},
+                "priced_models": sorted(LLM_PRICES),
+            }
+
+
+usage_tracker = UsageTracker()